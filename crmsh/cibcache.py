@@ -0,0 +1,104 @@
+# Results of the CLI validation of CIB objects, kept on disk for
+# CIBs read from files (shadow CIBs or CIB_file). Checking
+# whether an object can be shown in the CLI notation takes a
+# conversion to CLI and back for every object and makes most of
+# the time spent loading a large CIB. A file which did not change
+# since the last run need not be checked again.
+
+import hashlib
+import json
+import os
+
+from . import config
+from . import userdir
+from . import utils
+from .msg import common_debug
+
+
+_CACHE_VERSION = 1
+_cache_dir = os.path.join(userdir.CACHE_HOME, "cib")
+
+
+def cib_file():
+    '''
+    The file holding the CIB in use, None for the live CIB.
+    '''
+    name = utils.get_cib_in_use()
+    if name:
+        from .xmlutil import shadowfile
+        return shadowfile(name)
+    return os.getenv("CIB_file")
+
+
+def _cache_file(path):
+    h = hashlib.sha1(path.encode('utf-8')).hexdigest()
+    return os.path.join(_cache_dir, h + ".json")
+
+
+def _key(path, cib_elem):
+    '''
+    The file and the CIB version: the cached results are good
+    only for exactly this file contents and this crmsh.
+    '''
+    if not os.path.isfile(path):
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [path, st.st_mtime_ns, st.st_size, config.CRM_VERSION] + \
+        [cib_elem.get(a) for a in ("admin_epoch", "epoch", "num_updates", "validate-with")]
+
+
+def _lookup(cib_elem):
+    path = cib_file()
+    if not path or not config.core.cib_cache:
+        return None, None
+    path = os.path.realpath(path)
+    return path, _key(path, cib_elem)
+
+
+def load(cib_elem):
+    '''
+    The (xml tag, id) pairs of the objects which cannot be
+    represented in the CLI notation, or None if there are no
+    valid results for this CIB.
+    '''
+    path, key = _lookup(cib_elem)
+    if key is None:
+        return None
+    try:
+        with open(_cache_file(path)) as f:
+            obj = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if not isinstance(obj, dict) or obj.get("version") != _CACHE_VERSION or obj.get("key") != key:
+        return None
+    common_debug("CLI validation results for %s found in the cache" % (path))
+    return set(tuple(x) for x in obj["nocli"])
+
+
+def save(cib_elem, nocli):
+    '''
+    Store the (xml tag, id) pairs of the objects which cannot
+    be represented in the CLI notation.
+    '''
+    path, key = _lookup(cib_elem)
+    if key is None:
+        return
+    fn = _cache_file(path)
+    tmp = "%s.%d" % (fn, os.getpid())
+    try:
+        utils.mkdirp(_cache_dir, mode=0o700)
+        with open(tmp, 'wt') as f:
+            json.dump({"version": _CACHE_VERSION, "key": key, "nocli": sorted(nocli)}, f)
+        os.replace(tmp, fn)
+    except (IOError, OSError) as e:
+        common_debug("cannot save the CLI validation results to %s: %s" % (fn, e))
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+
+# vim:ts=4:sw=4:et:
@@ -8,6 +8,7 @@ import re
 import fnmatch
 import time
 import collections
+import heapq
 from lxml import etree
 from . import config
 from . import options
@@ -22,37 +23,46 @@ from . import parse
 from . import ordereddict
 from . import orderedset
 from . import cibstatus
+from . import cibcache
 from . import crm_gv
 from . import ui_utils
 from . import userdir
-from .ra import get_ra, get_properties_list, get_pe_meta, get_properties_meta
+from .ra import get_ra, get_properties_list, get_pe_meta, get_properties_meta, prefetch_meta
 from .msg import common_warn, common_err, common_debug, common_info, err_buf
 from .msg import common_error, constraint_norefobj_err, cib_parse_err, no_object_err
 from .msg import missing_obj_err, common_warning, update_err, unsupported_err, empty_cib_err
 from .msg import invalid_id_err, cib_ver_unsupported_err
 from .utils import ext_cmd, safe_open_w, pipe_string, safe_close_w, crm_msec
 from .utils import ask, lines2cli, olist
-from .utils import page_string, cibadmin_can_patch, str2tmp, ensure_sudo_readable
+from .utils import page_gen_lines, cibadmin_can_patch, str2tmp, ensure_sudo_readable
+from .utils import cibadmin_can_patch_v2
 from .utils import run_ptest, is_id_valid, edit_file, get_boolean, filter_string
 from .xmlutil import is_child_rsc, rsc_constraint, sanitize_cib, rename_id, get_interesting_nodes
 from .xmlutil import is_pref_location, get_topnode, new_cib, get_rscop_defaults_meta_node
-from .xmlutil import rename_rscref, is_ms, silly_constraint, is_container, fix_comments
+from .xmlutil import rename_rscref, rename_refs, is_ms, silly_constraint, is_container, fix_comments
 from .xmlutil import sanity_check_nvpairs, merge_nodes, op2list, mk_rsc_type, is_resource
 from .xmlutil import stuff_comments, is_comment, is_constraint, read_cib, processing_sort_cli
 from .xmlutil import find_operation, get_rsc_children_ids, is_primitive, referenced_resources
-from .xmlutil import cibdump2elem, processing_sort, get_rsc_ref_ids, merge_tmpl_into_prim
+from .xmlutil import processing_sort, get_rsc_ref_ids, merge_tmpl_into_prim
 from .xmlutil import remove_id_used_attributes, get_top_cib_nodes
 from .xmlutil import merge_attributes, is_cib_element, sanity_check_meta
 from .xmlutil import is_simpleconstraint, is_template, rmnode, is_defaults, is_live_cib
-from .xmlutil import get_rsc_operations, delete_rscref, xml_equals, lookup_node, RscState
-from .xmlutil import cibtext2elem, is_related, check_id_ref, xml_tostring
-from .xmlutil import sanitize_cib_for_patching
+from .xmlutil import get_rsc_operations, delete_rscref, xml_digest, lookup_node, RscState
+from .xmlutil import cibtext2elem, is_related, check_id_ref, xml_tostring, xml_show_difference
+from .xmlutil import sanitize_cib_for_patching, related_ids, cib_patchset, cibversion2elem
+from .xmlutil import cibdump2elem_nostatus, cib_query_cache_clear
 from .cliformat import get_score, nvpairs2list, abs_pos_score, cli_acl_roleref, nvpair_format
 from .cliformat import cli_nvpair, cli_acl_rule, rsc_set_constraint, get_kind, head_id_format
 from .cliformat import simple_rsc_constraint, cli_rule, cli_format
 from .cliformat import cli_acl_role, cli_acl_permission, cli_path
 
 
+# create at least this many objects at once to take the bulk path
+_BULK_CREATE_MIN = 100
+# parse at least this many lines at once to use worker processes
+_PARALLEL_PARSE_MIN = 1000
+
+
 def show_unrecognized_elems(cib_elem):
     try:
         conf = cib_elem.findall("configuration")[0]
@@ -349,12 +359,14 @@ class CibObjectSet(object):
         if not f:
             return False
         rc = True
+        written = False
         with clidisplay.nopretty():
-            s = self.repr()
-        if s:
-            f.write(s)
-            f.write('\n')
-        elif self.obj_set:
+            for s in self.repr_gen():
+                if s:
+                    f.write(s)
+                    f.write('\n')
+                    written = True
+        if not written and self.obj_set:
             rc = False
         safe_close_w(f)
         return rc
@@ -417,9 +429,7 @@ class CibObjectSet(object):
         return gv_obj.save(outf)
 
     def show(self):
-        s = self.repr()
-        if s:
-            page_string(s)
+        page_gen_lines(self.repr_gen())
         return self.search_rc
 
     def import_file(self, method, fname):
@@ -446,6 +456,15 @@ class CibObjectSet(object):
         '''
         return ''
 
+    def repr_gen(self, format_mode=0):
+        '''
+        Generate the representation piecewise, for show and
+        save. By default it is all in one piece.
+        '''
+        s = self.repr(format_mode=format_mode)
+        if s:
+            yield s
+
     def save(self, s, remove=True, method='replace'):
         '''
         For each object:
@@ -460,32 +479,26 @@ class CibObjectSet(object):
 
     def _check_unique_clash(self, set_obj_all):
         'Check whether resource parameters with attribute "unique" clash'
-        def process_primitive(prim, clash_dict):
+        unique_params = {}
+
+        def agent_unique_params(r_node):
             '''
-            Update dict clash_dict with
-            (ra_class, ra_provider, ra_type, name, value) -> [ resourcename ]
-            if parameter "name" should be unique
+            The agent (class, provider, type) of a primitive and
+            the names of its parameters which should be unique.
+            Looked up once per agent.
             '''
-            ra_id = prim.get("id")
-            r_node = reduce_primitive(prim)
-            if r_node is None:
-                return  # template not defined yet
-            ra_type = node.get("type")
-            ra_class = node.get("class")
-            ra_provider = node.get("provider")
-            ra = get_ra(r_node)
-            if ra.mk_ra_node() is None:  # no RA found?
-                return
-            ra_params = ra.params()
-            for p in r_node.xpath("./instance_attributes/nvpair"):
-                name, value = p.get("name"), p.get("value")
-                if value is None:
-                    continue
-                # don't fail if the meta-data doesn't contain the
-                # expected attributes
-                if name in ra_params and ra_params[name].get("unique") == "1":
-                    clash_dict[(ra_class, ra_provider, ra_type, name, value)].append(ra_id)
-            return
+            agent = (r_node.get("class"), r_node.get("provider"), r_node.get("type"))
+            if agent not in unique_params:
+                names = frozenset()
+                ra = get_ra(r_node)
+                if ra.mk_ra_node() is not None:  # no RA found?
+                    # don't fail if the meta-data doesn't contain the
+                    # expected attributes
+                    names = frozenset(name for name, attrs in ra.params().items()
+                                      if attrs.get("unique") == "1")
+                unique_params[agent] = names
+            return agent, unique_params[agent]
+
         # we check the whole CIB for clashes as a clash may originate between
         # an object already committed and a new one
         check_set = set([o.obj_id
@@ -493,11 +506,21 @@ class CibObjectSet(object):
                          if o.obj_type == "primitive"])
         if not check_set:
             return 0
+        # (ra_class, ra_provider, ra_type, name, value) -> [ resourcename ]
         clash_dict = collections.defaultdict(list)
         for obj in set_obj_all.obj_set:
-            node = obj.node
-            if is_primitive(node):
-                process_primitive(node, clash_dict)
+            if not is_primitive(obj.node):
+                continue
+            r_node = reduce_primitive(obj.node)
+            if r_node is None:
+                continue  # template not defined yet
+            agent, names = agent_unique_params(r_node)
+            if not names:
+                continue
+            for p in r_node.xpath("./instance_attributes/nvpair"):
+                name, value = p.get("name"), p.get("value")
+                if value is not None and name in names:
+                    clash_dict[agent + (name, value)].append(obj.node.get("id"))
         # but we only warn if a 'new' object is involved
         rc = 0
         for param, resources in list(clash_dict.items()):
@@ -513,12 +536,110 @@ class CibObjectSet(object):
         '''
         Test objects for sanity. This is about semantics.
         '''
+        objs = set(self.obj_set)
+        if any(o.obj_type == "primitive" for o in objs):
+            objs.update(set_obj_all.obj_set)  # see _check_unique_clash
+        prefetch_ra_meta(o.node for o in sorted(objs, key=lambda x: x.obj_id))
         rc = self._check_unique_clash(set_obj_all)
         for obj in sorted(self.obj_set, key=lambda x: x.obj_id):
             rc |= obj.check_sanity()
         return rc
 
 
+def _parse_chunk(chunk):
+    """
+    Parse (line number, line) pairs in a worker process. The
+    elements are returned serialized along with the messages
+    made while parsing them, which the parent shows in order.
+    """
+    err_buf.buffer()
+    out = []
+    for lineno, cli_text in chunk:
+        err_buf.lineno = lineno
+        node = parse.parse(cli_text, comments=[])
+        if isinstance(node, etree._Element):
+            node = etree.tostring(node)
+        out.append((node, err_buf.msg_list))
+        err_buf.msg_list = []
+    return out
+
+
+def _parse_parallel(lines, workers):
+    """
+    Parse the lines which do not depend on the parser state in
+    worker processes. Returns a dict from the line index to the
+    (result, messages) pair or None if the workers could not be
+    used. Lines missing from the dict (e.g. of a chunk which
+    failed in the worker) are to be parsed by the caller. The
+    workers are forked, so that they see the same configuration
+    and CIB as the parent.
+    """
+    import multiprocessing
+    import concurrent.futures
+    try:
+        ctx = multiprocessing.get_context('fork')
+    except ValueError:
+        return None
+    # comments are kept for the next element and id-refs are
+    # resolved by the factory: these lines are left to the parent
+    todo = [i for i, l in enumerate(lines)
+            if not l.startswith('#') and 'id-ref' not in l.lower()]
+    base = err_buf.lineno
+    chunksize = max(1, len(todo) // (workers * 4))
+    chunks = [todo[n:n + chunksize] for n in range(0, len(todo), chunksize)]
+    try:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+    except TypeError:
+        # no mp_context before Python 3.7
+        return None
+    sys.stdout.flush()
+    sys.stderr.flush()
+    parsed = {}
+    try:
+        with pool:
+            futures = [pool.submit(_parse_chunk,
+                                   [(base + i + 1 if base >= 0 else base, lines[i]) for i in chunk])
+                       for chunk in chunks]
+            for chunk, future in zip(chunks, futures):
+                try:
+                    parsed.update(zip(chunk, future.result()))
+                except Exception as e:
+                    common_debug("parsing lines %d-%d in a worker process failed: %s" %
+                                 (chunk[0] + 1, chunk[-1] + 1, e))
+    except OSError as e:
+        common_debug("cannot parse in worker processes: %s" % (e))
+        return None
+    return parsed
+
+
+def parse_lines(lines):
+    """
+    Parse CLI lines, one element (or None or False) for each
+    line, in order. Large inputs are parsed by up to
+    core.parse_workers processes.
+    """
+    try:
+        workers = min(int(config.core.parse_workers), os.cpu_count() or 1)
+    except ValueError:
+        workers = 1
+    parsed = None
+    if workers > 1 and len(lines) >= _PARALLEL_PARSE_MIN:
+        parsed = _parse_parallel(lines, workers)
+    comments = []
+    for i, cli_text in enumerate(lines):
+        err_buf.incr_lineno()
+        if parsed is None or i not in parsed:
+            yield parse.parse(cli_text, comments=comments)
+            continue
+        node, msgs = parsed[i]
+        for msg in msgs:
+            err_buf.writemsg(msg)
+        if isinstance(node, bytes):
+            node = etree.fromstring(node)
+            parse.add_comments(node, comments)
+        yield node
+
+
 class CibObjectSetCli(CibObjectSet):
     '''
     Edit or display a set of cib objects (using cli notation).
@@ -534,10 +655,14 @@ class CibObjectSetCli(CibObjectSet):
 
     def repr(self, format_mode=1):
         "Return a string containing cli format of all objects."
+        return '\n'.join(self.repr_gen(format_mode=format_mode))
+
+    def repr_gen(self, format_mode=1):
+        "Generate cli format of the objects, one at a time."
         if not self.obj_set:
-            return ''
-        return '\n'.join(obj.repr_cli(format_mode=format_mode)
-                         for obj in processing_sort_cli(list(self.obj_set)))
+            return
+        for obj in processing_sort_cli(list(self.obj_set)):
+            yield obj.repr_cli(format_mode=format_mode)
 
     def _pre_edit(self, s):
         '''Extra processing of the string to be edited'''
@@ -575,10 +700,7 @@ class CibObjectSetCli(CibObjectSet):
         diff = CibDiff(self)
         rc = True
         err_buf.start_tmp_lineno()
-        comments = []
-        for cli_text in lines2cli(s):
-            err_buf.incr_lineno()
-            node = parse.parse(cli_text, comments=comments)
+        for node in parse_lines(list(lines2cli(s))):
             if node not in (False, None):
                 rc = rc and diff.add(node)
             elif node is False:
@@ -848,32 +970,108 @@ class CibObject(object):
     '''
     The top level object of the CIB. Resources and constraints.
     '''
+    __slots__ = ("obj_type", "xml_obj_type", "origin", "_nocli", "_cli_pending",
+                 "nocli_warn", "_updated", "parent", "children", "obj_id",
+                 "node", "_gen", "_cli_cache", "_digest")
     state_fmt = "%16s %-8s%-8s%-8s%-4s"
     set_names = {}
+    _slot_cache = {}
 
     def __init__(self, xml_obj_type):
         if xml_obj_type not in cib_object_map:
             unsupported_err(xml_obj_type)
             return
         self.obj_type = cib_object_map[xml_obj_type][0]
-        self.parent_type = cib_object_map[xml_obj_type][2]
         self.xml_obj_type = xml_obj_type
         self.origin = ""        # where did it originally come from?
-        self.nocli = False      # we don't support this one
+        self._nocli = False     # we don't support this one
+        self._cli_pending = False  # cli_use_validate postponed
         self.nocli_warn = True  # don't issue warnings all the time
-        self.updated = False    # was the object updated
+        self._updated = False   # was the object updated
         self.parent = None      # object superior (group/clone/ms)
         self.children = []      # objects inferior
         self.obj_id = None
         self.node = None
+        self._gen = 0           # bumped whenever the object is updated
+        self._cli_cache = None  # (key, text) of the last repr_cli
+        self._digest = None     # (gen, node, digest) of the last digest
 
     def __str__(self):
         return "%s:%s" % (self.obj_type, self.obj_id)
 
+    @property
+    def parent_type(self):
+        "The tag of the CIB section the object lives in."
+        return cib_object_map[self.xml_obj_type][2]
+
+    @classmethod
+    def slot_names(cls):
+        "Names of all instance attributes (the slots of the class and its bases)."
+        try:
+            return cls._slot_cache[cls]
+        except KeyError:
+            names = tuple(a for c in reversed(cls.__mro__)
+                          for a in c.__dict__.get("__slots__", ()))
+            cls._slot_cache[cls] = names
+            return names
+
+    def save_attrs(self):
+        "The instance attributes as a dict (see restore_attrs)."
+        return dict((a, getattr(self, a)) for a in self.slot_names() if hasattr(self, a))
+
+    def restore_attrs(self, d):
+        for a in self.slot_names():
+            if a in d:
+                setattr(self, a, d[a])
+            elif hasattr(self, a):
+                delattr(self, a)
+
+    @property
+    def updated(self):
+        return self._updated
+
+    @updated.setter
+    def updated(self, value):
+        self._updated = value
+        if value:
+            self.mark_changed()
+
+    def mark_changed(self):
+        '''
+        The XML of the object, and so of its parents, changes:
+        drop their cached CLI text and digests.
+        '''
+        obj = self
+        while obj is not None:
+            obj._gen += 1
+            obj = obj.parent
+
     def set_updated(self):
         self.updated = True
         self.propagate_updated()
 
+    @property
+    def nocli(self):
+        if self._cli_pending:
+            self._cli_pending = False
+            if not self.cli_use_validate():
+                self._nocli = True
+        return self._nocli
+
+    @nocli.setter
+    def nocli(self, value):
+        self._cli_pending = False
+        self._nocli = value
+
+    def postpone_cli_validation(self):
+        '''
+        Run cli_use_validate only once somebody asks whether the
+        object may be shown in the CLI format. Used for bulk
+        loads where most objects are never looked at again.
+        '''
+        self._nocli = False
+        self._cli_pending = True
+
     def dump_state(self):
         'Print object status'
         print(self.state_fmt % (self.obj_id,
@@ -923,9 +1121,41 @@ class CibObject(object):
         'implemented in subclasses'
         pass
 
+    def digest(self):
+        '''
+        Structural digest of the XML (see xmlutil.xml_digest).
+        It is computed again only after the object was updated
+        or got another node. Equal digests mean equal objects.
+        '''
+        d = self._digest
+        if d is None or d[0] != self._gen or d[1] is not self.node:
+            d = self._digest = (self._gen, self.node, xml_digest(self.node))
+        return d[2]
+
+    def _cli_cache_key(self, format_mode):
+        '''
+        Everything the CLI representation depends on: the XML
+        (the node and the update generation), the referenced ids
+        and the display settings.
+        '''
+        return (format_mode, self.nocli, self._gen, self.node,
+                cib_factory.id_refs_serial, clidisplay.display_key(),
+                utils.obscured_patterns())
+
     def repr_cli(self, format_mode=1):
         '''
-        CLI representation for the node.
+        CLI representation for the node. The text is cached
+        until the XML or anything else it depends on changes.
+        '''
+        key = self._cli_cache_key(format_mode)
+        if self._cli_cache is not None and self._cli_cache[0] == key:
+            return self._cli_cache[1]
+        s = self._render_cli(format_mode)
+        self._cli_cache = (key, s)
+        return s
+
+    def _render_cli(self, format_mode):
+        '''
         _repr_cli_head and _repr_cli_child in subclasess.
         '''
         if self.nocli:
@@ -1126,7 +1356,8 @@ class CibObject(object):
                 xml_tostring(self.node),
                 cli_text))
             return False
-        if not xml_equals(self.node, xml2, show=True):
+        if self.digest() != xml_digest(xml2):
+            xml_show_difference(self.node, xml2)
             common_debug("validation failed: %s -> %s -> %s" % (
                 xml_tostring(self.node),
                 cli_text,
@@ -1250,6 +1481,7 @@ class CibNode(CibObject):
     '''
     Node and node's attributes.
     '''
+    __slots__ = ()
     set_names = {
         "instance_attributes": "attributes",
         "utilization": "utilization",
@@ -1300,10 +1532,32 @@ def reduce_primitive(node):
     return merge_tmpl_into_prim(node, template_obj.node)
 
 
+def prefetch_ra_meta(nodes):
+    '''
+    Get the meta-data of all resource agents used by the given
+    primitive and template nodes before checking them one by
+    one.
+    '''
+    ra_l = []
+    for node in nodes:
+        if node is None or node.tag not in ("primitive", "template"):
+            continue
+        template = node.get("template")
+        if template:
+            template_obj = cib_factory.find_object(template)
+            if template_obj is None:
+                continue
+            node = template_obj.node
+        if node.get("type"):
+            ra_l.append(get_ra(node))
+    prefetch_meta(ra_l)
+
+
 class Op(object):
     '''
     Operations.
     '''
+    __slots__ = ("prim", "node", "attr_d")
     elem_type = "op"
 
     def __init__(self, op_name, prim, node=None):
@@ -1364,6 +1618,7 @@ class CibOp(CibObject):
     '''
     Operations
     '''
+    __slots__ = ()
 
     set_names = {
         "instance_attributes": "op_params",
@@ -1383,6 +1638,7 @@ class CibPrimitive(CibObject):
     '''
     Primitives.
     '''
+    __slots__ = ()
 
     set_names = {
         "instance_attributes": "params",
@@ -1615,6 +1871,7 @@ class CibContainer(CibObject):
     '''
     Groups and clones and ms.
     '''
+    __slots__ = ()
     set_names = {
         "instance_attributes": "params",
         "meta_attributes": "meta",
@@ -1670,6 +1927,7 @@ class CibBundle(CibObject):
     '''
     bundle type resource
     '''
+    __slots__ = ()
     set_names = {
         "instance_attributes": "params",
         "meta_attributes": "meta",
@@ -1715,6 +1973,7 @@ class CibLocation(CibObject):
     '''
     Location constraint.
     '''
+    __slots__ = ()
 
     def _repr_cli_head(self, format_mode):
         rsc = None
@@ -1855,6 +2114,7 @@ class CibSimpleConstraint(CibObject):
     '''
     Colocation and order constraints.
     '''
+    __slots__ = ()
 
     def _repr_cli_head(self, format_mode):
         s = clidisplay.keyword(self.obj_type)
@@ -1948,6 +2208,7 @@ class CibRscTicket(CibSimpleConstraint):
     '''
     rsc_ticket constraint.
     '''
+    __slots__ = ()
 
     def _repr_cli_head(self, format_mode):
         s = clidisplay.keyword(self.obj_type)
@@ -1969,6 +2230,7 @@ class CibProperty(CibObject):
     '''
     Cluster properties.
     '''
+    __slots__ = ()
 
     def _repr_cli_head(self, format_mode):
         return "%s %s" % (clidisplay.keyword(self.obj_type),
@@ -2022,6 +2284,12 @@ class CibFencingOrder(CibObject):
     '''
     Fencing order (fencing-topology).
     '''
+    __slots__ = ()
+
+    def _cli_cache_key(self, format_mode):
+        # levels are shown per node unless all nodes are covered
+        return (super(CibFencingOrder, self)._cli_cache_key(format_mode),
+                tuple(cib_factory.node_id_list()))
 
     def set_id(self, obj_id=None):
         self.obj_id = "fencing_topology"
@@ -2108,6 +2376,7 @@ class CibAcl(CibObject):
     Now with support for 1.1.12 style ACL rules.
 
     '''
+    __slots__ = ()
 
     def _repr_cli_head(self, format_mode):
         s = clidisplay.keyword(self.obj_type)
@@ -2132,6 +2401,7 @@ class CibTag(CibObject):
     TODO: check_sanity, repr_gv
 
     '''
+    __slots__ = ()
 
     def _repr_cli_head(self, fmt):
         return ' '.join([clidisplay.keyword(self.obj_type),
@@ -2149,6 +2419,7 @@ class CibAlert(CibObject):
     FIXME: display instance / meta attributes, description
 
     '''
+    __slots__ = ()
     set_names = {
         "instance_attributes": "attributes",
         "meta_attributes": "meta",
@@ -2252,6 +2523,11 @@ def default_id_for_tag(tag):
     return m[3] if len(m) > 3 else None
 
 
+def has_wildcard(obj_id):
+    "Does the id contain fnmatch wildcard characters?"
+    return any(c in obj_id for c in "*?[")
+
+
 def default_id_for_obj(obj_type):
     "Get default id for object type"
     return default_id_for_tag(backtrans.get(obj_type))
@@ -2299,31 +2575,21 @@ class CibDiff(object):
             self._resources[obj_id] = item
         return True
 
-    def _obj_type(self, nid):
-        for obj in self.objset.all_set:
-            if obj.obj_id == nid:
-                return obj.obj_type
-        return None
-
-    def _is_node(self, nid):
-        for obj in self.objset.all_set:
-            if obj.obj_id == nid and obj.obj_type == 'node':
-                return True
-        return False
-
-    def _is_resource(self, nid):
+    def _obj_ids(self):
+        '''
+        Ids of the nodes and of the other objects in the set,
+        in the set order.
+        '''
+        node_ids = set()
+        rsc_ids = set()
         for obj in self.objset.all_set:
-            if obj.obj_id == nid and obj.obj_type != 'node':
-                return True
-        return False
-
-    def _obj_nodes(self):
-        return orderedset.oset([n for n in self.objset.obj_ids
-                                if self._is_node(n)])
-
-    def _obj_resources(self):
-        return orderedset.oset([n for n in self.objset.obj_ids
-                                if self._is_resource(n)])
+            if obj.obj_type == 'node':
+                node_ids.add(obj.obj_id)
+            else:
+                rsc_ids.add(obj.obj_id)
+        nodes = orderedset.oset([n for n in self.objset.obj_ids if n in node_ids])
+        resources = orderedset.oset([n for n in self.objset.obj_ids if n in rsc_ids])
+        return nodes, resources
 
     def _is_edit_valid(self, id_set, existing):
         '''
@@ -2367,8 +2633,9 @@ class CibDiff(object):
         if not rc:
             return rc
 
-        for e, s, existing in ((edited_nodes, self._node_set, self._obj_nodes()),
-                               (edited_resources, self._rsc_set, self._obj_resources())):
+        obj_nodes, obj_resources = self._obj_ids()
+        for e, s, existing in ((edited_nodes, self._node_set, obj_nodes),
+                               (edited_resources, self._rsc_set, obj_resources)):
             rc, mk, upd, rm = calc_sets(s, existing)
             if not rc:
                 return rc
@@ -2378,6 +2645,56 @@ class CibDiff(object):
         return rc
 
 
+def _order_key(node):
+    ident = node.get("id") if isinstance(node.tag, str) else None
+    return node if ident is None else (node.tag, ident)
+
+
+class UndoJournal(object):
+    '''
+    Records changes made to the CibFactory inside a transaction
+    (between _push_state and _pop_state/_drop_state) so that
+    they can be rolled back. Objects are saved copy-on-write,
+    the first time they are touched, together with the XML of
+    their top parent. The cost is thus proportional to the
+    size of the change and not to the size of the CIB.
+    The order of the elements in a configuration section is
+    saved once, when the section is first changed, as later
+    changes would shift any positions saved per element. The
+    elements are saved by tag and id, for the touched ones
+    are replaced by their snapshots on rollback.
+    '''
+    def __init__(self, cib_attrs, cib_elem):
+        self.entries = []
+        self.touched = set()
+        self.cib_attrs = dict(cib_attrs)
+        self.orders = {}  # section element -> keys of its children
+        self.cib_elem = cib_elem
+        self.cib_elem_attrs = None
+        self.sections = None
+        if cib_elem is not None:
+            self.cib_elem_attrs = dict(cib_elem.attrib)
+            conf_elem = cib_elem.find("configuration")
+            if conf_elem is not None:
+                self.sections = list(conf_elem)
+
+    def add(self, *entry):
+        self.entries.append(entry)
+
+    def save_order(self, pnode):
+        if pnode is not None and pnode not in self.orders:
+            self.orders[pnode] = [_order_key(c) for c in pnode]
+
+    def merge(self, journal):
+        '''
+        Fold a committed inner transaction into this one.
+        '''
+        self.entries.extend(journal.entries)
+        self.touched |= journal.touched
+        for pnode, children in journal.orders.items():
+            self.orders.setdefault(pnode, children)
+
+
 class CibFactory(object):
     '''
     Juggle with CIB objects.
@@ -2523,11 +2840,13 @@ class CibFactory(object):
     def _import_cib(self, cib_elem):
         'Parse the current CIB (from cibadmin -Q).'
         self.cib_elem = cib_elem
+        self._xml_index = None
         if self.cib_elem is None:
             return False
         if not self.is_cib_supported():
             common_warn("CIB schema is not supported by the shell")
         self._get_cib_attributes(self.cib_elem)
+        self._loaded_version = self._cib_version(self.cib_elem)
         schema.init_schema(self.cib_elem)
         return True
 
@@ -2583,7 +2902,7 @@ class CibFactory(object):
         return c.get(a) == self.cib_attrs.get(a)
 
     def is_current_cib_equal(self, silent=False):
-        cib_elem = read_cib(cibdump2elem)
+        cib_elem = read_cib(cibversion2elem)
         if cib_elem is None:
             return False
         rc = self._attr_match(cib_elem, 'epoch') and \
@@ -2610,19 +2929,65 @@ class CibFactory(object):
         'Commit the configuration to the CIB.'
         if not self.is_cib_sane():
             return False
+        self._commit_version = None
         if not replace and cibadmin_can_patch():
             rc = self._patch_cib(force)
         else:
             rc = self._replace_cib(force)
+        # whatever we read before may be out of date now
+        cib_query_cache_clear()
         if rc:
             # reload the cib!
             t = time.time()
             common_debug("CIB commit successful at %s" % (t))
             if is_live_cib():
                 self.last_commit_time = t
-            self.refresh()
+            self._refresh_after_commit()
         return rc
 
+    def _cib_version(self, cib):
+        return (cib.get("admin_epoch"), cib.get("epoch"))
+
+    def _expected_version(self, step):
+        '''
+        The version the CIB should have once our commit went in,
+        given that it is based on the CIB we loaded.
+        '''
+        if self._loaded_version is None:
+            return None
+        try:
+            epoch = int(self._loaded_version[1])
+        except (TypeError, ValueError):
+            return None
+        return (self._loaded_version[0], str(epoch + step))
+
+    def _refresh_after_commit(self):
+        '''
+        After a successful patch the CIB holds exactly our
+        configuration. Unless the epoch shows that somebody else
+        changed the configuration as well, promote the in-memory
+        model instead of loading and parsing the whole CIB again.
+        Changes in the status section (num_updates) don't matter
+        here.
+        '''
+        expected, self._commit_version = self._commit_version, None
+        if expected is None or config.core.commit_refresh != "incremental":
+            return self.refresh()
+        cib = read_cib(cibversion2elem)
+        if cib is None or self._cib_version(cib) != expected:
+            common_debug("CIB changed by somebody else, reloading")
+            return self.refresh()
+        self._loaded_version = expected
+        self._copy_cib_attributes(cib, self.cib_elem)
+        self.cib_orig = copy.deepcopy(self.cib_elem)
+        sanitize_cib_for_patching(self.cib_orig)
+        for obj in self.cib_objects:
+            obj.origin = "cib"
+            obj.updated = False
+        self.remove_queue = []
+        self._clean_state()
+        return self.is_cib_sane()
+
     def _update_schema(self):
         '''
         Set the validate-with, if the schema changed.
@@ -2654,19 +3019,44 @@ class CibFactory(object):
         # copy the epoch from the current cib to both the target
         # cib and the original one (otherwise cibadmin won't want
         # to apply the patch)
-        current_cib = read_cib(cibdump2elem)
+        current_cib = read_cib(cibversion2elem)
         if current_cib is None:
             return False
+        # the in-memory model may replace the loaded CIB after
+        # the commit only if nobody changed the CIB meanwhile
+        based_on_loaded = self._cib_version(current_cib) == self._loaded_version
+        if not based_on_loaded:
+            common_debug("CIB changed since it was loaded")
 
         self._copy_cib_attributes(current_cib, self.cib_orig)
         current_cib = None  # don't need that anymore
         self._set_cib_attributes(self.cib_elem)
+        if not cibadmin_can_patch_v2():
+            return self._crm_diff_patch_cib(force)
+        cib_diff = cib_patchset(self.cib_orig, self.cib_elem)
+        if cib_diff is None:
+            return self._replace_cib(force)
+        if len(cib_diff) == 0:
+            # no diff = no action
+            if based_on_loaded:
+                self._commit_version = self._expected_version(0)
+            return True
+        rc = self._apply_patch(xml_tostring(cib_diff), force)
+        if rc and based_on_loaded:
+            # configuration changes bump the epoch
+            self._commit_version = self._expected_version(1)
+        return rc
+
+    def _crm_diff_patch_cib(self, force):
+        '''
+        Older pacemaker versions know only v1 patches, let
+        crm_diff produce those.
+        '''
         cib_s = xml_tostring(self.cib_orig, pretty_print=True)
         tmpf = str2tmp(cib_s, suffix=".xml")
         if not tmpf or not ensure_sudo_readable(tmpf):
             return False
         tmpfiles.add(tmpf)
-        cibadmin_opts = force and "-P --force" or "-P"
 
         # produce a diff:
         # dump_new_conf | crm_diff -o self.cib_orig -n -
@@ -2693,6 +3083,10 @@ class CibFactory(object):
                 if "digest" in tag.attrib:
                     del tag.attrib["digest"]
             cib_diff = xml_tostring(e)
+        return self._apply_patch(cib_diff, force)
+
+    def _apply_patch(self, cib_diff, force):
+        cibadmin_opts = force and "-P --force" or "-P"
         common_debug("Diff: %s" % (cib_diff))
         rc = pipe_string("%s %s" % (cib_piped, cibadmin_opts),
                          cib_diff.encode('utf-8'))
@@ -2734,7 +3128,7 @@ class CibFactory(object):
         obj.origin = "cib"
         obj.node = node
         obj.set_id()
-        self.cib_objects.append(obj)
+        self._append_obj(obj)
         return obj
 
     def _populate(self):
@@ -2751,23 +3145,34 @@ class CibFactory(object):
         for obj in self.cib_objects:
             obj.move_comments()
             fix_comments(obj.node)
-        self.cli_use_validate_all()
+        nocli = cibcache.load(self.cib_elem)
+        if nocli is None:
+            self.cli_use_validate_all()
+            cibcache.save(self.cib_elem,
+                          [(obj.xml_obj_type, obj.obj_id) for obj in self.cib_objects if obj.nocli])
+        else:
+            for obj in self.cib_objects:
+                if (obj.xml_obj_type, obj.obj_id) in nocli:
+                    self._set_nocli(obj)
         for obj in self.cib_objects:
             self._update_links(obj)
 
+    def _set_nocli(self, obj):
+        obj.nocli = True
+        obj.nocli_warn = False
+        # no need to warn, user can see the object displayed as XML
+        common_debug("object %s cannot be represented in the CLI notation" % (obj.obj_id))
+
     def cli_use_validate_all(self):
         for obj in self.cib_objects:
             if not obj.cli_use_validate():
-                obj.nocli = True
-                obj.nocli_warn = False
-                # no need to warn, user can see the object displayed as XML
-                common_debug("object %s cannot be represented in the CLI notation" % (obj.obj_id))
+                self._set_nocli(obj)
 
     def initialize(self, cib=None):
         if self.cib_elem is not None:
             return True
         if cib is None:
-            cib = read_cib(cibdump2elem)
+            cib = read_cib(cibdump2elem_nostatus)
         elif isinstance(cib, str):
             cib = cibtext2elem(cib)
         if not self._import_cib(cib):
@@ -2787,43 +3192,288 @@ class CibFactory(object):
         self.cib_objects = []    # a list of cib objects
         self.remove_queue = []   # a list of cib objects to be removed
         self.id_refs = {}        # dict of id-refs
+        self.id_refs_serial = 0  # bumped on every id_refs change
+        self._loaded_version = None  # (admin_epoch, epoch) of the CIB we hold
+        self._commit_version = None  # (admin_epoch, epoch) expected after commit
         self.new_schema = False  # schema changed
         self._state = []
+        self._id_index = {}      # obj_id -> [objects]
+        self._uname_index = {}   # node uname -> [node objects]
+        self._type_index = {}    # obj_type -> {objects}
+        self._xml_index = None   # (tag, id) -> xml element
+        self._obj_order = {}     # object -> position (cib_objects order)
+        self._next_order = 0
+        self._referrers = {}     # obj_id -> {objects referencing it}
+        self._refs = {}          # object -> ids it references
+
+    #
+    # object index (id, type and node uname lookups)
+    #
+    def _index_add(self, obj):
+        self._id_index.setdefault(obj.obj_id, []).append(obj)
+        self._type_index.setdefault(obj.obj_type, set()).add(obj)
+        if obj.obj_type == "node" and obj.node is not None:
+            uname = obj.node.get("uname")
+            if uname and uname != obj.obj_id:
+                self._uname_index.setdefault(uname, []).append(obj)
+        self._refs_update(obj)
+
+    def _index_remove(self, obj):
+        def drop(index, key):
+            l = index.get(key)
+            if l is None:
+                return
+            l[:] = [x for x in l if x is not obj]
+            if not l:
+                del index[key]
+        drop(self._id_index, obj.obj_id)
+        objs = self._type_index.get(obj.obj_type)
+        if objs is not None:
+            objs.discard(obj)
+        if obj.obj_type == "node" and obj.node is not None:
+            drop(self._uname_index, obj.node.get("uname"))
+        self._refs_remove(obj)
+
+    def _rebuild_index(self):
+        self._id_index = {}
+        self._uname_index = {}
+        self._type_index = {}
+        self._obj_order = {}
+        self._referrers = {}
+        self._refs = {}
+        for i, obj in enumerate(self.cib_objects):
+            self._obj_order[obj] = i
+            self._index_add(obj)
+        self._next_order = len(self.cib_objects)
+
+    def _append_obj(self, obj):
+        # positions only need to be increasing
+        self._obj_order[obj] = self._next_order
+        self._next_order += 1
+        self.cib_objects.append(obj)
+        self._index_add(obj)
+        self._journal('append', obj)
+
+    #
+    # reverse reference graph: which objects (constraints, tags,
+    # containers, primitives using a template) refer to an id
+    #
+    def _refs_remove(self, obj):
+        for ref in self._refs.pop(obj, ()):
+            s = self._referrers.get(ref)
+            if s is not None:
+                s.discard(obj)
+                if not s:
+                    del self._referrers[ref]
+
+    def _refs_update(self, obj):
+        """
+        (Re)compute references of obj. Must be called whenever
+        references in obj.node may have been added.
+        """
+        self._refs_remove(obj)
+        if obj.node is None:
+            return
+        refs = related_ids(obj.node)
+        self._refs[obj] = refs
+        for ref in refs:
+            self._referrers.setdefault(ref, set()).add(obj)
+
+    def _referring_objs(self, obj_id, predicate):
+        """
+        Objects referring to obj_id for which predicate holds,
+        in cib_objects order. The graph may hold stale edges
+        (references dropped from the XML), hence the predicate.
+        """
+        l = [x for x in self._referrers.get(obj_id, ())
+             if x in self._obj_order and x.node is not None and predicate(x)]
+        return sorted(l, key=lambda x: self._obj_order[x])
+
+    def _is_listed(self, obj):
+        return any(x is obj for x in self._id_index.get(obj.obj_id, []))
+
+    #
+    # xml element index (used instead of searching the whole document)
+    #
+    def _xml_index_key(self, node):
+        if node.tag == 'fencing-topology':
+            return (node.tag, None)
+        pnode = node.getparent()
+        if node.tag == 'meta_attributes' and pnode is not None and is_defaults(pnode):
+            return (pnode.tag, node.get("id"))
+        return (node.tag, node.get("id"))
+
+    def _build_xml_index(self):
+        self._xml_index = {}
+        if self.cib_elem is None:
+            return
+        for node in self.cib_elem.iter(tag=etree.Element):
+            if node.get("id") is not None or node.tag == 'fencing-topology':
+                # the first element in document order wins (as with xpath)
+                self._xml_index.setdefault(self._xml_index_key(node), node)
+
+    def _xml_index_add(self, node):
+        if self._xml_index is None or node is None:
+            return
+        for c in node.iter(tag=etree.Element):
+            if c.get("id") is not None or c.tag == 'fencing-topology':
+                self._xml_index[self._xml_index_key(c)] = c
+
+    def _xml_index_lookup(self, key):
+        node = self._xml_index.get(key)
+        if node is None:
+            return None
+        # the index is updated on our own edits, but nodes may be
+        # replaced or moved by other code: verify before use
+        # (removed nodes still report the document root, so walk
+        # up the ancestors instead of using getroottree())
+        top = node
+        for top in node.iterancestors():
+            pass
+        if top is not self.cib_elem or self._xml_index_key(node) != key:
+            return None
+        return node
 
     def _push_state(self):
         '''
-        A rudimentary instance state backup. Just make copies of
-        all important variables.
-        idmgmt has to be backed up too.
+        Start a transaction. Changes are journaled from now on.
+        idmgmt has its own journal.
         '''
-        self._state.append([copy.deepcopy(x)
-                            for x in (self.cib_elem,
-                                      self.cib_attrs,
-                                      self.cib_objects,
-                                      self.remove_queue,
-                                      self.id_refs)])
+        self._state.append(UndoJournal(self.cib_attrs, self.cib_elem))
         idmgmt.push_state()
 
+    def _journal(self, *entry):
+        if self._state:
+            self._state[-1].add(*entry)
+
+    def _journal_touch(self, obj):
+        '''
+        Save obj, the objects related to it (its top parent and
+        all children) and the XML of the top parent before
+        they get modified. Done once per object and transaction.
+        '''
+        obj.mark_changed()
+        if not self._state or obj not in self._obj_order:
+            return
+        journal = self._state[-1]
+        if obj in journal.touched:
+            return
+        top = obj.top_parent()
+        members = [top]
+        for m in members:
+            members.extend(c for c in m.children if c not in members)
+        if obj not in members:
+            members.append(obj)
+        positions = dict((e, i) for i, e in enumerate(top.node.iter()))
+        pnode = top.node.getparent()
+        journal.save_order(pnode)
+        saved = [(m, self._save_obj(m), positions.get(m.node)) for m in members]
+        journal.touched.update(members)
+        journal.add('touch', copy.deepcopy(top.node), pnode, saved)
+
+    def _save_obj(self, obj):
+        d = obj.save_attrs()
+        d["children"] = list(obj.children)
+        return d
+
+    def _restore_obj(self, obj, d):
+        obj.restore_attrs(d)
+        obj.children = list(d["children"])
+
+    def _undo_touch(self, snapshot, pnode, saved):
+        '''
+        Put the saved objects and XML back. The snapshot is
+        appended to the section, _undo_orders puts it in place.
+        '''
+        for m, _, _ in saved:
+            rmnode(m.node)
+        if pnode is not None:
+            pnode.append(snapshot)
+        elems = list(snapshot.iter())
+        for m, d, pos in saved:
+            listed = m in self._obj_order
+            if listed:
+                self._index_remove(m)
+            self._restore_obj(m, d)
+            if pos is not None:
+                m.node = elems[pos]
+            if listed:
+                self._index_add(m)
+        self._xml_index_add(snapshot)
+
+    def _undo_append(self, obj):
+        self.cib_objects.remove(obj)
+        self._index_remove(obj)
+        del self._obj_order[obj]
+        rmnode(obj.node)
+
+    def _undo_remove(self, obj, index, order):
+        self.cib_objects.insert(index, obj)
+        self._obj_order[obj] = order
+        self._index_add(obj)
+
+    def _undo_orders(self, journal):
+        '''
+        Restore the order of the elements in the changed
+        sections and drop the sections created in the
+        transaction, if they are empty.
+        '''
+        for pnode, keys in journal.orders.items():
+            rank = dict((k, i) for i, k in enumerate(keys))
+            current = list(pnode)
+            children = sorted(current, key=lambda c: rank.get(_order_key(c), len(rank)))
+            if children != current:
+                for c in children:
+                    pnode.append(c)
+        if journal.sections is not None and journal.cib_elem is self.cib_elem:
+            conf_elem = self.cib_elem.find("configuration")
+            for section in list(conf_elem):
+                if section not in journal.sections and len(section) == 0:
+                    conf_elem.remove(section)
+
+    def _undo(self, journal):
+        for entry in reversed(journal.entries):
+            op, args = entry[0], entry[1:]
+            if op == 'touch':
+                self._undo_touch(*args)
+            elif op == 'append':
+                self._undo_append(*args)
+            elif op == 'remove':
+                self._undo_remove(*args)
+            elif op == 'queue':
+                self.remove_queue.pop()
+            elif op == 'id_ref':
+                ident, had, old = args
+                if had:
+                    self.id_refs[ident] = old
+                else:
+                    self.id_refs.pop(ident, None)
+                self.id_refs_serial += 1
+            elif op == 'objects':
+                self.cib_objects = args[0]
+                self._rebuild_index()
+        self._undo_orders(journal)
+        self.cib_attrs = journal.cib_attrs
+        if journal.cib_elem_attrs is not None and journal.cib_elem is self.cib_elem:
+            self.cib_elem.attrib.clear()
+            self.cib_elem.attrib.update(journal.cib_elem_attrs)
+
     def _pop_state(self):
         try:
-            common_debug("performing rollback from %s" % (self.cib_objects))
-            self.cib_elem, \
-                self.cib_attrs, self.cib_objects, \
-                self.remove_queue, self.id_refs = self._state.pop()
-        except KeyError:
+            journal = self._state.pop()
+        except IndexError:
             return False
-        # need to get addresses of all new objects created by
-        # deepcopy
-        for obj in self.cib_objects:
-            obj.node = self.find_xml_node(obj.xml_obj_type, obj.obj_id)
-            self._update_links(obj)
+        common_debug("performing rollback from %s" % (self.cib_objects))
+        self._undo(journal)
         idmgmt.pop_state()
         return self.check_structure()
 
     def _drop_state(self):
         try:
-            self._state.pop()
-        except KeyError:
+            journal = self._state.pop()
+            if self._state:
+                self._state[-1].merge(journal)
+        except IndexError:
             pass
         idmgmt.drop_state()
 
@@ -2846,6 +3496,12 @@ class CibFactory(object):
             return x and fnmatch.fnmatch(x, obj_id)
         if not self.is_cib_sane() or obj_id is None:
             return None
+        if not has_wildcard(obj_id):
+            objs = list(self._id_index.get(obj_id, []))
+            # special case for Heartbeat nodes which have id
+            # different from uname
+            objs += [x for x in self._uname_index.get(obj_id, []) if x not in objs]
+            return objs
         objs = []
         for obj in self.cib_objects:
             if matchfn(obj.obj_id):
@@ -2960,27 +3616,32 @@ class CibFactory(object):
     #
     def find_container_child(self, node):
         "Find an object which may be the child in a container."
-        for obj in reversed(self.cib_objects):
-            if node.tag == "fencing-topology" and obj.xml_obj_type == "fencing-topology":
-                return obj
-            if node.tag == obj.node.tag and node.get("id") == obj.obj_id:
-                return obj
-        return None
+        if node.tag == "fencing-topology":
+            for obj in reversed(self.cib_objects):
+                if obj.xml_obj_type == "fencing-topology":
+                    return obj
+            return None
+        # the most recently added one, as with a backwards search
+        # of cib_objects
+        l = [x for x in self._id_index.get(node.get("id"), [])
+             if x in self._obj_order and x.node.tag == node.tag]
+        return max(l, key=lambda x: self._obj_order[x]) if l else None
 
     def find_xml_node(self, tag, ident, strict=True):
         "Find a xml node of this type with this id."
-        try:
-            if tag in constants.defaults_tags:
-                expr = '//%s/meta_attributes[@id="%s"]' % (tag, ident)
-            elif tag == 'fencing-topology':
-                expr = '//fencing-topology'
-            else:
-                expr = '//%s[@id="%s"]' % (tag, ident)
-            return self.cib_elem.xpath(expr)[0]
-        except IndexError:
-            if strict:
-                common_warn("strange, %s element %s not found" % (tag, ident))
-            return None
+        key = (tag, None if tag == 'fencing-topology' else ident)
+        if self._xml_index is None:
+            self._build_xml_index()
+        node = self._xml_index_lookup(key)
+        if node is None and key in self._xml_index:
+            # a stale entry: the element was replaced or moved
+            # behind our back, reindex once (absent keys are
+            # just not there, that costs nothing)
+            self._build_xml_index()
+            node = self._xml_index_lookup(key)
+        if node is None and strict:
+            common_warn("strange, %s element %s not found" % (tag, ident))
+        return node
 
     #
     # Element editing stuff.
@@ -3013,6 +3674,7 @@ class CibFactory(object):
                 common_warn("template for %s not defined" % obj_id)
                 rc = False
                 continue
+            self._journal_touch(obj)
             ra = get_ra(r_node)
             if not ra.mk_ra_node():  # no RA found?
                 if not self.is_asymm_cluster():
@@ -3077,7 +3739,9 @@ class CibFactory(object):
         one, i.e. if the former is the case to find the right
         id to reference.
         '''
+        self._journal('id_ref', id_ref, id_ref in self.id_refs, self.id_refs.get(id_ref))
         self.id_refs[id_ref] = attr_list_type
+        self.id_refs_serial += 1
         obj = self.find_resource(id_ref)
         if obj:
             nodes = obj.node.xpath(".//%s" % attr_list_type)
@@ -3153,23 +3817,69 @@ class CibFactory(object):
         return [x for x in self.cib_objects
                 if x.updated or x.origin == "user"]
 
+    def _in_order(self, objs):
+        "Listed objects from objs, in cib_objects order."
+        return sorted((x for x in objs if x in self._obj_order),
+                      key=lambda x: self._obj_order[x])
+
     def get_elems_on_type(self, spec):
         if not spec.startswith("type:"):
             return []
-        t = spec[5:]
-        return [x for x in self.cib_objects if x.obj_type == t]
+        return self._in_order(self._type_index.get(spec[5:], ()))
+
+    def _tags_matching(self, t):
+        "Tag objects with id t (can be a wildcard-glob)."
+        if has_wildcard(t):
+            return self._in_order(x for x in self._type_index.get('tag', ())
+                                  if fnmatch.fnmatch(x.obj_id, t))
+        return [x for x in self._id_index.get(t, []) if x.obj_type == 'tag']
 
     def get_elems_on_tag(self, spec):
         if not spec.startswith("tag:"):
             return []
-        t = spec[4:]
-        matching_tags = [x for x in self.cib_objects if x.obj_type == 'tag' and x.obj_id == t]
         ret = []
-        for mt in matching_tags:
+        for mt in self._tags_matching(spec[4:]):
             matches = [cib_factory.find_resource(o) for o in mt.node.xpath('./obj_ref/@id')]
             ret += [m for m in matches if m is not None]
         return ret
 
+    def _filter_term(self, spec, within=None):
+        """
+        Objects matching a single filter term. If within is not
+        None, only those objects are candidates, which spares us
+        looking at all objects for wildcards and the like.
+        Returns a set or None if an id matches no object at all.
+        """
+        def matchfn(x):
+            return x and fnmatch.fnmatch(x, spec)
+        if spec == "changed":
+            candidates = self.cib_objects if within is None else within
+            return set(x for x in candidates if x.updated or x.origin == "user")
+        if spec.startswith("type:"):
+            objs = self._type_index.get(spec[5:], set())
+        elif spec.startswith("tag:"):
+            objs = set(self.get_elems_on_tag(spec))
+        elif spec.startswith("related:"):
+            name = spec[len("related:"):]
+            objs = set(self.find_objects(name) or [])
+            obj = self.find_object(name)
+            if obj is not None:
+                objs.update(self.related_elements(obj))
+        elif within is not None and has_wildcard(spec):
+            objs = set(x for x in within
+                       if matchfn(x.obj_id) or
+                       (x.obj_type == "node" and matchfn(x.node.get("uname"))))
+            if not objs and not self.find_objects(spec):
+                return None
+            return objs
+        else:
+            objs = set(self.find_objects(spec) or [])
+            if not objs:
+                return None
+        if within is not None:
+            return objs & within
+        return set(objs)
+
     def filter_objects(self, filters):
         """
         Filter out a set of objects given a list of filters.
@@ -3186,6 +3896,12 @@ class CibFactory(object):
         type:primitive and foo* = primitives that start with id foo
         type:primitive or foo* = all that start with id foo plus all primitives
         type:primitive and tag:foo
+        type:primitive and tag:foo*
+
+        The terms are evaluated from left to right, "and"
+        taking everything selected so far as its left side.
+        The term right of an "and" is only matched against that
+        selection; the indexes take care of the other terms.
 
         Returns:
         True, set() on success
@@ -3195,38 +3911,24 @@ class CibFactory(object):
             return True, copy.copy(self.cib_objects)
         if filters[0] == 'NOOBJ':
             return True, orderedset.oset([])
-        obj_set = orderedset.oset([])
-        and_filter, and_set = False, None
+        objs = set()
+        and_set = None
         for spec in filters:
             if spec == "or":
                 continue
             elif spec == "and":
-                and_filter, and_set = True, obj_set
-                obj_set = orderedset.oset([])
+                and_set, objs = objs, set()
                 continue
-            if spec == "changed":
-                obj_set |= orderedset.oset(self.modified_elems())
-            elif spec.startswith("type:"):
-                obj_set |= orderedset.oset(self.get_elems_on_type(spec))
-            elif spec.startswith("tag:"):
-                obj_set |= orderedset.oset(self.get_elems_on_tag(spec))
-            elif spec.startswith("related:"):
-                name = spec[len("related:"):]
-                obj_set |= orderedset.oset(self.find_objects(name) or [])
-                obj = self.find_object(name)
-                if obj is not None:
-                    obj_set |= orderedset.oset(self.related_elements(obj))
+            selected = self._filter_term(spec, within=and_set)
+            if selected is None:
+                return False, spec
+            if and_set is not None:
+                objs, and_set = selected, None
             else:
-                objs = self.find_objects(spec) or []
-                for obj in objs:
-                    obj_set.add(obj)
-                if not objs:
-                    return False, spec
-            if and_filter is True:
-                and_filter, obj_set = False, obj_set.intersection(and_set)
-        if and_filter is True:
-            and_filter, obj_set = False, and_set
-        return True, obj_set
+                objs |= selected
+        if and_set is not None:
+            objs = and_set
+        return True, orderedset.oset(self._in_order(objs))
 
     def mkobj_set(self, *args):
         rc, obj_set = self.filter_objects(args)
@@ -3279,8 +3981,13 @@ class CibFactory(object):
                            (obj_id, child_id))
                 rc = False
             c_dict[child_id] = 1
-        for other in [x for x in self.cib_objects
-                      if x != obj and is_container(x.node)]:
+        # only containers referring to one of the children may
+        # share it
+        others = set()
+        for child in obj.children:
+            others.update(self._referring_objs(child.obj_id,
+                                               lambda x: x != obj and is_container(x.node)))
+        for other in sorted(others, key=lambda x: self._obj_order[x]):
             shared_obj = set(obj.children) & set(other.children)
             if shared_obj:
                 common_err("%s contained in both %s and %s" %
@@ -3351,7 +4058,10 @@ class CibFactory(object):
             obj.origin = "user"
             obj.node.set('id', pset_id)
             topnode.append(obj.node)
-            self.cib_objects.append(obj)
+            self._append_obj(obj)
+            self._xml_index_add(obj.node)
+        else:
+            self._journal_touch(obj)
         copy_nvpairs(obj.node, node)
         obj.normalize_parameters()
         obj.set_updated()
@@ -3373,6 +4083,7 @@ class CibFactory(object):
         node, obj_type, obj_id = postprocess_cli(node, id_hint=rsc_obj.obj_id)
 
         del node.attrib['rsc']
+        self._journal_touch(rsc_obj)
         return rsc_obj.add_operation(node)
 
     def create_from_cli(self, cli):
@@ -3404,6 +4115,54 @@ class CibFactory(object):
             return None
         return self._add_element(obj, elem)
 
+    def _bulk_create_from_cli(self, cli_l):
+        '''
+        Create many objects from their parsed cli
+        representations, e.g. on "configure load" of a large
+        file. The ids are checked and the objects made in one
+        pass before anything is attached to the CIB. The
+        xml -> cli -> xml validation is postponed until an
+        object is shown or edited.
+        Returns the list of new objects or None.
+        '''
+        if not self.is_cib_sane():
+            return None
+        todo = []
+        ids = set()
+        for cli in cli_l:
+            if cli.tag in ("op", "node") or \
+                    cib_object_map[cli.tag][0] in constants.nvset_cli_names:
+                # these may merge into existing objects
+                todo.append((None, cli))
+                continue
+            obj_id = id_for_node(cli)
+            if obj_id in ids:
+                common_err("Duplicate resource: %s" % (obj_id))
+                return None
+            ids.add(obj_id)
+            obj = self.new_object(cib_object_map[cli.tag][0], obj_id)
+            if not obj:
+                return None
+            todo.append((obj, cli))
+        # normalize_parameters needs the meta-data
+        prefetch_ra_meta(cli for obj, cli in todo if obj is not None)
+        objs = []
+        for obj, cli in todo:
+            if obj is None:
+                obj = self.create_from_cli(cli)
+            else:
+                # references are resolved against the objects
+                # attached so far
+                elem = postprocess_cli(cli)[0]
+                if elem is None or not self._add_element(obj, elem, validate=False):
+                    obj = None
+            if not obj:
+                common_debug("create_from_cli '%s' failed" %
+                             (xml_tostring(cli, pretty_print=True)))
+                return None
+            objs.append(obj)
+        return objs
+
     def update_from_cli(self, obj, node, method):
         '''
         Replace element from the cli intermediate.
@@ -3428,11 +4187,15 @@ class CibFactory(object):
             idmgmt.replace_xml(newnode, obj.node)
             return False
         oldnode = obj.node
-        if xml_equals(oldnode, newnode):
+        if obj.digest() == xml_digest(newnode):
             if newnode.getparent() is not None:
                 newnode.getparent().remove(newnode)
             return True  # the new and the old versions are equal
+        self._journal_touch(obj)
+        self._index_remove(obj)
         obj.node = newnode
+        self._index_add(obj)
+        self._xml_index_add(newnode)
         common_debug("update CIB element: %s" % str(obj))
         if oldnode.getparent() is not None:
             oldnode.getparent().replace(oldnode, newnode)
@@ -3448,11 +4211,13 @@ class CibFactory(object):
 
     def merge_from_cli(self, obj, node):
         common_debug("merge_from_cli: %s %s" % (obj.obj_type, xml_tostring(node)))
+        self._journal_touch(obj)
         if obj.obj_type in constants.nvset_cli_names:
             rc = merge_attributes(obj.node, node, "nvpair")
         else:
             rc = merge_nodes(obj.node, node)
         if rc:
+            self._refs_update(obj)
             obj.set_updated()
         return True
 
@@ -3495,13 +4260,20 @@ class CibFactory(object):
             common_debug("delete %s failed" % (list(del_set)))
             return False
 
-        for cli in processing_sort([edit_d[x] for x in mk_set]):
-            obj = self.create_from_cli(cli)
-            if not obj:
-                common_debug("create_from_cli '%s' failed" %
-                             (xml_tostring(cli, pretty_print=True)))
+        mk_l = processing_sort([edit_d[x] for x in mk_set])
+        if len(mk_l) >= _BULK_CREATE_MIN:
+            objs = self._bulk_create_from_cli(mk_l)
+            if objs is None:
                 return False
-            test_l.append(obj)
+            test_l.extend(objs)
+        else:
+            for cli in mk_l:
+                obj = self.create_from_cli(cli)
+                if not obj:
+                    common_debug("create_from_cli '%s' failed" %
+                                 (xml_tostring(cli, pretty_print=True)))
+                    return False
+                test_l.append(obj)
 
         for ident in upd_set:
             if edit_d[ident].tag == 'node':
@@ -3525,6 +4297,8 @@ class CibFactory(object):
             common_debug("delete %s failed" % (list(del_set)))
             return False
         rc = True
+        if utils.is_check_always():
+            prefetch_ra_meta(obj.node for obj in test_l)
         for obj in test_l:
             if not self.test_element(obj):
                 common_debug("test_element failed for %s" % (obj))
@@ -3559,6 +4333,8 @@ class CibFactory(object):
         if not self.delete(*list(del_set)):
             return False
         rc = True
+        if utils.is_check_always():
+            prefetch_ra_meta(obj.node for obj in test_l)
         for obj in test_l:
             if not self.test_element(obj):
                 rc = False
@@ -3594,6 +4370,9 @@ class CibFactory(object):
         old_children = [x for x in obj.children if x.parent == obj]
         new_children = [self.find_resource(x) for x in new_children_ids]
         new_children = [c for c in new_children if c is not None]
+        self._journal_touch(obj)
+        for child in new_children:
+            self._journal_touch(child)
         obj.children = new_children
         # relink orphans to top
         for child in set(old_children) - set(obj.children):
@@ -3628,6 +4407,9 @@ class CibFactory(object):
         '''
         # unlink all and find them in the new node
         for child in obj.children:
+            if child.parent:
+                # the old parent is marked updated below
+                self._journal_touch(child.parent)
             oldnode = child.node
             newnode = obj.find_child_in_node(child)
             if newnode is None:
@@ -3671,7 +4453,7 @@ class CibFactory(object):
                     rmnode(child.node)
                     child.node = c
 
-    def _add_element(self, obj, node):
+    def _add_element(self, obj, node, validate=True):
         assert node is not None
         obj.node = node
         obj.set_id()
@@ -3682,12 +4464,15 @@ class CibFactory(object):
         pnode.append(node)
         self._redirect_children_constraints(obj)
         obj.normalize_parameters()
-        if not obj.cli_use_validate():
+        if not validate:
+            obj.postpone_cli_validation()
+        elif not obj.cli_use_validate():
             self.nocli_warn = True
             obj.nocli = True
         self._update_links(obj)
         obj.origin = "user"
-        self.cib_objects.append(obj)
+        self._append_obj(obj)
+        self._xml_index_add(obj.node)
         return obj
 
     def _add_children(self, obj_type, node):
@@ -3737,40 +4522,101 @@ class CibFactory(object):
 
     def _remove_obj(self, obj):
         "Remove a cib object."
-        common_debug("remove object %s" % str(obj))
-        for child in obj.children:
-            # just relink, don't remove children
-            self._relink_child_to_top(child)
-        if obj.parent:  # remove obj from its parent, if any
-            obj.parent.children.remove(obj)
-        idmgmt.remove_xml(obj.node)
-        rmnode(obj.node)
-        self._add_to_remove_queue(obj)
-        self.cib_objects.remove(obj)
-        for tag in self.related_tags(obj):
-            # remove self from tag
-            # remove tag if self is last tagged object in tag
-            selfies = [x for x in tag.node.iterchildren() if x.get('id') == obj.obj_id]
+        self._remove_objs([obj])
+
+    def _unlist_objs(self, objs):
+        "Drop objs from cib_objects (in one pass) and the indexes."
+        if len(objs) == 1:
+            positions = [(self.cib_objects.index(objs[0]), objs[0])]
+            del self.cib_objects[positions[0][0]]
+        else:
+            gone = set(objs)
+            positions = [(i, x) for i, x in enumerate(self.cib_objects) if x in gone]
+            self.cib_objects[:] = [x for x in self.cib_objects if x not in gone]
+        # journaled from the back so that the undo can insert
+        # each object at its original position
+        for i, obj in reversed(positions):
+            self._journal('remove', obj, i, self._obj_order[obj])
+        for obj in objs:
+            self._index_remove(obj)
+            del self._obj_order[obj]
+
+    def _remove_objs(self, objs):
+        '''
+        Remove cib objects, in the given order. The tags and
+        constraints which refer to any of them are then updated
+        in one pass, each only once.
+        '''
+        first_child = {}
+        referrers = set()
+        for obj in objs:
+            common_debug("remove object %s" % str(obj))
+            self._journal_touch(obj)
+            if obj.children:
+                first_child[obj] = obj.children[0].obj_id
+            for child in obj.children:
+                # just relink, don't remove children
+                self._relink_child_to_top(child)
+            if obj.parent:  # remove obj from its parent, if any
+                obj.parent.children.remove(obj)
+                obj.parent.set_updated()
+            idmgmt.remove_xml(obj.node)
+            rmnode(obj.node)
+            self._add_to_remove_queue(obj)
+            referrers.update(self._referrers.get(obj.obj_id, ()))
+        self._unlist_objs(objs)
+        referrers = self._in_order(x for x in referrers if x.node is not None)
+        removed_ids = set(obj.obj_id for obj in objs)
+        hanging = []
+        for tag in [x for x in referrers if x.obj_type == 'tag']:
+            # remove the objects from the tag
+            # remove the tag if no tagged object remains
+            selfies = [x for x in tag.node.iterchildren() if x.get('id') in removed_ids]
+            if not selfies:
+                continue
+            self._journal_touch(tag)
             for c in selfies:
                 rmnode(c)
             if not tag.node.xpath('./obj_ref'):
-                self._remove_obj(tag)
+                hanging.append(tag)
                 if not self._no_constraint_rm_msg:
                     err_buf.info("hanging %s deleted" % str(tag))
-        for c_obj in self.related_constraints(obj):
-            if is_simpleconstraint(c_obj.node) and obj.children:
-                # the first child inherits constraints
-                rename_rscref(c_obj, obj.obj_id, obj.children[0].obj_id)
-            deleted = False
-            if delete_rscref(c_obj, obj.obj_id):
-                deleted = True
-            if silly_constraint(c_obj.node, obj.obj_id):
+            else:
+                tag.set_updated()
+                self._refs_update(tag)
+        pos = dict((obj.obj_id, i) for i, obj in enumerate(objs) if is_resource(obj.node))
+        for c_obj in [x for x in referrers if is_constraint(x.node)]:
+            self._journal_touch(c_obj)
+            # the removed resources referred to, in removal order;
+            # a removed container passes the references in simple
+            # constraints on to its first child
+            pending = [pos[x] for x in related_ids(c_obj.node) if x in pos]
+            heapq.heapify(pending)
+            deleted = silly = False
+            while pending and not silly:
+                i = heapq.heappop(pending)
+                obj = objs[i]
+                if not rsc_constraint(obj.obj_id, c_obj.node):
+                    continue
+                child_id = first_child.get(obj)
+                if is_simpleconstraint(c_obj.node) and child_id:
+                    rename_rscref(c_obj, obj.obj_id, child_id)
+                    if pos.get(child_id, -1) > i:
+                        heapq.heappush(pending, pos[child_id])
+                if delete_rscref(c_obj, obj.obj_id):
+                    deleted = True
+                silly = silly_constraint(c_obj.node, obj.obj_id)
+            if silly:
                 # remove invalid constraints
-                self._remove_obj(c_obj)
+                hanging.append(c_obj)
                 if not self._no_constraint_rm_msg:
                     err_buf.info("hanging %s deleted" % str(c_obj))
-            elif deleted:
-                err_buf.info("constraint %s updated" % str(c_obj))
+            else:
+                self._refs_update(c_obj)
+                if deleted:
+                    err_buf.info("constraint %s updated" % str(c_obj))
+        if hanging:
+            self._remove_objs(hanging)
 
     def related_tags(self, obj):
         def related_tag(tobj):
@@ -3780,20 +4626,20 @@ class CibFactory(object):
                 if c.get('id') == obj.obj_id:
                     return True
             return False
-        return [x for x in self.cib_objects if related_tag(x)]
+        return self._referring_objs(obj.obj_id, related_tag)
 
     def related_constraints(self, obj):
         def related_constraint(obj2):
             return is_constraint(obj2.node) and rsc_constraint(obj.obj_id, obj2.node)
         if not is_resource(obj.node):
             return []
-        return [x for x in self.cib_objects if related_constraint(x)]
+        return self._referring_objs(obj.obj_id, related_constraint)
 
     def related_elements(self, obj):
         "Both constraints, groups, tags, ..."
         if not is_resource(obj.node):
             return []
-        return [x for x in self.cib_objects if is_related(obj.obj_id, x.node)]
+        return self._referring_objs(obj.obj_id, lambda x: is_related(obj.obj_id, x.node))
 
     def _redirect_children_constraints(self, obj):
         '''
@@ -3801,7 +4647,9 @@ class CibFactory(object):
         '''
         for child in obj.children:
             for c_obj in self.related_constraints(child):
+                self._journal_touch(c_obj)
                 rename_rscref(c_obj, child.obj_id, obj.obj_id)
+                self._refs_update(c_obj)
         # drop useless constraints which may have been created above
         for c_obj in self.related_constraints(obj):
             if silly_constraint(c_obj.node, obj.obj_id):
@@ -3812,13 +4660,9 @@ class CibFactory(object):
     def template_primitives(self, obj):
         if not is_template(obj.node):
             return []
-        c_list = []
-        for obj2 in self.cib_objects:
-            if not is_primitive(obj2.node):
-                continue
-            if obj2.node.get("template") == obj.obj_id:
-                c_list.append(obj2)
-        return c_list
+        return self._referring_objs(obj.obj_id,
+                                    lambda x: is_primitive(x.node) and
+                                    x.node.get("template") == obj.obj_id)
 
     def _check_running_primitives(self, prim_l):
         rscstat = RscState()
@@ -3831,16 +4675,28 @@ class CibFactory(object):
     def _add_to_remove_queue(self, obj):
         if obj.origin == "cib":
             self.remove_queue.append(obj)
+            self._journal('queue')
 
-    def _delete_1(self, obj):
+    def _delete_order(self, objs):
         '''
-        Remove an object and its parent in case the object is the
-        only child.
+        The objects to remove, in order: an object is preceded
+        by its parent in case it is the (last remaining) only
+        child.
         '''
-        if obj.parent and len(obj.parent.children) == 1:
-            self._delete_1(obj.parent)
-        if obj in self.cib_objects:  # don't remove parents twice
-            self._remove_obj(obj)
+        l = []
+        seen = set()
+
+        def add(obj):
+            p = obj.parent
+            if p is not None and p not in seen and \
+                    all(c is obj or c in seen for c in p.children):
+                add(p)
+            if obj not in seen:  # don't remove parents twice
+                seen.add(obj)
+                l.append(obj)
+        for obj in objs:
+            add(obj)
+        return l
 
     def delete(self, *args):
         'Delete a cib object.'
@@ -3848,6 +4704,8 @@ class CibFactory(object):
             return False
         rc = True
         l = []
+        listed = set()
+        arg_ids = set(args)
         rscstat = RscState()
         for obj_id in args:
             obj = self.find_object(obj_id)
@@ -3869,18 +4727,19 @@ class CibFactory(object):
             if is_template(obj.node):
                 prim_l = self.template_primitives(obj)
                 prim_l = [x for x in prim_l
-                          if x not in l and x.obj_id not in args]
+                          if x not in listed and x.obj_id not in arg_ids]
                 if not self._check_running_primitives(prim_l):
                     rc = False
                     continue
                 for prim in prim_l:
                     common_info("hanging %s deleted" % str(prim))
                     l.append(prim)
+                    listed.add(prim)
             l.append(obj)
+            listed.add(obj)
         if l:
             l = processing_sort_cli(l)
-            for obj in reversed(l):
-                self._delete_1(obj)
+            self._remove_objs(self._delete_order(reversed(l)))
         return rc
 
     def rename(self, old_id, new_id):
@@ -3895,26 +4754,74 @@ class CibFactory(object):
           deleted and the one with the new name created
         - rename old id to new id in the object
         '''
-        if not self.is_cib_sane() or not new_id:
-            return False
-        if idmgmt.id_in_use(new_id):
-            return False
-        obj = self.find_object(old_id)
-        if not obj:
-            no_object_err(old_id)
-            return False
-        if not obj.can_be_renamed():
+        return self.bulk_rename(ordereddict.odict([(old_id, new_id)]))
+
+    def bulk_rename(self, renames):
+        '''
+        Rename a number of cib objects, renames maps old to new
+        ids. The objects referring to any of the old ids
+        (constraints, also in resource sets, tags and the fencing
+        topology) are rewritten once each. Either all objects
+        are renamed or none.
+        '''
+        if not self.is_cib_sane():
             return False
-        for c_obj in self.related_constraints(obj):
-            rename_rscref(c_obj, old_id, new_id)
-        rename_id(obj.node, old_id, new_id)
-        obj.obj_id = new_id
-        idmgmt.rename(old_id, new_id)
-        # FIXME: (bnc#901543)
-        # for each child node; if id starts with "%(old_id)s-" and
-        # is not referenced by anything, change that id as well?
-        # otherwise inner ids will resemble old name, not new
-        obj.set_updated()
+        objs = []
+        new_ids = set()
+        for old_id, new_id in renames.items():
+            if not new_id:
+                return False
+            if new_id in new_ids:
+                common_err("cannot rename more than one object to %s" % new_id)
+                return False
+            if idmgmt.id_in_use(new_id):
+                return False
+            new_ids.add(new_id)
+            obj = self.find_object(old_id)
+            if not obj:
+                no_object_err(old_id)
+                return False
+            if not obj.can_be_renamed():
+                return False
+            objs.append(obj)
+        if not objs:
+            return True
+        self._push_state()
+        referrers = set()
+        for obj in objs:
+            referrers.update(self._referrers.get(obj.obj_id, ()))
+            self._journal_touch(obj)
+        fencing = self.find_object("fencing_topology")
+        if fencing is not None:
+            referrers.add(fencing)
+        for c_obj in self._in_order(referrers):
+            if c_obj.node is None or is_container(c_obj.node):
+                continue  # containers hold the renamed nodes
+            self._journal_touch(c_obj)
+            if rename_refs(c_obj, renames):
+                self._refs_update(c_obj)
+        parents = set()
+        for obj in objs:
+            old_id, new_id = obj.obj_id, renames[obj.obj_id]
+            rename_id(obj.node, old_id, new_id)
+            self._index_remove(obj)
+            obj.obj_id = new_id
+            self._index_add(obj)
+            self._xml_index_add(obj.node)
+            parent = obj.parent
+            while parent:
+                parents.add(parent)
+                parent = parent.parent
+            idmgmt.rename(old_id, new_id)
+            # FIXME: (bnc#901543)
+            # for each child node; if id starts with "%(old_id)s-" and
+            # is not referenced by anything, change that id as well?
+            # otherwise inner ids will resemble old name, not new
+            obj.set_updated()
+        for parent in parents:  # containers now hold the new ids
+            self._refs_update(parent)
+        self._drop_state()
+        return True
 
     def erase(self):
         "Remove all cib objects."
@@ -3947,7 +4854,9 @@ class CibFactory(object):
             for obj in self.cib_objects:
                 if obj.obj_type != "node":
                     print(str(obj), file=sys.stderr)
+            self._journal('objects', self.cib_objects)
             self.cib_objects = []
+            self._rebuild_index()
         return True
 
     def erase_nodes(self):
@@ -35,6 +35,14 @@ def nopretty(cond=True):
             enable_pretty()
 
 
+def display_key():
+    '''
+    What the output of this module depends on, for callers
+    which cache formatted text.
+    '''
+    return (_pretty, config.serial())
+
+
 def colors_enabled():
     return 'color' in config.color.style and _pretty
 
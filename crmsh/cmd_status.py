@@ -3,10 +3,18 @@
 # See COPYING for license information.
 
 import re
+import sys
+import time
+import json
+import fnmatch
+from lxml import etree
 from . import clidisplay
 from . import utils
 
 _crm_mon = None
+_crm_mon_xml = None
+# seconds between the CIB version checks of status watch
+_WATCH_INTERVAL = 2
 
 _WARNS = ['pending',
           'complete',
@@ -66,13 +74,9 @@ class CrmMonFilter(object):
         return '\n'.join([self._filter(line) for line in text.splitlines()]) + '\n'
 
 
-def crm_mon(opts=''):
-    """
-    Run 'crm_mon -1'
-    opts: Additional options to pass to crm_mon
-    returns: rc, stdout
-    """
-    global _crm_mon
+def _init_crm_mon():
+    "Find out which crm_mon options we can use."
+    global _crm_mon, _crm_mon_xml
     if _crm_mon is None:
         prog = utils.is_program("crm_mon")
         if not prog:
@@ -82,15 +86,527 @@ def crm_mon(opts=''):
             _crm_mon = "%s -1 -j" % (prog)
         else:
             _crm_mon = "%s -1" % (prog)
+        if "--output-as" in out:
+            _crm_mon_xml = "--output-as=xml"
+        else:
+            _crm_mon_xml = "--as-xml"
+
 
+def crm_mon(opts=''):
+    """
+    Run 'crm_mon -1'
+    opts: Additional options to pass to crm_mon
+    returns: rc, stdout
+    """
+    _init_crm_mon()
     status_cmd = "%s %s" % (_crm_mon, opts)
     return utils.get_stdout(utils.add_sudo(status_cmd))
 
 
+# crm_mon XML elements which are resources
+_RSC_TAGS = ("resource", "group", "clone", "bundle", "replica")
+_RUNNING_ROLES = ("Started", "Master", "Slave", "Promoted", "Unpromoted")
+# clone instances are summed up by role, in this order
+_ROLE_LABELS = (("Master", "Masters"), ("Promoted", "Promoted"),
+                ("Slave", "Slaves"), ("Unpromoted", "Unpromoted"),
+                ("Started", "Started"), ("Stopped", "Stopped"))
+
+
+def _true(attrs, name):
+    return attrs.get(name) == "true"
+
+
+def _strip_instance(ident):
+    base, sep, instance = ident.rpartition(':')
+    return base if sep and instance.isdigit() else ident
+
+
+# <resource>_<task>_<interval>, tasks such as migrate_to contain '_'
+_OP_KEY_RE = re.compile(r'(.*?)_(migrate_to|migrate_from|[^_]+)_\d+$')
+
+
+def _failure_rsc(failure):
+    "The id of the resource of the failed action."
+    op_key = failure.get("op_key", "")
+    suffix = "_%s_%s" % (failure.get("task"), failure.get("interval"))
+    if op_key.endswith(suffix) and len(op_key) > len(suffix):
+        return op_key[:-len(suffix)]
+    m = _OP_KEY_RE.match(op_key)
+    return m.group(1) if m else op_key
+
+
+class StatusResource(object):
+    '''
+    A resource in the crm_mon status: a primitive, group,
+    clone, bundle or bundle replica. attrs are the crm_mon
+    attributes (role, active, managed, failed, ...), nodes
+    the nodes it runs on.
+    '''
+    __slots__ = ("kind", "id", "attrs", "nodes", "children")
+
+    def __init__(self, kind, ident, attrs, nodes, children):
+        self.kind = kind
+        self.id = ident
+        self.attrs = attrs
+        self.nodes = nodes
+        self.children = children
+
+    @classmethod
+    def from_xml(cls, e):
+        attrs = dict(e.attrib)
+        ident = attrs.pop("id", "")
+        kind = "primitive" if e.tag == "resource" else e.tag
+        nodes = [n.get("name") for n in e.iterchildren("node")]
+        children = [cls.from_xml(c) for c in e.iterchildren(*_RSC_TAGS)]
+        return cls(kind, ident, attrs, nodes, children)
+
+    @property
+    def role(self):
+        return self.attrs.get("role", "Stopped")
+
+    @property
+    def active(self):
+        return _true(self.attrs, "active") or bool(self.nodes)
+
+    def walk(self):
+        "This resource and all resources it contains."
+        yield self
+        for c in self.children:
+            for r in c.walk():
+                yield r
+
+    def key(self):
+        '''
+        Everything shown about the resource, for comparing
+        snapshots.
+        '''
+        return (self.kind, self.id, tuple(sorted(self.attrs.items())), tuple(self.nodes),
+                tuple(c.key() for c in self.children))
+
+    def to_dict(self):
+        d = {"type": self.kind, "id": self.id}
+        d.update(self.attrs)
+        if self.kind == "primitive":
+            d["nodes"] = self.nodes
+        if self.children:
+            d["children"] = [c.to_dict() for c in self.children]
+        return d
+
+
+class StatusModel(object):
+    '''
+    The cluster status from crm_mon XML: the summary, the nodes,
+    the resources (as a tree) and the failed actions. It is
+    parsed once and then rendered as text or JSON, possibly
+    filtered.
+    '''
+    def __init__(self, summary, nodes, resources, failures):
+        self.summary = summary
+        self.nodes = nodes
+        self.resources = resources
+        self.failures = failures
+
+    @classmethod
+    def from_xml(cls, text):
+        '''
+        Parse the output of crm_mon --output-as=xml (or of the
+        older --as-xml). Returns None if it makes no sense.
+        '''
+        try:
+            root = etree.fromstring(text.encode('utf-8') if isinstance(text, str) else text)
+        except etree.Error:
+            return None
+        if root.find("resources") is None and root.find("nodes") is None:
+            return None
+        summary_elem = root.find("summary")
+        summary = dict((c.tag, dict(c.attrib)) for c in summary_elem) \
+            if summary_elem is not None else {}
+        nodes = [dict(n.attrib) for n in root.iterfind("nodes/node")]
+        resources = [StatusResource.from_xml(e)
+                     for e in root.iterfind("resources/*") if e.tag in _RSC_TAGS]
+        failures = [dict(f.attrib) for f in root.iterfind("failures/failure")]
+        return cls(summary, nodes, resources, failures)
+
+    def filtered(self, patterns):
+        '''
+        The status of the resources and nodes matching any of
+        the (fnmatch) patterns. Resources running on matching
+        nodes are kept as well, and so are all nodes if no node
+        matches.
+        '''
+        def match(name):
+            return any(fnmatch.fnmatch(name, p) for p in patterns)
+        nodes = [n for n in self.nodes if match(n.get("name", ""))]
+        node_names = set(n.get("name") for n in nodes)
+        resources = [r for r in self.resources
+                     if any(match(_strip_instance(x.id)) or node_names.intersection(x.nodes)
+                            for x in r.walk())]
+        rsc_ids = set(_strip_instance(x.id) for r in resources for x in r.walk())
+        failures = [f for f in self.failures
+                    if f.get("node") in node_names or
+                    _failure_rsc(f) in rsc_ids]
+        return StatusModel(self.summary, nodes or self.nodes, resources, failures)
+
+    def to_dict(self):
+        return {
+            "summary": self.summary,
+            "nodes": self.nodes,
+            "resources": [r.to_dict() for r in self.resources],
+            "failures": self.failures,
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2, sort_keys=True)
+
+    def render(self):
+        "The text view, much like crm_mon -1 -r."
+        return StatusRenderer(self).render()
+
+
+class StatusRenderer(object):
+    '''
+    Render the StatusModel as text, section by section.
+    '''
+    def __init__(self, model):
+        self.model = model
+        self.lines = []
+
+    def _out(self, level, s):
+        self.lines.append("%s* %s" % ("  " * level, s))
+
+    def render(self):
+        self.lines = []
+        for section in (self._summary, self._nodes, self._resources, self._failures):
+            n = len(self.lines)
+            section()
+            if len(self.lines) > n:
+                self.lines.append("")
+        return '\n'.join(self.lines)
+
+    def _summary(self):
+        summary = self.model.summary
+        if not summary:
+            return
+        self.lines.append("Cluster Summary:")
+        if "stack" in summary:
+            self._out(1, "Stack: %s" % summary["stack"].get("type", ""))
+        dc = summary.get("current_dc")
+        if dc is not None:
+            if _true(dc, "present"):
+                quorum = "with" if _true(dc, "with_quorum") else clidisplay.error("WITHOUT")
+                self._out(1, "Current DC: %s (version %s) - partition %s quorum" %
+                          (dc.get("name"), dc.get("version"), quorum))
+            else:
+                self._out(1, "Current DC: %s" % clidisplay.error("NONE"))
+        if "last_update" in summary:
+            self._out(1, "Last updated: %s" % summary["last_update"].get("time", ""))
+        change = summary.get("last_change")
+        if change is not None:
+            s = "Last change:  %s" % change.get("time", "")
+            for word, attr in (("by", "user"), ("via", "client"), ("on", "origin")):
+                if change.get(attr):
+                    s += " %s %s" % (word, change[attr])
+            self._out(1, s)
+        if "nodes_configured" in summary:
+            self._out(1, clidisplay.help_header("%s nodes configured" %
+                                                summary["nodes_configured"].get("number")))
+        rscs = summary.get("resources_configured")
+        if rscs is not None:
+            s = clidisplay.help_header("%s resource instances configured" % rscs.get("number"))
+            if rscs.get("disabled", "0") != "0":
+                s += " (%s DISABLED)" % rscs["disabled"]
+            if rscs.get("blocked", "0") != "0":
+                s += " (%s BLOCKED from further action due to failure)" % rscs["blocked"]
+            self._out(1, s)
+        if _true(summary.get("cluster_options", {}), "maintenance-mode"):
+            self.lines.append("")
+            self.lines.append(clidisplay.warn("              *** Resource management is DISABLED ***"))
+
+    def _node_state(self, node):
+        """
+        The state of the node and whether the node is only listed
+        with the other online (or offline) nodes.
+        """
+        online = _true(node, "online")
+        if _true(node, "unclean"):
+            return clidisplay.error("UNCLEAN (%s)" % ("online" if online else "offline")), False
+        if _true(node, "pending"):
+            return clidisplay.warn("pending"), False
+        if _true(node, "standby"):
+            what = "standby (on-fail)" if _true(node, "standby_onfail") else "standby"
+            if not online:
+                what += " (offline)"
+            return clidisplay.warn(what), False
+        if _true(node, "maintenance"):
+            return clidisplay.warn("maintenance"), False
+        prefix = {"remote": "Remote", "guest": "Guest"}.get(node.get("type"), "")
+        return prefix + ("Online" if online else "OFFLINE"), True
+
+    def _nodes(self):
+        if not self.model.nodes:
+            return
+        self.lines.append("Node List:")
+        lists = {}
+        for node in self.model.nodes:
+            state, listed = self._node_state(node)
+            if listed:
+                lists.setdefault(state, []).append(node.get("name"))
+            else:
+                self._out(1, "Node %s: %s" % (node.get("name"), state))
+        for label in sorted(lists, key=lambda l: ("OFFLINE" in l, l)):
+            color = clidisplay.error if "OFFLINE" in label else clidisplay.ok
+            self._out(1, "%s: [ %s ]" % (color(label), ' '.join(lists[label])))
+
+    def _resources(self):
+        self.lines.append("Full List of Resources:")
+        if not self.model.resources:
+            self.lines.append("  * No resources")
+        for r in self.model.resources:
+            self._resource(1, r)
+
+    def _flags(self, r):
+        flags = []
+        if _true(r.attrs, "orphaned"):
+            flags.append(clidisplay.warn("ORPHANED"))
+        if r.attrs.get("managed") == "false":
+            flags.append(clidisplay.warn("unmanaged"))
+        if _true(r.attrs, "disabled") or r.attrs.get("target_role") == "Stopped":
+            flags.append(clidisplay.warn("disabled"))
+        if _true(r.attrs, "blocked"):
+            flags.append(clidisplay.error("blocked"))
+        if _true(r.attrs, "failure_ignored"):
+            flags.append(clidisplay.warn("failure ignored"))
+        return ''.join(" (%s)" % f for f in flags)
+
+    def _role(self, r):
+        role = r.role
+        if _true(r.attrs, "failed"):
+            return clidisplay.error("FAILED" if role == "Started" else "FAILED %s" % role)
+        if role in _RUNNING_ROLES:
+            return clidisplay.ok(role)
+        return clidisplay.warn(role)
+
+    def _primitive(self, level, r):
+        s = "%s\t(%s):\t %s" % (clidisplay.help_header(r.id), r.attrs.get("resource_agent", ""),
+                                  self._role(r))
+        if len(r.nodes) == 1:
+            s += " %s" % r.nodes[0]
+        elif r.nodes:
+            s += " [ %s ]" % ' '.join(r.nodes)
+        self._out(level, s + self._flags(r))
+
+    def _resource(self, level, r):
+        if r.kind == "primitive":
+            self._primitive(level, r)
+        elif r.kind == "group":
+            self._out(level, "Resource Group: %s%s:" % (clidisplay.help_header(r.id), self._flags(r)))
+            for c in r.children:
+                self._resource(level + 1, c)
+        elif r.kind == "clone":
+            self._clone(level, r)
+        elif r.kind == "bundle":
+            self._out(level, "Container bundle set: %s [%s]%s:" %
+                      (clidisplay.help_header(r.id), r.attrs.get("image", ""), self._flags(r)))
+            for replica in r.children:
+                for c in replica.children:
+                    self._resource(level + 1, c)
+        else:
+            for c in r.children:
+                self._resource(level, c)
+
+    def _instance_state(self, r):
+        '''
+        (role, node) if the clone instance can be summed up with
+        the others, else None.
+        '''
+        members = r.children if r.kind == "group" else [r]
+        if not members or any(m.kind != "primitive" for m in members):
+            return None
+        states = set((m.role, tuple(m.nodes)) for m in members)
+        if len(states) != 1:
+            return None
+        role, nodes = states.pop()
+        if len(nodes) > 1 or any(_true(m.attrs, "failed") or m.attrs.get("managed") == "false"
+                                 for m in members):
+            return None
+        return role, nodes[0] if nodes else None
+
+    def _clone(self, level, r):
+        child = _strip_instance(r.children[0].id) if r.children else ""
+        kind = " (promotable)" if _true(r.attrs, "multi_state") else ""
+        if _true(r.attrs, "unique"):
+            kind += " (unique)"
+        self._out(level, "Clone Set: %s [%s]%s%s:" %
+                  (clidisplay.help_header(r.id), child, kind, self._flags(r)))
+        by_role = {}
+        stopped = 0
+        for c in r.children:
+            state = None if _true(r.attrs, "unique") else self._instance_state(c)
+            if state is None:
+                self._resource(level + 1, c)
+            elif state[1] is None:
+                stopped += 1
+            else:
+                by_role.setdefault(state[0], []).append(state[1])
+        for role, label in _ROLE_LABELS:
+            if role in by_role:
+                color = clidisplay.ok if role in _RUNNING_ROLES else clidisplay.warn
+                self._out(level + 1, "%s: [ %s ]" % (color(label), ' '.join(by_role[role])))
+        if stopped:
+            # crm_mon XML does not tell where the stopped
+            # instances could run
+            self._out(level + 1, "%s: %d instance%s" %
+                      (clidisplay.warn("Stopped"), stopped, "" if stopped == 1 else "s"))
+
+    def _failures(self):
+        if not self.model.failures:
+            return
+        self.lines.append(clidisplay.error("Failed Resource Actions:"))
+        for f in self.model.failures:
+            s = "%s on %s '%s' (%s): call=%s, status='%s'" % (
+                clidisplay.help_header(f.get("op_key", "")), f.get("node", ""),
+                clidisplay.error(f.get("exitstatus", "")), f.get("exitcode", ""),
+                f.get("call", ""), f.get("status", ""))
+            if f.get("exitreason"):
+                s += ", exitreason='%s'" % f["exitreason"]
+            if f.get("last-rc-change"):
+                s += ", last-rc-change='%s'" % f["last-rc-change"]
+            for attr in ("queued", "exec"):
+                if f.get(attr):
+                    s += ", %s=%sms" % (attr, f[attr])
+            self._out(1, s)
+
+    def render_changes(self, old):
+        """
+        Only what differs from the old model: the summary if it
+        changed, the nodes and the (top level) resources which
+        changed, appeared or went away, and the failed actions
+        if there are new ones or some were cleared. Empty if
+        nothing changed.
+        """
+        self.lines = []
+        model = self.model
+        if _summary_key(old.summary) != _summary_key(model.summary):
+            self._summary()
+        old_nodes = dict((n.get("name"), n) for n in old.nodes)
+        new_nodes = set(n.get("name") for n in model.nodes)
+        nodes = [n for n in model.nodes if old_nodes.get(n.get("name")) != n]
+        gone = [name for name in old_nodes if name not in new_nodes]
+        if nodes or gone:
+            self.lines.append("Node List:")
+            for node in nodes:
+                state, listed = self._node_state(node)
+                if listed:
+                    state = (clidisplay.error if "OFFLINE" in state else clidisplay.ok)(state)
+                self._out(1, "Node %s: %s" % (node.get("name"), state))
+            for name in gone:
+                self._out(1, "Node %s: %s" % (name, clidisplay.warn("removed")))
+        old_rscs = dict((r.id, r.key()) for r in old.resources)
+        new_rscs = set(r.id for r in model.resources)
+        rscs = [r for r in model.resources if old_rscs.get(r.id) != r.key()]
+        gone = [ident for ident in old_rscs if ident not in new_rscs]
+        if rscs or gone:
+            self.lines.append("Resources:")
+            for r in rscs:
+                self._resource(1, r)
+            for ident in gone:
+                self._out(1, "%s: %s" % (clidisplay.help_header(ident), clidisplay.warn("removed")))
+        if _failures_key(old.failures) != _failures_key(model.failures):
+            if model.failures:
+                self._failures()
+            else:
+                self.lines.append(clidisplay.ok("Failed Resource Actions: cleared"))
+        return '\n'.join(self.lines)
+
+
+def _summary_key(summary):
+    "The summary without the time of the crm_mon run."
+    return dict((k, v) for k, v in summary.items() if k != "last_update")
+
+
+def _failures_key(failures):
+    return sorted(tuple(sorted(f.items())) for f in failures)
+
+
+def crm_mon_model():
+    '''
+    Run crm_mon with XML output and return the StatusModel, or
+    None if crm_mon fails or its output cannot be parsed.
+    '''
+    _init_crm_mon()
+    rc, s = crm_mon("-r %s" % (_crm_mon_xml))
+    if rc != 0 or not s:
+        return None
+    return StatusModel.from_xml(s)
+
+
+def watch_status(patterns, interval):
+    """
+    Show the status, and then only what changes, until
+    interrupted. Every interval seconds the CIB version is
+    queried (which is cheap), and crm_mon is run only if the
+    CIB changed since the last run.
+    """
+    from . import xmlutil
+    model = None
+    version = None
+    try:
+        while True:
+            new_version = xmlutil.cib_version()
+            if model is None or new_version is None or new_version != version:
+                new = crm_mon_model()
+                if new is None and model is None:
+                    raise IOError("crm_mon XML output not available")
+                if new is not None:
+                    if patterns:
+                        new = new.filtered(patterns)
+                    if model is None:
+                        out = new.render()
+                    else:
+                        out = StatusRenderer(new).render_changes(model)
+                        if out:
+                            out = "%s\n%s" % (clidisplay.help_header(time.strftime("%c")), out)
+                    if out:
+                        print(out)
+                        sys.stdout.flush()
+                    model = new
+                    version = new_version
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    return True
+
+
+def _watch_interval(args):
+    """
+    The watch interval given by a "watch" or "--watch" argument
+    (optionally as watch=<seconds>), or None.
+    """
+    interval = None
+    for arg in filter(_is_watch, args):
+        value = arg.partition('=')[2]
+        try:
+            interval = float(value) if value else _WATCH_INTERVAL
+        except ValueError:
+            interval = 0
+        if interval <= 0:
+            raise ValueError("bad watch interval: %s" % (value))
+    return interval
+
+
+def _is_watch(arg):
+    return arg.lstrip('-').partition('=')[0] == "watch"
+
+
 def cmd_status(args):
     '''
     Calls crm_mon -1, passing optional extra arguments.
     Displays the output, paging if necessary.
+    Other words than options select the JSON output ("json")
+    or are patterns for resource and node names; those views
+    are rendered from the crm_mon XML output. Everything
+    from the first crm_mon option (starting with '-') on is
+    passed to crm_mon.
     Raises IOError if crm_mon fails.
     '''
     opts = {
@@ -110,6 +626,31 @@ def cmd_status(args):
         "brief": "-b",
         "full": "-ncrft",
     }
+    interval = _watch_interval(args)
+    args = [arg for arg in args if not _is_watch(arg)]
+    views = []
+    for i, arg in enumerate(args):
+        if arg.startswith('-'):
+            # the rest may be option values
+            views_end = i
+            break
+        if arg not in opts:
+            views.append(arg)
+    else:
+        views_end = len(args)
+    if interval is not None:
+        return watch_status([arg for arg in views if arg != "json"], interval)
+    args = [arg for arg in args[:views_end] if arg in opts] + args[views_end:]
+    # JSON and filters come from the crm_mon XML
+    if views:
+        patterns = [arg for arg in views if arg != "json"]
+        model = crm_mon_model()
+        if model is None:
+            raise IOError("crm_mon XML output not available")
+        if patterns:
+            model = model.filtered(patterns)
+        utils.page_string(model.to_json() if "json" in views else model.render())
+        return True
     extra = ' '.join(opts.get(arg, arg) for arg in args)
     if not args:
         extra = "-r"
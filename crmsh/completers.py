@@ -50,12 +50,13 @@ def resources(args=None):
         return []
     nodes = xmlutil.get_interesting_nodes(cib_el, [])
     rsc_id_list = [x.get("id") for x in nodes if xmlutil.is_resource(x)]
+    rscstate = xmlutil.RscState()
     if args and args[0] in ['promote', 'demote']:
-        return [item for item in rsc_id_list if xmlutil.RscState().is_ms(item)]
+        return [item for item in rsc_id_list if rscstate.is_ms(item)]
     if args and args[0] == "started":
-        return [item for item in rsc_id_list if xmlutil.RscState().is_running(item)]
+        return [item for item in rsc_id_list if rscstate.is_running(item)]
     if args and args[0] == "stopped":
-        return [item for item in rsc_id_list if not xmlutil.RscState().is_running(item)]
+        return [item for item in rsc_id_list if not rscstate.is_running(item)]
     return rsc_id_list
 
 
@@ -81,4 +82,4 @@ shadows = call(xmlutil.listshadows)
 
 status_option = """full bynode inactive ops timing failcounts
                    verbose quiet xml simple tickets noheaders
-                   detail brief""".split()
+                   detail brief json watch""".split()
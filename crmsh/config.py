@@ -252,7 +252,11 @@ DEFAULTS = {
         'ignore_missing_metadata': opt_boolean('no'),
         'report_tool_options': opt_string(''),
         'lock_timeout': opt_string('120'),
-        'obscure_pattern': opt_string('passw*')
+        'obscure_pattern': opt_string('passw*'),
+        'commit_refresh': opt_choice('incremental', ('incremental', 'full')),
+        'metadata_workers': opt_string('8'),
+        'parse_workers': opt_string('4'),
+        'cib_cache': opt_boolean('yes')
     },
     'path': {
         'sharedir': opt_dir('%(datadir)s/crmsh'),
@@ -317,6 +321,7 @@ class _Configuration(object):
         self._defaults = None
         self._systemwide = None
         self._user = None
+        self.serial = 0  # bumped on every change
 
     def _safe_read(self, config_parser_inst, file_list):
         """
@@ -329,6 +334,7 @@ class _Configuration(object):
                 raise
 
     def load(self):
+        self.serial += 1
         self._defaults = configparser.ConfigParser()
         for section, keys in DEFAULTS.items():
             self._defaults.add_section(section)
@@ -375,6 +381,7 @@ class _Configuration(object):
         if not self._defaults.has_option(section, name):
             raise ValueError("Setting invalid option %s.%s" % (section, name))
         DEFAULTS[section][name].validate(value)
+        self.serial += 1
         if self._user is None:
             self._user = configparser.ConfigParser()
         if not self._user.has_section(section):
@@ -394,6 +401,7 @@ class _Configuration(object):
 
     def reset(self):
         '''reset to what is on disk'''
+        self.serial += 1
         self._user = configparser.ConfigParser()
         self._user.read([_PERUSER])
 
@@ -476,6 +484,14 @@ def reset():
     _configuration.reset()
 
 
+def serial():
+    '''
+    Changes whenever any option changes, for callers which
+    cache values derived from options.
+    '''
+    return _configuration.serial
+
+
 load()
 core = _Section('core')
 path = _Section('path')
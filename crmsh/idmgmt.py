@@ -3,7 +3,6 @@
 #
 # Make sure that ids are unique.
 
-import copy
 from . import constants
 from . import xmlutil
 from .msg import common_error, id_used_err
@@ -14,23 +13,33 @@ ok = True  # error var
 
 
 def push_state():
-    _state.append(copy.deepcopy(_id_store))
+    '''
+    Start journaling changes to the id store.
+    Only ids which get added or removed are recorded.
+    '''
+    _state.append([])
 
 
 def pop_state():
     try:
-        global _id_store
-        _id_store = _state.pop()
-        return True
+        journal = _state.pop()
     except IndexError:
         return False
+    for node_id, was_used in reversed(journal):
+        if was_used:
+            _id_store[node_id] = 1
+        else:
+            _id_store.pop(node_id, None)
+    return True
 
 
 def drop_state():
     try:
-        _state.pop()
-    except KeyError:
-        pass
+        journal = _state.pop()
+    except IndexError:
+        return
+    if _state:
+        _state[-1].extend(journal)
 
 
 def clean_state():
@@ -38,6 +47,11 @@ def clean_state():
     _state = []
 
 
+def _journal(node_id):
+    if _state:
+        _state[-1].append((node_id, node_id in _id_store))
+
+
 def new(node, pfx):
     '''
     Create a unique id for the xml node.
@@ -133,6 +147,8 @@ def id_in_use(obj_id):
 def save(node_id):
     if not node_id:
         return
+    if node_id not in _id_store:
+        _journal(node_id)
     _id_store[node_id] = 1
 
 
@@ -150,10 +166,9 @@ def rename(old_id, new_id):
 def remove(node_id):
     if not node_id:
         return
-    try:
+    if node_id in _id_store:
+        _journal(node_id)
         del _id_store[node_id]
-    except KeyError:
-        pass
 
 
 def clear():
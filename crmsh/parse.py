@@ -43,6 +43,13 @@ _ROLE2_RE = re.compile(r"role=(.+)$", re.IGNORECASE)
 _TARGET_RE = re.compile(r'([^:]+):$')
 _TARGET_ATTR_RE = re.compile(r'attr:([\w-]+)=([\w-]+)$', re.IGNORECASE)
 _TARGET_PATTERN_RE = re.compile(r'pattern:(.+)$', re.IGNORECASE)
+_VALUE_SOURCE_RE = re.compile(r"^(?P<val_src>[^\s{}]+)({(?P<val>\S+)})?$")
+_NUMERIC_SCORE_RE = re.compile(r"^[+-]?(inf(inity)?|INF(INITY)?|[0-9]+)$")
+_INFINITY_RE = re.compile(r"inf(inity)?|INF(INITY)?")
+_KEYWORD_RE = re.compile(r'[\w-]+$')
+# see split_line
+_SHLEX_SPECIAL_RE = re.compile(r"[\'\\\x0b\x0c\x1c-\x1f]|[^\x00-\x7f]")
+_DQ_TOKEN_RE = re.compile(r'(?:[^ \t\r\n"]+|"[^"]*")+')
 TERMINATORS = ('params', 'meta', 'utilization', 'operations', 'op', 'op_params', 'op_meta', 'rule', 'attributes')
 
 
@@ -132,9 +139,26 @@ class Validation(object):
 validator = Validation()
 
 
+class _KeywordMatch(object):
+    "The match of a literal keyword, see BaseParser.try_match."
+    __slots__ = ("_tok",)
+
+    def __init__(self, tok):
+        self._tok = tok
+
+    def group(self, idx=0):
+        if idx != 0:
+            raise IndexError("no such group")
+        return self._tok
+
+
 class BaseParser(object):
     _BINOP_RE = None
-    _VALUE_SOURCE_RE = None
+    # string patterns given to try_match: keywords (and choices
+    # of keywords) as sets of lowercase words, the rest compiled
+    _token_patterns = {}
+    # match_nvpairs_bykey patterns per set of keys
+    _bykey_patterns = {}
 
     def parse(self, cmd):
         "Called by do_parse(). Raises ParseError if parsing fails."
@@ -180,20 +204,41 @@ class BaseParser(object):
         rx: compiled regex or string
         returns: the match object, if the match is successful
         """
-        tok = self.current_token()
+        if self._currtok >= len(self._cmd):
+            return None
+        tok = self._cmd[self._currtok]
         if not tok:
             return None
         if isinstance(rx, str):
-            if not rx.endswith('$'):
-                rx = rx + '$'
-            self._lastmatch = re.match(rx, tok, re.IGNORECASE)
+            rx = self._token_pattern(rx)
+        if isinstance(rx, frozenset):
+            m = _KeywordMatch(tok) if tok.lower() in rx else None
         else:
-            self._lastmatch = rx.match(tok)
-        if self._lastmatch is not None:
-            if not self.has_tokens():
-                self.err("Unexpected end of line")
+            m = rx.match(tok)
+        self._lastmatch = m
+        if m is not None:
             self._currtok += 1
-        return self._lastmatch
+        return m
+
+    def _token_pattern(self, rx):
+        """
+        The pattern for a regex given as string: the words if it
+        is just a keyword or a choice of keywords (those are
+        compared without running the regex engine), else the
+        compiled regex, matching case-insensitively the whole
+        token.
+        """
+        try:
+            return self._token_patterns[rx]
+        except KeyError:
+            pass
+        words = rx.split('|')
+        if all(_KEYWORD_RE.match(w) for w in words):
+            pat = frozenset(w.lower() for w in words)
+        else:
+            pat = re.compile(rx if rx.endswith('$') else rx + '$', re.IGNORECASE)
+        self._token_patterns[rx] = pat
+        return pat
 
     def match(self, rx, errmsg=None):
         """
@@ -259,8 +304,11 @@ class BaseParser(object):
         matches string of p=v | p tokens, but only if p is in valid_keys
         Returns list of <nvpair> tags
         """
-        _KEY_RE = re.compile(r'(%s)=(.+)$' % '|'.join(valid_keys))
-        _NOVAL_RE = re.compile(r'(%s)$' % '|'.join(valid_keys))
+        keys = tuple(valid_keys)
+        if keys not in self._bykey_patterns:
+            self._bykey_patterns[keys] = (re.compile(r'(%s)=(.+)$' % '|'.join(keys)),
+                                          re.compile(r'(%s)$' % '|'.join(keys)))
+        _KEY_RE, _NOVAL_RE = self._bykey_patterns[keys]
         ret = []
         while True:
             if self.try_match(_KEY_RE):
@@ -532,9 +580,7 @@ class BaseParser(object):
             node = xmlutil.new('expression', operation=binop, attribute=attr)
             xmlutil.maybe_set(node, 'type', optype)
             val = self.match_any()
-            if not self._VALUE_SOURCE_RE:
-                self._VALUE_SOURCE_RE = re.compile(r"^(?P<val_src>[^\s{}]+)({(?P<val>\S+)})?$")
-            val_src_match = re.match(self._VALUE_SOURCE_RE, val)
+            val_src_match = _VALUE_SOURCE_RE.match(val)
             if val_src_match.group('val') is None:
                 node.set('value', val)
             else:
@@ -586,8 +632,8 @@ class BaseParser(object):
     def validate_score(self, score, noattr=False, to_kind=False):
         if not noattr and score in olist(constants.score_types):
             return ["score", constants.score_types[score.lower()]]
-        elif re.match("^[+-]?(inf(inity)?|INF(INITY)?|[0-9]+)$", score):
-            score = re.sub("inf(inity)?|INF(INITY)?", "INFINITY", score)
+        elif _NUMERIC_SCORE_RE.match(score):
+            score = _INFINITY_RE.sub("INFINITY", score)
             if to_kind:
                 return ["kind", score_to_kind(score)]
             else:
@@ -1690,6 +1736,19 @@ class ResourceSet(object):
         return ret
 
 
+def split_line(s):
+    '''
+    Same as shlex.split(s), but without going through shlex
+    for lines which have no single quotes and escapes (which
+    is most of them).
+    '''
+    if _SHLEX_SPECIAL_RE.search(s) or s.count('"') % 2:
+        return shlex.split(s)
+    if '"' not in s:
+        return s.split()
+    return [t.replace('"', '') for t in _DQ_TOKEN_RE.findall(s)]
+
+
 def parse(s, comments=None):
     '''
     Input: a list of tokens (or a CLI format string).
@@ -1721,7 +1780,7 @@ def parse(s, comments=None):
                 common_err(e)
                 return False
         else:
-            s = shlex.split(s)
+            s = split_line(s)
     # but there shouldn't be any newlines (?)
     while '\n' in s:
         s.remove('\n')
@@ -1737,17 +1796,27 @@ def parse(s, comments=None):
 
     try:
         ret = parser.do_parse(s)
-        if ret is not None and len(comments) > 0:
-            if ret.tag in constants.defaults_tags:
-                xmlutil.stuff_comments(ret[0], comments)
-            else:
-                xmlutil.stuff_comments(ret, comments)
-            del comments[:]
+        if ret is not None:
+            add_comments(ret, comments)
         return ret
     except ParseError:
         return False
 
 
+def add_comments(node, comments):
+    """
+    Put the comments collected by parse in front of the
+    parsed element and clear them.
+    """
+    if not comments:
+        return
+    if node.tag in constants.defaults_tags:
+        xmlutil.stuff_comments(node[0], comments)
+    else:
+        xmlutil.stuff_comments(node, comments)
+    del comments[:]
+
+
 def score_to_kind(score):
     """
     Convert score to kind for rsc_order
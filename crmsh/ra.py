@@ -2,6 +2,10 @@
 # See COPYING for license information.
 
 import os
+import sys
+import io
+import threading
+import contextlib
 import subprocess
 import copy
 import re
@@ -225,6 +229,77 @@ def ra_meta(ra_class, ra_type, ra_provider):
         return l
 
 
+# meta-data fetched by prefetch_meta and not used yet:
+# "ra_meta-<agent>" -> (what the fetch printed, meta-data lines)
+_prefetched = {}
+# what finding out how to get the meta-data printed, shown
+# before the first prefetched meta-data is used
+_prefetch_probe = []
+
+
+class _WorkerOutput(object):
+    '''
+    Keeps what each worker thread prints (the .EXT lines in
+    regression tests), so that it can be shown when the
+    meta-data is used, in the same order as without prefetching.
+    '''
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffers = {}
+
+    def write(self, s):
+        self.buffers.get(threading.get_ident(), self.stream).write(s)
+
+    def flush(self):
+        pass
+
+    def run(self, f, *args):
+        buf = io.StringIO()
+        self.buffers[threading.get_ident()] = buf
+        try:
+            return buf, f(*args)
+        finally:
+            del self.buffers[threading.get_ident()]
+
+
+def prefetch_meta(ra_l):
+    """
+    Fetch the meta-data of the given RAInfo objects which is
+    not in the cache yet. The external programs are run
+    concurrently, by at most core.metadata_workers at a time.
+    The meta-data is parsed (and errors reported) only once
+    it is used.
+    """
+    todo = {}
+    for ra in ra_l:
+        if ra.ra_class in constants.meta_progs or ra.ra_class in constants.meta_progs_20:
+            continue
+        sid = "ra_meta-%s" % ra
+        if not ra.ra_type or sid in _prefetched or cache.is_cached(sid):
+            continue
+        todo.setdefault(sid, ra)
+    try:
+        workers = int(config.core.metadata_workers)
+    except ValueError:
+        workers = 1
+    if workers <= 1 or len(todo) <= 1:
+        return
+    import concurrent.futures
+    # decide on the method before starting the workers
+    probe = io.StringIO()
+    with contextlib.redirect_stdout(probe):
+        if not can_use_crm_resource():
+            can_use_lrmadmin()
+    _prefetch_probe.append(probe.getvalue())
+    out = _WorkerOutput(sys.stdout)
+    with contextlib.redirect_stdout(out), \
+            concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, len(todo))) as pool:
+        results = list(pool.map(lambda ra: out.run(ra_meta, ra.ra_class, ra.ra_type, ra.ra_provider),
+                                todo.values()))
+    for sid, (buf, l) in zip(todo, results):
+        _prefetched[sid] = (buf.getvalue(), l)
+
+
 @utils.memoize
 def get_pe_meta():
     return RAInfo(utils.pacemaker_schedulerd(), "metadata")
@@ -316,6 +391,8 @@ class RAInfo(object):
     '''
     A resource agent and whatever's useful about it.
     '''
+    __slots__ = ("excluded_from_completion", "ra_class", "ra_type", "ra_provider",
+                 "ra_elem", "broken_ra")
     ra_tab = "    "  # four horses
     required_ops = ("start", "stop")
     skip_ops = ("meta-data", "validate-all")
@@ -620,7 +697,11 @@ class RAInfo(object):
         sid = "ra_meta-%s" % self
         if cache.is_cached(sid):
             return cache.retrieve(sid)
-        if self.ra_class in constants.meta_progs:
+        if sid in _prefetched:
+            printed, l = _prefetched.pop(sid)
+            sys.stdout.write(''.join(_prefetch_probe) + printed)
+            del _prefetch_probe[:]
+        elif self.ra_class in constants.meta_progs:
             l = prog_meta(self.ra_class)
         elif self.ra_class in constants.meta_progs_20:
             l = prog_meta(self.ra_class)
@@ -16,6 +16,7 @@ from .cibconfig import mkset_obj, cib_factory
 from . import clidisplay
 from . import term
 from . import options
+from . import ordereddict
 from .msg import common_err, common_info, common_warn
 from .msg import err_buf, syntax_err
 from . import rsctest
@@ -837,9 +838,15 @@ class CibConfig(command.UI):
 
     @command.skill_level('administrator')
     @command.completers(_id_list)
-    def do_rename(self, context, old_id, new_id):
-        "usage: rename <old_id> <new_id>"
-        return cib_factory.rename(old_id, new_id)
+    def do_rename(self, context, old_id, new_id, *args):
+        "usage: rename <old_id> <new_id> [<old_id> <new_id>...]"
+        if len(args) % 2 != 0:
+            context.fatal_error("Expected pairs of old and new ids")
+        ids = (old_id, new_id) + args
+        renames = ordereddict.odict(zip(ids[::2], ids[1::2]))
+        if len(renames) != len(ids) // 2:
+            context.fatal_error("Cannot rename an object more than once")
+        return cib_factory.bulk_rename(renames)
 
     @command.skill_level('administrator')
     @command.completers(compl.choice(['nodes']))
@@ -1,7 +1,6 @@
 # Copyright (C) 2013 Kristoffer Gronlund <kgronlund@suse.com>
 # See COPYING for license information.
 
-import shlex
 import sys
 from . import config
 from . import utils
@@ -10,6 +9,7 @@ from .msg import common_err, common_info, common_warn
 from . import ui_utils
 from . import userdir
 from . import constants
+from . import parse
 
 
 # import logging
@@ -68,7 +68,7 @@ class Context(object):
         rv = True
         cmd = False
         try:
-            tokens = shlex.split(line)
+            tokens = parse.split_line(line)
             while tokens:
                 token, tokens = tokens[0], tokens[1:]
                 self.command_name = token
@@ -132,7 +132,7 @@ class Context(object):
                 return self.current_level().get_completions()
 
             try:
-                tokens = shlex.split(line)
+                tokens = parse.split_line(line)
                 if complete_next:
                     tokens += ['']
                 while tokens:
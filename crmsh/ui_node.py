@@ -161,7 +161,10 @@ def _find_attr(args):
     """
     if not len(args) >= 2:
         return []
-    cib = xmlutil.cibdump2elem()
+    if args[0] == "status-attr":
+        cib = xmlutil.cibdump2elem()
+    else:
+        cib = xmlutil.cibdump2elem_nostatus()
     if cib is None:
         return []
 
@@ -468,7 +471,7 @@ class NodeMgmt(command.UI):
         server -- print server hostname / address for each node
         server <node> ... -- print server hostname / address for node
         """
-        cib = xmlutil.cibdump2elem()
+        cib = xmlutil.cibdump2elem_nostatus()
         if cib is None:
             return False
         for node in cib.xpath('/cib/configuration/nodes/node'):
@@ -173,9 +173,18 @@ Show cluster status. The status is displayed by `crm_mon`. Supply
 additional arguments for more information or different format.
 See `crm_mon(8)` for more details.
 
+The `json` option prints the status as JSON. Other words are
+shell patterns which limit the output to matching resources and
+nodes.
+
+With `watch`, the status is shown and then updated with the nodes
+and resources which change, until interrupted. crm_mon runs only
+when the CIB changed (checked every 2 seconds by default).
+
 Usage:
 ...............
-status [<option> ...]
+status [<option> ...] [json] [<pattern> ...]
+status watch[=<seconds>] [<pattern> ...]
 
 option :: bynode | inactive | ops | timing | failcounts
 ...............
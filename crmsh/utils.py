@@ -14,6 +14,7 @@ import shlex
 import bz2
 import fnmatch
 import gc
+import itertools
 import ipaddress
 import argparse
 import random
@@ -392,6 +393,11 @@ def ensure_sudo_readable(f):
 
 
 def pipe_string(cmd, s):
+    """
+    Pipe s to cmd. s may also be an iterable of strings, which
+    are written as they come: if cmd exits early (e.g. a pager
+    which the user quit), the rest is not generated.
+    """
     rc = -1  # command failed
     cmd = add_sudo(cmd)
     common_debug("piping string to %s" % cmd)
@@ -399,15 +405,25 @@ def pipe_string(cmd, s):
         print(".EXT", cmd)
     p = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE)
     try:
-        # communicate() expects encoded bytes
-        if isinstance(s, str):
-            s = s.encode('utf-8')
-        p.communicate(s)
+        if isinstance(s, (str, bytes)):
+            # communicate() expects encoded bytes
+            if isinstance(s, str):
+                s = s.encode('utf-8')
+            p.communicate(s)
+        else:
+            for chunk in s:
+                p.stdin.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+            p.stdin.close()
         p.wait()
         rc = p.returncode
     except IOError as msg:
         if "Broken pipe" not in str(msg):
             common_err(msg)
+        try:
+            p.stdin.close()
+        except IOError:
+            pass
+        p.wait()
     return rc
 
 
@@ -1145,7 +1161,8 @@ def edit_file_ext(fname, template=''):
         raise IOError(e)
 
 
-def need_pager(s, w, h):
+def _screen_lines(s, w, h):
+    'Number of screen lines s takes (counting stops at h).'
     from math import ceil
     cnt = 0
     for l in s.split('\n'):
@@ -1153,8 +1170,12 @@ def need_pager(s, w, h):
         l = re.sub(r'\${\w+}', '', l)
         cnt += int(ceil((len(l) + 0.5) / w))
         if cnt >= h:
-            return True
-    return False
+            break
+    return cnt
+
+
+def need_pager(s, w, h):
+    return _screen_lines(s, w, h) >= h
 
 
 def term_render(s):
@@ -1196,7 +1217,34 @@ def page_gen(g):
         for line in g:
             sys.stdout.write(term_render(line))
     else:
-        pipe_string(get_pager_cmd(), term_render("".join(g)))
+        pipe_string(get_pager_cmd(), (term_render(line) for line in g))
+
+
+def page_gen_lines(g):
+    '''
+    Like page_string, but for text generated in pieces (each
+    one or more lines, without the trailing newline). Output
+    starts as soon as it is clear whether the pager is needed
+    and the pieces go straight to the terminal or the pager.
+    If the pager exits early, the rest is not generated.
+    '''
+    if not config.core.pager or not can_ask() or options.batch:
+        page_gen(s + '\n' for s in g)
+        return
+    w, h = get_winsize()
+    head = []
+    cnt = 0
+    for s in g:
+        head.append(s)
+        cnt += _screen_lines(s, w, h - cnt)
+        if cnt >= h:
+            constants.need_reset = True
+            try:
+                page_gen(s + '\n' for s in itertools.chain(head, g))
+            finally:
+                constants.need_reset = False
+            return
+    page_string('\n'.join(head))
 
 
 def page_file(filename):
@@ -1579,6 +1627,12 @@ def cibadmin_can_patch():
     return is_min_pcmk_ver("1.1.11")
 
 
+@memoize
+def cibadmin_can_patch_v2():
+    # v2 patches (format="2") are understood since 1.1.12
+    return is_min_pcmk_ver("1.1.12")
+
+
 # quote function from python module shlex.py in python 3.3
 
 _find_unsafe = re.compile(r'[^\w@%+=:,./-]').search
@@ -1980,6 +2034,10 @@ def obscured(key, value):
     return value
 
 
+def obscured_patterns():
+    return tuple(_obscured_nvpairs)
+
+
 @contextmanager
 def obscure(obscure_list):
     global _obscured_nvpairs
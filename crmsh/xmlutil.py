@@ -2,7 +2,9 @@
 # Copyright (C) 2016 Kristoffer Gronlund <kgronlund@suse.com>
 # See COPYING for license information.
 
+import io
 import os
+import re
 import subprocess
 from lxml import etree, doctestcompare
 import copy
@@ -80,6 +82,74 @@ def sudocall(cmd):
         return None, None, None
 
 
+# cibadmin dump of the whole CIB by (CIB in use, user), each
+# with the CIB version it was read at
+_cib_reads = {}
+_cib_version_re = re.compile(r'\s(admin_epoch|epoch|num_updates)\s*=\s*["\']([^"\']*)')
+
+
+def _cib_text_version(text):
+    "The version attributes of the cib element which starts text."
+    m = re.search(r'<cib\b[^>]*>', text)
+    if not m:
+        return None
+    d = dict(_cib_version_re.findall(m.group(0)))
+    return tuple(d.get(a) for a in ("admin_epoch", "epoch", "num_updates"))
+
+
+def cib_version():
+    "Ask cibadmin for the current CIB version (a cheap query)."
+    rc, outp, _ = sudocall("%s --xpath /cib --no-children" % (cib_dump))
+    if rc != 0 or not outp:
+        return None
+    return _cib_text_version(outp)
+
+
+def _cib_section_text(cibtext, section):
+    "The section of the CIB text, as cibadmin -o would dump it."
+    try:
+        cib_elem = etree.fromstring(cibtext)
+    except etree.Error:
+        return None
+    if section not in ("configuration", "status"):
+        section = "configuration/%s" % (section)
+    node = cib_elem.find(section)
+    if node is None:
+        return None
+    return etree.tostring(node, encoding='unicode')
+
+
+def cib_query(cmd, section=None):
+    '''
+    Run a cibadmin query of the whole CIB or of its section,
+    like sudocall. The whole CIB is kept in memory and repeated
+    queries are served from it for as long as the CIB version
+    (epoch and num_updates) stays the same, which takes only a
+    short query instead of dumping (and then parsing) the CIB.
+    Without a CIB in memory the query is just run.
+    '''
+    key = (get_cib_in_use(), os.getenv("CIB_file"), config.core.user)
+    cached = _cib_reads.get(key)
+    if cached is not None:
+        version = cib_version()
+        if version is not None and cached[0] == version:
+            outp = cached[1] if section is None else _cib_section_text(cached[1], section)
+            if outp is not None:
+                common_debug("%s: CIB version %s unchanged" % (cmd, '.'.join(str(x) for x in version)))
+                return 0, outp, ""
+    rc, outp, errp = sudocall(cmd)
+    if rc == 0 and outp is not None and section is None:
+        version = _cib_text_version(outp)
+        if version is not None:
+            _cib_reads[key] = (version, outp)
+    return rc, outp, errp
+
+
+def cib_query_cache_clear():
+    "Forget the CIB read so far, e.g. after changing it."
+    _cib_reads.clear()
+
+
 def cibdump2file(fname):
     _, outp, _ = sudocall(cib_dump)
     if outp is not None:
@@ -114,7 +184,7 @@ def cibdump2elem(section=None):
         cmd = "%s -o %s" % (cib_dump, section)
     else:
         cmd = cib_dump
-    rc, outp, errp = sudocall(cmd)
+    rc, outp, errp = cib_query(cmd, section)
     if rc == 0:
         return cibtext2elem(outp)
     elif rc != constants.cib_no_section_rc:
@@ -122,6 +192,71 @@ def cibdump2elem(section=None):
     return None
 
 
+def cibversion2elem(params=None):
+    '''
+    Just the cib element with the version attributes, much
+    cheaper than reading the whole CIB.
+    '''
+    cmd = "%s --xpath /cib --no-children" % (cib_dump)
+    rc, outp, errp = sudocall(cmd)
+    if rc == 0:
+        return cibtext2elem(outp)
+    # older cibadmin may not know --no-children
+    common_debug("running %s: %s" % (cmd, errp))
+    cib_elem = cibdump2elem_nostatus()
+    if cib_elem is not None:
+        del cib_elem[:]
+    return cib_elem
+
+
+def cibtext2elem_nostatus(cibtext):
+    '''
+    Like cibtext2elem, but drop the status section while
+    parsing. Status elements are thrown away as soon as they
+    are complete, so the (often big) status tree is never
+    built.
+    '''
+    data = cibtext if isinstance(cibtext, bytes) else cibtext.encode('utf-8')
+    cib_elem = None
+    depth = 0
+    in_status = False
+    try:
+        for event, e in etree.iterparse(io.BytesIO(data), events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if depth == 1:
+                    cib_elem = e
+                elif depth == 2 and e.tag == "status":
+                    in_status = True
+                continue
+            depth -= 1
+            if not in_status:
+                continue
+            if depth == 1:
+                in_status = False
+                cib_elem.remove(e)
+            else:
+                e.clear()
+                while e.getprevious() is not None:
+                    del e.getparent()[0]
+    except Exception as err:
+        cib_parse_err(err, cibtext)
+        return None
+    return cib_elem
+
+
+def cibdump2elem_nostatus(params=None):
+    '''
+    The CIB without the status section, for the users which
+    need only the configuration (and the cib attributes).
+    '''
+    rc, outp, errp = cib_query(cib_dump)
+    if rc == 0:
+        return cibtext2elem_nostatus(outp)
+    common_error("running %s: %s" % (cib_dump, errp))
+    return None
+
+
 def read_cib(fun, params=None):
     cib_elem = fun(params)
     if cib_elem is None or cib_elem.tag != "cib":
@@ -176,18 +311,22 @@ def get_top_cib_nodes(node, nodes_l):
 class RscState(object):
     '''
     Get the resource status and some other relevant bits.
-    In particular, this class should allow for a bit of caching
-    of cibadmin -Q -o resources output in case we need to check
-    more than one resource in a row.
+    The configuration (cibadmin -Q -o configuration) and the
+    status (one crm_mon snapshot) are read once and then used
+    for any number of resources.
     '''
 
     rsc_status = "crm_resource -W -r '%s'"
+    # newer crm_mon first
+    status_snapshot = ("crm_mon --output-as=xml", "crm_mon -1 --as-xml")
 
     def __init__(self):
         self.current_cib = None
         self.rsc_elem = None
         self.prop_elem = None
         self.rsc_dflt_elem = None
+        self.rsc_index = None
+        self.running = None
 
     def _init_cib(self):
         cib = cibdump2elem("configuration")
@@ -195,6 +334,35 @@ class RscState(object):
         self.rsc_elem = get_first_conf_elem(cib, "resources")
         self.prop_elem = get_first_conf_elem(cib, "crm_config/cluster_property_set")
         self.rsc_dflt_elem = get_first_conf_elem(cib, "rsc_defaults/meta_attributes")
+        self.rsc_index = {}
+        if self.rsc_elem is not None:
+            for e in self.rsc_elem.iter():
+                ident = e.get("id")
+                if ident is not None:
+                    self.rsc_index.setdefault(ident, e)
+
+    def _init_status(self):
+        '''
+        Collect the ids of the running resources (and of the
+        groups and clones they belong to) from a crm_mon
+        snapshot. If crm_mon is of no help, running is left
+        False and crm_resource is asked for every resource.
+        '''
+        self.running = False
+        for cmd in self.status_snapshot:
+            rc, outp = get_stdout(cmd, stderr_on=False)
+            if rc != 0 or not outp:
+                continue
+            try:
+                root = etree.fromstring(outp.encode('utf-8'))
+            except etree.Error as err:
+                common_debug("%s: %s" % (cmd, err))
+                continue
+            resources = root.find("resources")
+            if resources is None:
+                continue
+            self.running = crm_mon_running(resources)
+            return
 
     def rsc2node(self, ident):
         '''
@@ -207,12 +375,7 @@ class RscState(object):
             self._init_cib()
         if self.rsc_elem is None:
             return None
-        # does this need to be optimized?
-        expr = './/*[@id="%s"]' % ident
-        try:
-            return self.rsc_elem.xpath(expr)[0]
-        except (IndexError, AttributeError):
-            return None
+        return self.rsc_index.get(ident)
 
     def is_ms(self, ident):
         '''
@@ -273,6 +436,10 @@ class RscState(object):
         if not is_live_cib():
             return False
         test_id = self.rsc_clone(ident) or ident
+        if self.running is None:
+            self._init_status()
+        if self.running is not False:
+            return test_id in self.running
         rc, outp = get_stdout(self.rsc_status % test_id, stderr_on=False)
         return outp.find("running") > 0 and outp.find("NOT") == -1
 
@@ -293,6 +460,27 @@ class RscState(object):
         return not (self.is_running(ident) and not self.is_group(ident) and self.is_managed(ident))
 
 
+def crm_mon_running(resources):
+    '''
+    The ids of the running resources in the resources element
+    of the crm_mon XML output, including the groups, clones
+    and bundles with running members. Clone instance numbers
+    are dropped.
+    '''
+    running = set()
+    for r in resources.iter("resource"):
+        if r.get("active") != "true" and r.get("nodes_running_on", "0") == "0":
+            continue
+        e = r
+        while e is not None and e is not resources:
+            ident = e.get("id")
+            if ident and e.tag in ("resource", "group", "clone", "bundle"):
+                base, sep, instance = ident.rpartition(':')
+                running.add(base if sep and instance.isdigit() else ident)
+            e = e.getparent()
+    return running
+
+
 def resources_xml():
     return cibdump2elem("resources")
 
@@ -335,7 +523,7 @@ def mk_rsc_type(n):
 
 
 def listnodes(include_remote_nodes=True):
-    cib = cibdump2elem()
+    cib = cibdump2elem() if include_remote_nodes else cibdump2elem_nostatus()
     if cib is None:
         return []
     local_nodes = cib.xpath('/cib/configuration/nodes/node/@uname')
@@ -360,10 +548,10 @@ def is_our_node(s):
 
 
 def is_remote_node(n):
-    cib = cibdump2elem()
-    if cib is None:
+    status = cibdump2elem("status")
+    if status is None:
         return False
-    remote_nodes = cib.xpath('/cib/status/node_state[@remote_node="true"]/@uname')
+    remote_nodes = status.xpath('/status/node_state[@remote_node="true"]/@uname')
     return any(n == r for r in remote_nodes if r)
 
 
@@ -613,6 +801,28 @@ def is_related(rsc_id, node):
     return False
 
 
+def related_ids(node):
+    """
+    ids of all elements to which the given node has a
+    direct relation in the sense of is_related (plus the
+    template of a primitive). Used to maintain the reverse
+    reference graph.
+    """
+    ids = set()
+    if is_constraint(node):
+        ids.update(node.get(attr) for attr in constants.constraint_rsc_refs)
+        ids.update(node.xpath("resource_set/resource_ref/@id"))
+    elif node.tag == 'tag':
+        ids.update(node.xpath('.//obj_ref/@id'))
+    elif is_container(node):
+        ids.update(node.xpath('.//primitive/@id|.//group/@id|.//clone/@id|.//master/@id'))
+    elif is_primitive(node):
+        ids.add(node.get("template"))
+    # don't keep the (smart) xpath strings and thereby the
+    # document alive
+    return set(str(x) for x in ids if x is not None)
+
+
 def sort_container_children(e_list):
     '''
     Make sure that attributes's nodes are first, followed by the
@@ -690,6 +900,169 @@ def sanitize_cib_for_patching(doc):
     xml_processnodes(doc, true, remove_dflt_attrs)
     xml_processnodes(doc, true, remove_text)
 
+
+# the CIB takes care of these, see crm_diff --no-version
+_patch_version_attrs = ("admin_epoch", "epoch", "num_updates")
+
+
+def _patch_path(node):
+    "Path of node in the format used by v2 patches."
+    l = []
+    while node is not None:
+        ident = node.get("id")
+        l.append(ident and "%s[@id='%s']" % (node.tag, ident) or node.tag)
+        node = node.getparent()
+    return "/" + "/".join(reversed(l))
+
+
+def _patch_same(a, b):
+    '''
+    Ordered comparison of two subtrees. Serializing is much
+    cheaper than walking the trees. Trees which differ only in
+    the order of attributes or in whitespace come out different
+    and are then compared element by element by _patch_node.
+    '''
+    return etree.tostring(a, with_tail=False) == etree.tostring(b, with_tail=False)
+
+
+def _patch_children(node):
+    '''
+    List children of node as (key, child, addressable). Elements
+    are keyed by tag and id, everything else (comments, elements
+    without id) by tag and occurrence. A child is addressable if
+    a path can refer to it, i.e. it has an id or it is the only
+    element with that tag.
+    '''
+    tags = defaultdict(int)
+    keys = defaultdict(int)
+    l = []
+    for c in node.iterchildren():
+        ident = isinstance(c.tag, str) and c.get("id") or None
+        key = (c.tag, ident, keys[(c.tag, ident)])
+        keys[(c.tag, ident)] += 1
+        tags[c.tag] += 1
+        l.append((key, c))
+    return [(key, c, isinstance(c.tag, str) and
+             (key[1] and keys[key[:2]] == 1 or tags[c.tag] == 1))
+            for key, c in l]
+
+
+def _patch_lis(seq):
+    "Return positions of a longest increasing subsequence of seq."
+    import bisect
+    tails, tail_pos = [], []
+    prev = [None] * len(seq)
+    for n, v in enumerate(seq):
+        j = bisect.bisect_left(tails, v)
+        if j:
+            prev[n] = tail_pos[j-1]
+        if j == len(tails):
+            tails.append(v)
+            tail_pos.append(n)
+        else:
+            tails[j] = v
+            tail_pos[j] = n
+    rc = set()
+    n = tail_pos[-1] if tail_pos else None
+    while n is not None:
+        rc.add(n)
+        n = prev[n]
+    return rc
+
+
+def _patch_delete(node):
+    return etree.Element("change", operation="delete", path=_patch_path(node))
+
+
+def _patch_create(parent, position, node):
+    change = etree.Element("change", operation="create",
+                           path=_patch_path(parent), position=str(position))
+    change.append(copy.deepcopy(node))
+    return change
+
+
+def _patch_modify(old, new, changes, skip_attrs=()):
+    change = etree.Element("change", operation="modify", path=_patch_path(old))
+    change_list = etree.SubElement(change, "change-list")
+    for name, value in new.items():
+        if name not in skip_attrs and old.get(name) != value:
+            etree.SubElement(change_list, "change-attr",
+                             name=name, operation="set", value=value)
+    for name in old.keys():
+        if name not in skip_attrs and name not in new.attrib:
+            etree.SubElement(change_list, "change-attr",
+                             name=name, operation="unset")
+    if len(change_list) == 0:
+        return
+    result = etree.SubElement(change, "change-result")
+    etree.SubElement(result, new.tag, attrib=dict(new.items()))
+    changes.append(change)
+
+
+def _patch_node(old, new, changes, skip_attrs=()):
+    '''
+    Append changes turning old into new to the changes list.
+    Returns False if that is not possible without replacing
+    old as a whole.
+
+    Reordered children are deleted and created again instead
+    of moved: different pacemaker versions apply moves in
+    different ways, but deletes followed by creates in order
+    of position are unambiguous.
+    '''
+    _patch_modify(old, new, changes, skip_attrs)
+    old_l = _patch_children(old)
+    new_l = _patch_children(new)
+    new_d = dict((key, (i, c, addr)) for i, (key, c, addr) in enumerate(new_l))
+    kept, deleted, created = [], [], set()
+    for key, c, addr in old_l:
+        if key in new_d:
+            i, nc, new_addr = new_d[key]
+            kept.append((i, c, nc, addr and new_addr))
+        elif not addr:
+            return False
+        else:
+            deleted.append(c)
+    in_order = _patch_lis([i for i, _, _, _ in kept])
+    recurse = []
+    for n, (i, c, nc, addr) in enumerate(kept):
+        if n in in_order and _patch_same(c, nc):
+            continue
+        if not addr:
+            return False
+        if n in in_order:
+            recurse.append((i, c, nc))
+        else:
+            deleted.append(c)
+            created.add(i)
+    old_keys = set(key for key, _, _ in old_l)
+    created.update(i for i, (key, _, _) in enumerate(new_l) if key not in old_keys)
+    changes.extend(_patch_delete(c) for c in deleted)
+    changes.extend(_patch_create(old, i, new_l[i][1]) for i in sorted(created))
+    for i, c, nc in recurse:
+        sub_changes = []
+        if _patch_node(c, nc, sub_changes):
+            changes.extend(sub_changes)
+        else:
+            changes.append(_patch_delete(c))
+            changes.append(_patch_create(old, i, nc))
+    return True
+
+
+def cib_patchset(orig, cib):
+    '''
+    Produce a Pacemaker v2 patch (without version details) which
+    turns the orig CIB into cib. Returns None if the difference
+    cannot be expressed as a patch.
+    '''
+    diff = etree.Element("diff", format="2")
+    changes = []
+    if not _patch_node(orig, cib, changes, skip_attrs=_patch_version_attrs):
+        return None
+    diff.extend(changes)
+    return diff
+
+
 def is_simpleconstraint(node):
     return len(node.xpath("resource_set/resource_ref")) == 0
 
@@ -1004,8 +1377,8 @@ def rset_convert(c_obj):
         # in case there are multiple non-sequential sets
         if rset.get("sequential"):
             del rset.attrib["sequential"]
+            c_obj.updated = True
         rsetcnt += 1
-    c_obj.modified = True
     cli = c_obj.repr_cli(format_mode=-1)
     cli = cli.replace("_rsc_set_ ", "")
     newnode = c_obj.cli2node(cli)
@@ -1053,6 +1426,53 @@ def rename_rscref(c_obj, old_id, new_id):
         err_buf.info("modified %s from %s to %s" % (str(c_obj), old_id, new_id))
 
 
+def rename_refs(c_obj, renames):
+    '''
+    Rename all references to the ids in renames (old id -> new
+    id) found in a constraint (also in resource sets), a tag or
+    the fencing topology. Returns True if c_obj was modified.
+    '''
+    node = c_obj.node
+    renamed = []
+    if is_constraint(node):
+        for attr in constants.constraint_rsc_refs:
+            old_id = node.get(attr)
+            if old_id in renames:
+                node.set(attr, renames[old_id])
+                renamed.append(old_id)
+        rrefs = node.xpath("resource_set/resource_ref")
+        d = {}
+        for rref in rrefs:
+            rsc_id = rref.get("id")
+            if rsc_id in renames:
+                renamed.append(rsc_id)
+                rsc_id = renames[rsc_id]
+                rref.set("id", rsc_id)
+            d[rsc_id] = d.get(rsc_id, 0) + 1
+        if len(renamed) > 0 and len(rrefs) > 0:
+            rset_uniq(c_obj, d)
+            if sum(d.values()) == 2:
+                rset_convert(c_obj)
+    elif node.tag == "tag":
+        for ref in node.iterchildren("obj_ref"):
+            old_id = ref.get("id")
+            if old_id in renames:
+                ref.set("id", renames[old_id])
+                renamed.append(old_id)
+    elif node.tag == "fencing-topology":
+        for level in node.iterchildren("fencing-level"):
+            devices = level.get("devices", "").split(",")
+            if any(dev in renames for dev in devices):
+                renamed.extend(dev for dev in devices if dev in renames)
+                level.set("devices", ",".join(renames.get(dev, dev) for dev in devices))
+    if not renamed:
+        return False
+    c_obj.updated = True
+    for old_id in sorted(set(renamed), key=renamed.index):
+        err_buf.info("modified %s from %s to %s" % (str(c_obj), old_id, renames[old_id]))
+    return True
+
+
 def delete_rscref(c_obj, rsc_id):
     return delete_rscref_simple(c_obj, rsc_id) or \
         delete_rscref_rset(c_obj, rsc_id)
@@ -1244,33 +1664,65 @@ def get_set_instace_attributes(e, create=False):
 _checker = doctestcompare.LXMLOutputChecker()
 
 
-def xml_equals_unordered(a, b):
+def _xml_sortkey(v):
     """
-    used by xml_equals to compare xml trees without ordering.
-    NOTE: resource_set children SHOULD be compared with ordering.
+    Children of an element compare in the order of this key.
+    Primitives all sort the same, so that their order (in
+    groups) matters.
     """
-    def fail(msg):
-        common_debug("%s!=%s: %s" % (a.tag, b.tag, msg))
-        return False
+    if v.tag == 'primitive':
+        return v.tag
+    tagflat = isinstance(v.tag, str) and v.tag or v.text
+    return tagflat + ''.join(sorted(list(v.attrib.keys()) + list(v.attrib.values())))
 
-    def tagflat(x):
-        return isinstance(x.tag, str) and x.tag or x.text
 
-    def sortby(v):
-        if v.tag == 'primitive':
-            return v.tag
-        return tagflat(v) + ''.join(sorted(list(v.attrib.keys()) + list(v.attrib.values())))
+def _safe_strip(text):
+    return text is not None and text.strip() or ''
 
-    def safe_strip(text):
-        return text is not None and text.strip() or ''
+
+def xml_digest(e):
+    """
+    Structural digest of the subtree e: two trees are equal
+    according to xml_equals_unordered if and only if their
+    digests are equal. Attributes and children (except
+    primitives in groups and anything in resource sets) are
+    taken in a canonical order and whitespace around text is
+    ignored. The digest is a nested tuple, which is hashable
+    and compared without any chance of collisions.
+    """
+    tag = e.tag
+    if tag.__class__ is not str:
+        return ("<!%s>" % tag.__name__, (), _safe_strip(e.text), _safe_strip(e.tail), ())
+    if len(e) == 0:
+        children = ()
+    elif tag == 'resource_set':
+        children = tuple(xml_digest(c) for c in e)
+    else:
+        l = [xml_digest(c) for c in e]
+        # primitives keep their order, the rest is sorted
+        children = tuple([d for d in l if d[0] == 'primitive'] +
+                         sorted(d for d in l if d[0] != 'primitive'))
+    text, tail = e.text, e.tail
+    return (tag, tuple(sorted(e.attrib.items())),
+            text.strip() if text else '', tail.strip() if tail else '', children)
+
+
+def _xml_report_unordered(a, b):
+    """
+    Log the first difference between two trees which are not
+    equal according to xml_equals_unordered.
+    """
+    def fail(msg):
+        common_debug("%s!=%s: %s" % (a.tag, b.tag, msg))
+        return False
 
     if a.tag != b.tag:
         return fail("tags differ: %s != %s" % (a.tag, b.tag))
     elif a.attrib != b.attrib:
         return fail("attributes differ: %s != %s" % (a.attrib, b.attrib))
-    elif safe_strip(a.text) != safe_strip(b.text):
+    elif _safe_strip(a.text) != _safe_strip(b.text):
         return fail("text differ %s != %s" % (repr(a.text), repr(b.text)))
-    elif safe_strip(a.tail) != safe_strip(b.tail):
+    elif _safe_strip(a.tail) != _safe_strip(b.tail):
         return fail("tails differ: %s != %s" % (a.tail, b.tail))
     elif len(a) != len(b):
         return fail("number of children differ")
@@ -1280,20 +1732,46 @@ def xml_equals_unordered(a, b):
     # order matters here, but in a strange way:
     # all primitive tags should sort the same..
     if a.tag == 'resource_set':
-        return all(xml_equals_unordered(a, b) for a, b in zip(a, b))
+        return all(_xml_report_unordered(a, b) for a, b in zip(a, b))
     else:
-        sorted_children = list(zip(sorted(a, key=sortby), sorted(b, key=sortby)))
-        return all(xml_equals_unordered(a, b) for a, b in sorted_children)
+        sorted_children = list(zip(sorted(a, key=_xml_sortkey), sorted(b, key=_xml_sortkey)))
+        return all(_xml_report_unordered(a, b) for a, b in sorted_children)
+
+
+def xml_equals_unordered(a, b):
+    """
+    used by xml_equals to compare xml trees without ordering.
+    NOTE: resource_set children SHOULD be compared with ordering.
+    """
+    if etree.tostring(a) == etree.tostring(b) or xml_digest(a) == xml_digest(b):
+        return True
+    if config.core.debug:
+        _xml_report_unordered(a, b)
+    return False
+
+
+def _print_difference(n, m):
+    # somewhat strange, but that's how this works
+    from doctest import Example
+    example = Example("etree.tostring(n)", xml_tostring(n))
+    got = xml_tostring(m)
+    print(_checker.output_difference(example, got, 0))
+
+
+def xml_show_difference(n, m):
+    """
+    Show how two trees which are not equal (see xml_equals)
+    differ, in debug mode.
+    """
+    if config.core.debug:
+        _xml_report_unordered(n, m)
+        _print_difference(n, m)
 
 
 def xml_equals(n, m, show=False):
     rc = xml_equals_unordered(n, m)
     if not rc and show and config.core.debug:
-        # somewhat strange, but that's how this works
-        from doctest import Example
-        example = Example("etree.tostring(n)", xml_tostring(n))
-        got = xml_tostring(m)
-        print(_checker.output_difference(example, got, 0))
+        _print_difference(n, m)
     return rc
 
 
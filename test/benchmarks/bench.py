@@ -0,0 +1,405 @@
+#!/usr/bin/python3
+"""
+Benchmarks for the configure layer on synthetic CIBs.
+
+    test/benchmarks/bench.py --primitives 2000 --output report.json
+    test/benchmarks/bench.py --baseline report.json show filter
+
+The CIB is made by cibgen from a fixed seed. cibadmin is replaced
+by a stub which serves the generated CIB and accepts patches, so
+no cluster is needed. The report is JSON: the parameters, the
+environment and the timings of every run (in seconds) for each
+benchmark. Given a baseline report, the best runs are compared
+and the exit status is 1 if a benchmark got slower than allowed.
+"""
+
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(_here, "..", ".."))
+sys.path.insert(0, _here)
+
+import cibgen  # noqa: E402
+
+
+_STUB = '''#!%(python)s
+# cibadmin stand-in for the benchmarks
+import os
+import sys
+from lxml import etree
+
+cib_file = os.environ["CRMSH_BENCH_CIB"]
+args = sys.argv[1:]
+if "--no-children" in args:
+    # the version query is cheap for the real cibadmin too
+    for _, cib in etree.iterparse(cib_file, events=("start",)):
+        break
+    sys.stdout.write('<cib %%s/>' %% " ".join('%%s="%%s"' %% x for x in cib.items()))
+    sys.exit(0)
+cib = etree.parse(cib_file).getroot()
+if "-P" in args or "-R" in args:
+    data = sys.stdin.read()
+    with open(cib_file + ".patch", "w") as f:
+        f.write(data)
+    cib.set("epoch", str(int(cib.get("epoch")) + 1))
+    etree.ElementTree(cib).write(cib_file)
+elif any(a.startswith("-Q") for a in args):
+    if "-o" in args:
+        section = args[args.index("-o") + 1]
+        found = cib.xpath("//%%s" %% section)
+        if not found:
+            sys.exit(6)
+        cib = found[0]
+    sys.stdout.write(etree.tostring(cib, encoding="unicode"))
+elif "-U" in args:
+    sys.stdin.read()
+'''
+
+
+class Env(object):
+    '''
+    crmsh set up to work on the generated CIB through the
+    cibadmin stub.
+    '''
+    def __init__(self, gen):
+        self.gen = gen
+        self.cib_text = gen.tostring()
+        self.tmpdir = tempfile.mkdtemp(prefix="crmsh-bench-")
+        self.cib_file = os.path.join(self.tmpdir, "cib.xml")
+        stub = os.path.join(self.tmpdir, "cibadmin")
+        with open(stub, "w") as f:
+            f.write(_STUB % {"python": sys.executable})
+        os.chmod(stub, 0o755)
+        os.environ["PATH"] = "%s:%s" % (self.tmpdir, os.environ.get("PATH", ""))
+        os.environ["CRMSH_BENCH_CIB"] = self.cib_file
+        os.environ["CIB_file"] = self.cib_file
+
+        from crmsh import config, constants, options
+        options.regression_tests = False
+        config.path.sharedir = os.path.join(_here, "..", "..", "doc")
+        config.path.crm_dtd_dir = os.path.join(_here, "..", "unittests", "schemas")
+        config.core.debug = False
+        config.core.check_frequency = "never"
+        config.core.ignore_missing_metadata = True
+        # only initialize_cached uses the CIB cache
+        config.core.cib_cache = False
+        constants.pcmk_version = "2.0.0"
+        from crmsh import cibcache
+        cibcache._cache_dir = os.path.join(self.tmpdir, "cache")
+        from crmsh import cibconfig
+        self.factory = cibconfig.cib_factory
+        self.reload()
+        self.show_text = self.show()
+
+    def cleanup(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def reload(self, cib_text=None):
+        "Start from the generated (or the given) CIB."
+        with open(self.cib_file, "w") as f:
+            f.write(cib_text or self.cib_text)
+        self.factory.reset()
+        if not self.factory.initialize(cib=cib_text or self.cib_text):
+            raise RuntimeError("cannot load the generated CIB")
+
+    def show(self):
+        from crmsh import cibconfig
+        return cibconfig.mkset_obj().repr_nopretty()
+
+    def sample(self, ids, fraction, salt):
+        rnd = random.Random("%s-%s" % (self.gen.seed, salt))
+        return rnd.sample(ids, max(1, int(len(ids) * fraction)))
+
+    def top_primitives(self):
+        return [x.obj_id for x in self.factory.get_elems_on_type("type:primitive")
+                if x.parent is None]
+
+
+#
+# the benchmarks: setup (not timed) returns the argument for
+# the timed part, which may return a dict of things worth
+# reporting besides the time (given "lines", the throughput
+# is reported too)
+#
+def setup_parse(env):
+    from crmsh import utils
+    return list(utils.lines2cli(env.show_text))
+
+
+def run_parse(env, lines):
+    from crmsh import parse
+    for line in lines:
+        if parse.parse(line, comments=[]) in (None, False):
+            raise RuntimeError("cannot parse: %s" % line)
+    return {"lines": len(lines)}
+
+
+def setup_initialize(env):
+    env.factory.reset()
+
+
+def run_initialize(env, arg):
+    env.factory.initialize(cib=env.cib_text)
+
+
+def setup_initialize_cached(env):
+    "The CIB file did not change since the last run."
+    from crmsh import config
+    config.core.cib_cache = True
+    env.reload()
+    env.factory.reset()
+
+
+def run_initialize_cached(env, arg):
+    from crmsh import config
+    try:
+        env.factory.initialize(cib=env.cib_text)
+    finally:
+        config.core.cib_cache = False
+
+
+def setup_show(env):
+    env.reload()
+
+
+def run_show(env, arg):
+    env.show()
+
+
+def setup_show_cached(env):
+    env.reload()
+    env.show()
+
+
+def setup_filter(env):
+    return (["type:primitive"],
+            ["type:primitive", "and", "tag:db*"],
+            ["rsc-000*"],
+            ["type:group", "or", "type:clone"],
+            ["related:rsc-00001"])
+
+
+def run_filter(env, filters):
+    for f in filters:
+        ok, _ = env.factory.filter_objects(f)
+        if not ok:
+            raise RuntimeError("filter failed: %s" % f)
+
+
+def setup_load(env):
+    empty = cibgen.CibGenerator(nodes=env.gen.nodes, primitives=0, groups=0,
+                                clones=0, constraints=0, tags=0, seed=env.gen.seed)
+    env.reload(empty.tostring())
+    return env.show_text
+
+
+def run_load(env, text):
+    from crmsh import cibconfig
+    if not cibconfig.mkset_obj().save(text, remove=False, method='update'):
+        raise RuntimeError("load failed")
+
+
+def setup_delete(env):
+    env.reload()
+    return env.sample(env.top_primitives(), 0.1, "delete")
+
+
+def run_delete(env, ids):
+    if not env.factory.delete(*ids):
+        raise RuntimeError("delete failed")
+
+
+def setup_rename(env):
+    env.reload()
+    return env.sample(env.top_primitives(), 0.01, "rename")
+
+
+def run_rename(env, ids):
+    for obj_id in ids:
+        if env.factory.rename(obj_id, obj_id + "-renamed") is False:
+            raise RuntimeError("rename of %s failed" % obj_id)
+
+
+def setup_reads(env):
+    "Commands read the CIB several times, e.g. for resource state."
+    from crmsh import xmlutil
+    env.reload()
+    xmlutil.cib_query_cache_clear()
+
+
+def run_reads(env, arg):
+    from crmsh import xmlutil
+    for _ in range(5):
+        if xmlutil.cibdump2elem() is None or xmlutil.cibdump2elem("resources") is None:
+            raise RuntimeError("cannot read the CIB")
+
+
+def setup_commit(env):
+    "Delete, change and add a few objects."
+    env.reload()
+    ids = env.top_primitives()
+    env.factory.delete(*env.sample(ids, 0.02, "commit-delete"))
+    for obj_id in env.sample(ids, 0.02, "commit-change"):
+        obj = env.factory.find_object(obj_id)
+        if obj is not None:
+            obj.node.set("description", "changed")
+            obj.set_updated()
+    for n in range(max(1, len(ids) // 50)):
+        env.factory.create_from_cli("primitive bench-new-%d ocf:pacemaker:Dummy" % n)
+
+
+def run_commit(env, arg):
+    if not env.factory.commit():
+        raise RuntimeError("commit failed")
+    patch = env.cib_file + ".patch"
+    return {"patch_bytes": os.path.getsize(patch) if os.path.exists(patch) else 0}
+
+
+BENCHMARKS = (
+    ("parse", setup_parse, run_parse),
+    ("initialize", setup_initialize, run_initialize),
+    ("initialize_cached", setup_initialize_cached, run_initialize_cached),
+    ("show", setup_show, run_show),
+    ("show_cached", setup_show_cached, run_show),
+    ("filter", setup_filter, run_filter),
+    ("load", setup_load, run_load),
+    ("delete", setup_delete, run_delete),
+    ("rename", setup_rename, run_rename),
+    ("reads", setup_reads, run_reads),
+    ("commit", setup_commit, run_commit),
+)
+
+
+def run_benchmarks(env, names, repeat):
+    results = {}
+    for name, setup, run in BENCHMARKS:
+        if names and name not in names:
+            continue
+        runs = []
+        info = None
+        for _ in range(repeat):
+            arg = setup(env)
+            gc.collect()
+            t = time.perf_counter()
+            info = run(env, arg)
+            runs.append(time.perf_counter() - t)
+        results[name] = {
+            "runs": runs,
+            "min": min(runs),
+            "median": statistics.median(runs),
+        }
+        results[name].update(info or {})
+        if "lines" in results[name] and results[name]["min"]:
+            results[name]["lines_per_sec"] = results[name]["lines"] / results[name]["min"]
+    return results
+
+
+def compare(report, baseline, max_ratio):
+    '''
+    Print the ratios of the best runs against the baseline,
+    return False on regressions.
+    '''
+    ok = True
+    if baseline.get("params") != report["params"]:
+        print("warning: the baseline was made with different parameters", file=sys.stderr)
+    for name, res in report["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base or not base["min"]:
+            continue
+        ratio = res["min"] / base["min"]
+        res["baseline_ratio"] = ratio
+        flag = ""
+        if ratio > max_ratio:
+            flag = "  REGRESSION"
+            ok = False
+        print("%-12s %10.4fs %10.4fs %6.2fx%s" % (name, base["min"], res["min"], ratio, flag),
+              file=sys.stderr)
+    return ok
+
+
+def make_report(env, args):
+    return {
+        "format": 1,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": env.gen.params(),
+        "repeat": args.repeat,
+        "objects": len(env.factory.cib_objects),
+        "results": run_benchmarks(env, args.benchmarks, args.repeat),
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="crmsh configure layer benchmarks")
+    parser.add_argument("benchmarks", nargs="*", help="benchmarks to run (default: all)")
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--primitives", type=int, default=1000)
+    parser.add_argument("--groups", type=int, default=None,
+                        help="default: primitives/20")
+    parser.add_argument("--clones", type=int, default=None,
+                        help="default: primitives/50")
+    parser.add_argument("--constraints", type=int, default=None,
+                        help="default: primitives/2")
+    parser.add_argument("--tags", type=int, default=None,
+                        help="default: primitives/100")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", "-o", help="write the report here (default: stdout)")
+    parser.add_argument("--baseline", help="compare with this report")
+    parser.add_argument("--max-ratio", type=float, default=1.25,
+                        help="slowdown against the baseline regarded as a regression")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, _, _ in BENCHMARKS:
+            print(name)
+        return 0
+    unknown = set(args.benchmarks) - set(name for name, _, _ in BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmarks: %s" % ", ".join(sorted(unknown)))
+
+    def dflt(v, div):
+        return v if v is not None else max(1, args.primitives // div)
+    gen = cibgen.CibGenerator(nodes=args.nodes,
+                              primitives=args.primitives,
+                              groups=dflt(args.groups, 20),
+                              clones=dflt(args.clones, 50),
+                              constraints=dflt(args.constraints, 2),
+                              tags=dflt(args.tags, 100),
+                              seed=args.seed)
+    # crmsh messages must not get into the report
+    with contextlib.redirect_stdout(sys.stderr):
+        env = Env(gen)
+        try:
+            report = make_report(env, args)
+        finally:
+            env.cleanup()
+    rc = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            if not compare(report, json.load(f), args.max_ratio):
+                rc = 1
+    s = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(s + "\n")
+    else:
+        print(s)
+    return rc
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,169 @@
+"""
+Generate synthetic CIBs of a given size.
+
+The same parameters and seed always produce the same CIB, so
+that benchmark results can be compared between runs.
+"""
+
+import random
+from lxml import etree
+
+
+_AGENTS = (
+    ("ocf", "heartbeat", "IPaddr2"),
+    ("ocf", "heartbeat", "Filesystem"),
+    ("ocf", "pacemaker", "Dummy"),
+    ("systemd", None, "httpd"),
+)
+
+
+class CibGenerator(object):
+    '''
+    A CIB with the given number of nodes, primitives, groups,
+    clones, constraints and tags. Groups and clones are made
+    of primitives (which are counted with the primitives).
+    '''
+    def __init__(self, nodes=3, primitives=100, groups=10, clones=5,
+                 constraints=50, tags=5, seed=0):
+        self.nodes = nodes
+        self.primitives = primitives
+        self.groups = groups
+        self.clones = clones
+        self.constraints = constraints
+        self.tags = tags
+        self.seed = seed
+
+    def params(self):
+        return {
+            "nodes": self.nodes,
+            "primitives": self.primitives,
+            "groups": self.groups,
+            "clones": self.clones,
+            "constraints": self.constraints,
+            "tags": self.tags,
+            "seed": self.seed,
+        }
+
+    def _nvset(self, parent, tag, set_id, pairs):
+        nvset = etree.SubElement(parent, tag, id=set_id)
+        for name, value in pairs:
+            etree.SubElement(nvset, "nvpair", id="%s-%s" % (set_id, name),
+                             name=name, value=value)
+        return nvset
+
+    def _primitive(self, rnd, parent, n):
+        rsc_id = "rsc-%05d" % n
+        ra_class, provider, ra_type = rnd.choice(_AGENTS)
+        prim = etree.SubElement(parent, "primitive", id=rsc_id)
+        prim.set("class", ra_class)
+        if provider:
+            prim.set("provider", provider)
+        prim.set("type", ra_type)
+        if ra_type == "IPaddr2":
+            params = [("ip", "10.%d.%d.%d" % (n // 65536, n // 256 % 256, n % 256))]
+        elif ra_type == "Filesystem":
+            params = [("device", "/dev/vg/lv%d" % n),
+                      ("directory", "/srv/%d" % n),
+                      ("fstype", "xfs")]
+        elif ra_type == "Dummy":
+            params = [("state", "/run/dummy-%d.state" % n)]
+        else:
+            params = []
+        if params:
+            self._nvset(prim, "instance_attributes", "%s-instance_attributes" % rsc_id, params)
+        if rnd.random() < 0.3:
+            self._nvset(prim, "meta_attributes", "%s-meta_attributes" % rsc_id,
+                        [("target-role", rnd.choice(("Started", "Stopped")))])
+        ops = etree.SubElement(prim, "operations")
+        interval = rnd.choice((10, 20, 30, 60))
+        etree.SubElement(ops, "op", id="%s-monitor-%ds" % (rsc_id, interval),
+                         name="monitor", interval="%ds" % interval, timeout="20s")
+        etree.SubElement(ops, "op", id="%s-start-0" % rsc_id,
+                         name="start", interval="0", timeout="60s")
+        etree.SubElement(ops, "op", id="%s-stop-0" % rsc_id,
+                         name="stop", interval="0", timeout="60s")
+        return prim
+
+    def _constraint(self, rnd, parent, n, rscs, node_names):
+        kind = rnd.choice(("location", "colocation", "order"))
+        if kind == "location" or len(rscs) < 2:
+            return etree.SubElement(parent, "rsc_location", id="loc-%05d" % n,
+                                    rsc=rnd.choice(rscs),
+                                    score=str(rnd.choice((100, 200, "INFINITY", "-INFINITY"))),
+                                    node=rnd.choice(node_names))
+        a, b = rnd.sample(rscs, 2)
+        if kind == "colocation":
+            col = etree.SubElement(parent, "rsc_colocation", id="col-%05d" % n,
+                                   rsc=a, score="INFINITY")
+            col.set("with-rsc", b)
+            return col
+        return etree.SubElement(parent, "rsc_order", id="ord-%05d" % n,
+                                first=a, then=b, kind=rnd.choice(("Mandatory", "Optional")))
+
+    def generate(self):
+        "The CIB as an etree element."
+        rnd = random.Random(self.seed)
+        cib = etree.Element("cib", epoch="1", num_updates="0", admin_epoch="0")
+        cib.set("validate-with", "pacemaker-1.2")
+        cib.set("crm_feature_set", "3.0.9")
+        configuration = etree.SubElement(cib, "configuration")
+        crm_config = etree.SubElement(configuration, "crm_config")
+        self._nvset(crm_config, "cluster_property_set", "cib-bootstrap-options",
+                    [("stonith-enabled", "false"),
+                     ("cluster-infrastructure", "corosync")])
+        nodes = etree.SubElement(configuration, "nodes")
+        node_names = []
+        for n in range(1, self.nodes + 1):
+            uname = "node-%03d" % n
+            etree.SubElement(nodes, "node", id=str(n), uname=uname)
+            node_names.append(uname)
+        resources = etree.SubElement(configuration, "resources")
+        prims = [self._primitive(rnd, resources, n) for n in range(self.primitives)]
+
+        # groups and clones take primitives from the front of the
+        # list, the rest stay top level
+        top = []
+        pos = 0
+        for n in range(self.groups):
+            size = rnd.randint(2, 5)
+            members = prims[pos:pos + size]
+            if len(members) < 2:
+                break
+            pos += size
+            grp = etree.SubElement(resources, "group", id="grp-%04d" % n)
+            for prim in members:
+                grp.append(prim)
+            top.append(grp)
+        for n in range(self.clones):
+            if pos >= len(prims):
+                break
+            cln = etree.SubElement(resources, "clone", id="cln-%04d" % n)
+            cln.append(prims[pos])
+            pos += 1
+            self._nvset(cln, "meta_attributes", "cln-%04d-meta_attributes" % n,
+                        [("interleave", "true")])
+            top.append(cln)
+        top.extend(prims[pos:])
+        rscs = [x.get("id") for x in top]
+
+        constraints = etree.SubElement(configuration, "constraints")
+        if rscs and node_names:
+            for n in range(self.constraints):
+                self._constraint(rnd, constraints, n, rscs, node_names)
+
+        if self.tags and prims:
+            tags = etree.SubElement(configuration, "tags")
+            ids = [x.get("id") for x in prims]
+            for n in range(self.tags):
+                tag = etree.SubElement(tags, "tag", id="db-%03d" % n)
+                for rsc_id in rnd.sample(ids, min(len(ids), rnd.randint(1, 10))):
+                    etree.SubElement(tag, "obj_ref", id=rsc_id)
+
+        rsc_defaults = etree.SubElement(configuration, "rsc_defaults")
+        self._nvset(rsc_defaults, "meta_attributes", "rsc-options",
+                    [("resource-stickiness", "1")])
+        etree.SubElement(cib, "status")
+        return cib
+
+    def tostring(self):
+        return etree.tostring(self.generate(), pretty_print=True, encoding='unicode')
@@ -19,6 +19,14 @@ config.path.crm_dtd_dir = os.path.join(_here, "schemas")
 
 os.environ["CIB_file"] = "test"
 
+# keep the CLI validation results out of the user's cache
+import atexit
+import shutil
+import tempfile
+from crmsh import cibcache
+cibcache._cache_dir = tempfile.mkdtemp(prefix="crmsh-test-")
+atexit.register(shutil.rmtree, cibcache._cache_dir, True)
+
 
 # install a basic CIB
 from crmsh import cibconfig
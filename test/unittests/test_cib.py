@@ -30,3 +30,870 @@ def test_cib_schema_change():
     factory._copy_cib_attributes(copy_of_cib, factory.cib_orig)
     assert factory.cib_attrs["validate-with"] == "pacemaker-1.1"
     assert factory.cib_elem.get("validate-with") == "pacemaker-1.1"
+
+
+def test_object_index():
+    "Id and uname lookups stay consistent through edits and rollback"
+    factory._push_state()
+    try:
+        factory.create_object('node', '1:', 'dell71')
+        factory.create_object('primitive', 'idx1', 'Dummy')
+        assert factory.find_object('idx1').obj_id == 'idx1'
+        assert factory.find_node('dell71').obj_id == '1'
+        assert [o.obj_id for o in factory.find_objects('idx*')] == ['idx1']
+        factory.rename('idx1', 'idx2')
+        assert factory.find_object('idx1') is None
+        assert factory.find_object('idx2') is not None
+        factory.delete('idx2')
+        assert factory.find_object('idx2') is None
+    finally:
+        factory._pop_state()
+    assert factory.find_object('idx1') is None
+    assert factory.find_node('dell71') is None
+
+
+def test_find_xml_node():
+    "The element index follows edits and rollback"
+    from unittest import mock
+    factory._push_state()
+    try:
+        obj = factory.create_from_cli('primitive xidx1 Dummy')
+        assert factory.find_xml_node('primitive', 'xidx1') is obj.node
+        assert factory.find_xml_node('rsc_defaults', 'rsc-options') is not None
+        factory.rename('xidx1', 'xidx2')
+        assert factory.find_xml_node('primitive', 'xidx1', strict=False) is None
+        assert factory.find_xml_node('primitive', 'xidx2') is obj.node
+    finally:
+        factory._pop_state()
+    assert factory.find_xml_node('primitive', 'xidx2', strict=False) is None
+    # a lookup of an absent element does not reindex
+    with mock.patch.object(factory, '_build_xml_index') as mock_build:
+        assert factory.find_xml_node('primitive', 'nosuchid', strict=False) is None
+        assert not mock_build.called
+    for obj in factory.cib_objects:
+        assert obj.node.getparent() is not None
+        assert obj.node.getroottree().getroot() is factory.cib_elem
+
+
+def test_rollback_journal():
+    "Rollback restores objects, XML and references touched in a transaction"
+    factory._push_state()
+    try:
+        for cli in ('primitive jr1 Dummy',
+                    'primitive jr2 Dummy',
+                    'group jrg jr1 jr2',
+                    'location jrl jrg 100: node1'):
+            assert factory.create_from_cli(cli) is not None
+        before = factory.cib_elem.xpath("//*[@id='jrg']")[0]
+        before = etree.tostring(before)
+        n_objects = len(factory.cib_objects)
+        factory._push_state()
+        try:
+            factory.rename('jr2', 'jr3')
+            factory.delete('jrg')
+            assert factory.find_object('jrg') is None
+        finally:
+            factory._pop_state()
+        assert len(factory.cib_objects) == n_objects
+        jrg = factory.find_object('jrg')
+        assert [c.obj_id for c in jrg.children] == ['jr1', 'jr2']
+        assert jrg.node is factory.find_xml_node('group', 'jrg')
+        assert etree.tostring(jrg.node) == before
+        for child in jrg.children:
+            assert child.parent is jrg
+            assert child.node.getparent() is jrg.node
+        assert [o.obj_id for o in factory.related_constraints(jrg)] == ['jrl']
+    finally:
+        factory._pop_state()
+    assert factory.find_object('jr1') is None
+    assert factory.find_xml_node('group', 'jrg', strict=False) is None
+
+
+def _rollback_state():
+    objs = sorted((o.obj_id, o.updated, o.parent and o.parent.obj_id,
+                   tuple(c.obj_id for c in o.children)) for o in factory.cib_objects)
+    return etree.tostring(factory.cib_elem), objs
+
+
+def _random_edit(rnd, n):
+    prims = [o.obj_id for o in factory.cib_objects if o.obj_type == 'primitive']
+    top = [x for x in prims if not factory.find_object(x).parent]
+    rscs = [o.obj_id for o in factory.cib_objects
+            if o.obj_type in ('primitive', 'group', 'clone') and not o.parent]
+    groups = [o for o in factory.cib_objects if o.obj_type == 'group' and len(o.children) > 1]
+    k = rnd.randrange(9)
+    if k == 0:
+        factory.create_from_cli('primitive rbp%d Dummy' % n)
+    elif k == 1 and len(top) >= 2:
+        factory.create_from_cli('group rbg%d %s' % (n, ' '.join(rnd.sample(top, 2))))
+    elif k == 2 and rscs:
+        factory.delete(rnd.choice(rscs))
+    elif k == 3 and rscs:
+        factory.rename(rnd.choice(rscs), 'rbr%d' % n)
+    elif k == 4 and len(rscs) >= 2:
+        factory.create_from_cli('colocation rbc%d inf: %s' % (n, ' '.join(rnd.sample(rscs, 2))))
+    elif k == 5 and top:
+        factory.create_from_cli('clone rbcl%d %s' % (n, rnd.choice(top)))
+    elif k == 6 and prims:
+        factory.create_from_cli('tag rbt%d %s' % (n, rnd.choice(prims)))
+    elif k == 7 and groups:
+        g = rnd.choice(groups)
+        kids = [c.obj_id for c in g.children][1:]
+        elem, _, _ = cibconfig.parse_cli_to_xml('group %s %s' % (g.obj_id, ' '.join(kids)))
+        factory.update_from_cli(g, elem, 'replace')
+    elif k == 8:
+        factory.create_from_cli('property rbprop=%d' % n)
+
+
+def test_rollback_restores_cib():
+    "Rollback restores the CIB exactly, including the order of elements"
+    import random
+    for seed in range(20):
+        rnd = random.Random(seed)
+        factory._push_state()
+        try:
+            for cli in ('primitive rbA Dummy', 'primitive rbB Dummy',
+                        'primitive rbC Dummy', 'primitive rbD Dummy',
+                        'group rbG rbC rbD'):
+                assert factory.create_from_cli(cli) is not None
+            for obj in factory.cib_objects:
+                obj.updated = False
+            before = _rollback_state()
+            factory._push_state()
+            if seed == 0:
+                factory.create_from_cli('group rbH rbA rbB')
+            for n in range(rnd.randint(1, 10)):
+                if rnd.random() < 0.2:
+                    # an inner transaction, kept or rolled back
+                    factory._push_state()
+                    _random_edit(rnd, 100 + n)
+                    if rnd.random() < 0.5:
+                        factory._pop_state()
+                    else:
+                        factory._drop_state()
+                else:
+                    _random_edit(rnd, n)
+            factory._pop_state()
+            assert _rollback_state() == before, seed
+        finally:
+            factory._pop_state()
+
+
+def test_related_elements():
+    "The reverse reference graph answers related_* queries"
+    factory._push_state()
+    try:
+        for cli in ('primitive rg1 Dummy',
+                    'primitive rg2 Dummy',
+                    'group rgg rg1',
+                    'tag rgt rg2',
+                    'colocation rgc inf: rg2 rgg',
+                    'order rgo Mandatory: rg2 rgg'):
+            assert factory.create_from_cli(cli) is not None
+        rg2 = factory.find_object('rg2')
+        assert [o.obj_id for o in factory.related_constraints(rg2)] == ['rgc', 'rgo']
+        assert [o.obj_id for o in factory.related_tags(rg2)] == ['rgt']
+        rg1 = factory.find_object('rg1')
+        assert [o.obj_id for o in factory.related_elements(rg1)] == ['rgg']
+        factory.rename('rgg', 'rgh')
+        rgh = factory.find_object('rgh')
+        assert [o.obj_id for o in factory.related_constraints(rgh)] == ['rgc', 'rgo']
+        factory.rename('rg1', 'rg3')
+        rg3 = factory.find_object('rg3')
+        assert [o.obj_id for o in factory.related_elements(rg3)] == ['rgh']
+        factory.delete('rgc')
+        assert [o.obj_id for o in factory.related_constraints(rg2)] == ['rgo']
+    finally:
+        factory._pop_state()
+
+
+def _apply_patchset(cib, diff):
+    "Apply a v2 patch the way the CIB does"
+    for change in diff:
+        path = change.get('path')
+        match = cib.xpath(path)[0] if path != '/cib' else cib
+        op = change.get('operation')
+        if op == 'delete':
+            match.getparent().remove(match)
+        elif op == 'create':
+            match.insert(int(change.get('position')), copy.deepcopy(change[0]))
+        elif op == 'modify':
+            match.attrib.clear()
+            match.attrib.update(dict(change.find('change-result')[0].items()))
+
+
+def test_cib_patchset():
+    "Native v2 patches turn the original CIB into the new one"
+    from crmsh import xmlutil
+    orig = etree.fromstring('''<cib epoch="1" num_updates="2" admin_epoch="0" validate-with="pacemaker-2.0">
+  <configuration>
+    <crm_config/>
+    <nodes><node id="1" uname="n1"/></nodes>
+    <resources>
+      <primitive id="p1" class="ocf" provider="heartbeat" type="Dummy">
+        <!--a comment-->
+        <operations><op id="p1-monitor" name="monitor" interval="10s"/></operations>
+      </primitive>
+      <primitive id="p2" class="ocf" provider="heartbeat" type="Dummy"/>
+      <group id="g1"><primitive id="p3" class="ocf" provider="heartbeat" type="Dummy"/>
+        <primitive id="p4" class="ocf" provider="heartbeat" type="Dummy"/></group>
+    </resources>
+    <constraints/>
+  </configuration>
+</cib>''', etree.XMLParser(remove_blank_text=True))
+    new = copy.deepcopy(orig)
+    new.set('epoch', '5')
+    p1 = new.xpath("//primitive[@id='p1']")[0]
+    p1.set('type', 'Stateful')
+    p1.find('operations/op').set('interval', '20s')
+    p2 = new.xpath("//primitive[@id='p2']")[0]
+    p2.getparent().remove(p2)
+    g1 = new.xpath("//group[@id='g1']")[0]
+    g1.insert(0, g1[1])
+    etree.SubElement(new.find('configuration/resources'), 'primitive', id='p5', type='Dummy')
+
+    diff = xmlutil.cib_patchset(orig, new)
+    assert diff.get('format') == '2'
+    ops = [(c.get('operation'), c.get('path')) for c in diff]
+    assert ('modify', '/cib') not in ops
+    assert ('delete', "/cib/configuration/resources/primitive[@id='p2']") in ops
+    assert ('modify', "/cib/configuration/resources/primitive[@id='p1']") in ops
+    assert len(diff) == 6
+    _apply_patchset(orig, diff)
+    orig.set('epoch', '5')
+    assert etree.tostring(orig) == etree.tostring(new)
+
+    # comments can't be addressed: replace the element holding them
+    orig = copy.deepcopy(new)
+    new.xpath("//primitive[@id='p1']")[0][0].text = 'another comment'
+    diff = xmlutil.cib_patchset(orig, new)
+    assert [(c.get('operation'), c.get('path')) for c in diff] == [
+        ('delete', "/cib/configuration/resources/primitive[@id='p1']"),
+        ('create', "/cib/configuration/resources")]
+    _apply_patchset(orig, diff)
+    assert etree.tostring(orig) == etree.tostring(new)
+    assert len(xmlutil.cib_patchset(orig, new)) == 0
+
+
+def test_refresh_after_commit():
+    "Reload the CIB after commit only if somebody else changed it"
+    from unittest import mock
+    cib_orig, cib_attrs = factory.cib_orig, dict(factory.cib_elem.attrib)
+    loaded = factory._loaded_version
+    factory._loaded_version = (factory.cib_attrs.get('admin_epoch'), factory.cib_attrs.get('epoch', '0'))
+    version = etree.Element('cib', factory.cib_attrs)
+    version.set('epoch', str(int(factory.cib_attrs.get('epoch', '0')) + 1))
+    factory._push_state()
+    try:
+        obj = factory.create_from_cli('primitive rac1 Dummy')
+        with mock.patch('crmsh.cibconfig.cibversion2elem', return_value=version), \
+                mock.patch.object(factory, 'refresh') as mock_refresh, \
+                mock.patch.object(factory, '_clean_state'):
+            factory._commit_version = factory._expected_version(1)
+            factory._refresh_after_commit()
+            assert not mock_refresh.called
+            assert obj.origin == 'cib'
+            assert factory.cib_elem.get('epoch') == version.get('epoch')
+            assert factory.cib_orig.find("configuration//primitive[@id='rac1']") is not None
+            # somebody else committed too
+            factory._commit_version = factory._expected_version(1)
+            factory._refresh_after_commit()
+            assert mock_refresh.called
+    finally:
+        factory._pop_state()
+        factory.cib_orig = cib_orig
+        factory._loaded_version = loaded
+        factory.cib_elem.attrib.clear()
+        factory.cib_elem.attrib.update(cib_attrs)
+
+
+def test_commit_after_foreign_change():
+    "A commit based on an outdated CIB reloads it afterwards"
+    from unittest import mock
+    cib_orig, cib_attrs = factory.cib_orig, dict(factory.cib_elem.attrib)
+    loaded = factory._loaded_version
+    factory.cib_orig = copy.deepcopy(factory.cib_elem)
+    factory._loaded_version = ('0', '7')
+    current = etree.Element('cib', factory.cib_attrs)
+    current.set('admin_epoch', '0')
+    current.set('epoch', '7')
+    factory._push_state()
+    try:
+        factory.create_from_cli('primitive rac2 Dummy')
+        with mock.patch('crmsh.cibconfig.cibversion2elem', return_value=current), \
+                mock.patch('crmsh.cibconfig.cibadmin_can_patch_v2', return_value=True), \
+                mock.patch.object(factory, '_apply_patch', return_value=True):
+            assert factory._patch_cib(False)
+            assert factory._commit_version == ('0', '8')
+            # somebody else changed the configuration since we loaded it
+            factory._commit_version = None
+            current.set('epoch', '8')
+            assert factory._patch_cib(False)
+            assert factory._commit_version is None
+    finally:
+        factory._pop_state()
+        factory.cib_orig = cib_orig
+        factory._loaded_version = loaded
+        factory.cib_elem.attrib.clear()
+        factory.cib_elem.attrib.update(cib_attrs)
+
+
+def test_cibtext2elem_nostatus():
+    "The status section is dropped while parsing"
+    from crmsh import xmlutil
+    ops = ''.join('<lrm_rsc_op id="op%d" operation="monitor"/>' % i for i in range(50))
+    text = '''<cib epoch="3" admin_epoch="0">
+  <configuration><nodes><node id="1" uname="n1"/></nodes></configuration>
+  <status><node_state id="1"><lrm><lrm_resources><lrm_resource id="r1">%s</lrm_resource>
+  </lrm_resources></lrm></node_state></status>
+</cib>''' % ops
+    cib = xmlutil.cibtext2elem_nostatus(text)
+    assert cib.tag == 'cib' and cib.get('epoch') == '3'
+    assert cib.find('status') is None
+    assert cib.find('configuration/nodes/node').get('uname') == 'n1'
+    assert xmlutil.cibtext2elem_nostatus('<cib><configuration>') is None
+
+
+def test_cib_query_cache():
+    "Repeated CIB reads are served from memory while the version stays"
+    from unittest import mock
+    from crmsh import config, xmlutil
+    cib = {'version': ('0', '3', '5')}
+    calls = []
+
+    def text():
+        return '<cib admin_epoch="%s" epoch="%s" num_updates="%s"><configuration>' \
+            '<nodes/><resources/></configuration><status/></cib>' % cib['version']
+
+    def sudocall(cmd):
+        calls.append(cmd)
+        if cmd.endswith('--no-children'):
+            return 0, '<cib admin_epoch="%s" epoch="%s" num_updates="%s"/>' % cib['version'], ''
+        if cmd.endswith('-o resources'):
+            return 0, '<resources/>', ''
+        return 0, text(), ''
+    version_cmd = xmlutil.cib_dump + ' --xpath /cib --no-children'
+    xmlutil.cib_query_cache_clear()
+    try:
+        with mock.patch('crmsh.xmlutil.sudocall', side_effect=sudocall):
+            assert xmlutil.cibdump2elem().get('num_updates') == '5'
+            assert calls == [xmlutil.cib_dump]
+            del calls[:]
+            assert xmlutil.cibdump2elem().get('num_updates') == '5'
+            assert xmlutil.cibdump2elem_nostatus().find('status') is None
+            assert calls == [version_cmd, version_cmd]
+            del calls[:]
+            cib['version'] = ('0', '3', '6')
+            assert xmlutil.cibdump2elem().get('num_updates') == '6'
+            assert calls == [version_cmd, xmlutil.cib_dump]
+            del calls[:]
+            assert xmlutil.cibdump2elem('resources').tag == 'resources'
+            assert xmlutil.cibdump2elem('resources').tag == 'resources'
+            assert calls == [version_cmd, version_cmd]
+            del calls[:]
+            xmlutil.cib_query_cache_clear()
+            assert xmlutil.cibdump2elem('resources').tag == 'resources'
+            assert calls == [xmlutil.cib_dump + ' -o resources']
+            del calls[:]
+            xmlutil.cibdump2elem()
+            assert calls == [xmlutil.cib_dump]
+            del calls[:]
+            with mock.patch.dict('os.environ', {'CIB_file': '/nonexistent/cib.xml'}):
+                xmlutil.cibdump2elem()
+            assert calls == [xmlutil.cib_dump]
+            del calls[:]
+            user = config.core.user
+            config.core.user = 'hacluster'
+            try:
+                xmlutil.cibdump2elem()
+            finally:
+                config.core.user = user
+            assert calls == [xmlutil.cib_dump]
+    finally:
+        xmlutil.cib_query_cache_clear()
+
+
+def test_rsc_state_snapshot():
+    "The running state of any number of resources comes from one crm_mon run"
+    from unittest import mock
+    from crmsh import xmlutil
+    conf = etree.fromstring('''<configuration><resources>
+  <primitive id="r1" class="ocf" provider="pacemaker" type="Dummy"/>
+  <primitive id="r2" class="ocf" provider="pacemaker" type="Dummy"/>
+  <group id="g1"><primitive id="g1a" class="ocf" provider="pacemaker" type="Dummy"/></group>
+  <clone id="c1"><group id="g2"><primitive id="g2a" class="ocf" provider="pacemaker" type="Dummy"/></group></clone>
+</resources></configuration>''')
+    mon = '''<?xml version="1.0"?>
+<pacemaker-result api-version="2.2" request="crm_mon --output-as=xml">
+  <resources>
+    <resource id="r1" role="Started" active="true" nodes_running_on="1"/>
+    <resource id="r2" role="Stopped" active="false" nodes_running_on="0"/>
+    <group id="g1" number_resources="1">
+      <resource id="g1a" role="Stopped" active="false" nodes_running_on="0"/>
+    </group>
+    <clone id="c1" multi_state="false" unique="false">
+      <group id="g2:0" number_resources="1">
+        <resource id="g2a" role="Started" active="true" nodes_running_on="1"/>
+      </group>
+    </clone>
+  </resources>
+  <status code="0" message="OK"/>
+</pacemaker-result>'''
+    with mock.patch('crmsh.xmlutil.cibdump2elem', return_value=conf), \
+            mock.patch('crmsh.xmlutil.is_live_cib', return_value=True), \
+            mock.patch('crmsh.xmlutil.get_stdout', return_value=(0, mon)) as mock_stdout:
+        rscstate = xmlutil.RscState()
+        assert [x for x in ("r1", "r2", "g1", "g1a", "c1", "g2", "g2a")
+                if rscstate.is_running(x)] == ["r1", "c1", "g2", "g2a"]
+        assert mock_stdout.call_count == 1
+        assert rscstate.rsc2node("g2a").getparent().get("id") == "g2"
+        assert rscstate.rsc_clone("g2a") == "c1"
+        assert not rscstate.can_delete("r1") and rscstate.can_delete("r2")
+
+    # no crm_mon XML: ask crm_resource
+    def get_stdout(cmd, stderr_on=True):
+        if cmd.startswith("crm_mon"):
+            return 1, ""
+        return 0, "resource r1 is running on: n1"
+    with mock.patch('crmsh.xmlutil.cibdump2elem', return_value=conf), \
+            mock.patch('crmsh.xmlutil.is_live_cib', return_value=True), \
+            mock.patch('crmsh.xmlutil.get_stdout', side_effect=get_stdout) as mock_stdout:
+        assert xmlutil.RscState().is_running("r1")
+        assert mock_stdout.call_args[0][0] == "crm_resource -W -r 'r1'"
+
+
+def test_repr_cli_cache():
+    "The CLI text is cached until the object is updated"
+    from unittest import mock
+    factory._push_state()
+    try:
+        obj = factory.create_from_cli('primitive rcc1 Dummy params state=/tmp/a')
+        text = obj.repr_cli(format_mode=-1)
+        with mock.patch.object(type(obj), '_render_cli') as mock_render:
+            assert obj.repr_cli(format_mode=-1) == text
+            assert not mock_render.called
+        obj.node.find('instance_attributes/nvpair').set('value', '/tmp/b')
+        obj.set_updated()
+        assert obj.repr_cli(format_mode=-1) == text.replace('/tmp/a', '/tmp/b')
+        from crmsh import utils
+        with utils.obscure(['state']):
+            assert '******' in obj.repr_cli(format_mode=-1)
+        assert '/tmp/b' in obj.repr_cli(format_mode=-1)
+    finally:
+        factory._pop_state()
+
+
+def test_repr_cli_after_member_delete():
+    "Groups and tags are shown without the members deleted from them"
+    factory._push_state()
+    try:
+        for cli in ['primitive rmd1 Dummy', 'primitive rmd2 Dummy', 'primitive rmd3 Dummy',
+                    'group grmd rmd1 rmd2 rmd3', 'tag trmd rmd1 rmd2 rmd3']:
+            factory.create_from_cli(cli)
+        group = factory.find_object('grmd')
+        tag = factory.find_object('trmd')
+        assert group.repr_cli(format_mode=-1) == 'group grmd rmd1 rmd2 rmd3'
+        assert tag.repr_cli(format_mode=-1) == 'tag trmd rmd1 rmd2 rmd3'
+        group.reset_updated()
+        tag.reset_updated()
+        assert factory.delete('rmd3')
+        assert group.updated and tag.updated
+        assert group.repr_cli(format_mode=-1) == 'group grmd rmd1 rmd2'
+        assert tag.repr_cli(format_mode=-1) == 'tag trmd rmd1 rmd2'
+        assert factory.delete('rmd1')
+        assert group.repr_cli(format_mode=-1) == 'group grmd rmd2'
+        assert tag.repr_cli(format_mode=-1) == 'tag trmd rmd2'
+    finally:
+        factory._pop_state()
+
+
+def test_bulk_load():
+    "Large loads postpone the CLI validation but end up with the same objects"
+    n = cibconfig._BULK_CREATE_MIN
+    lines = ["primitive bl%d Dummy params state=/tmp/bl%d" % (i, i) for i in range(n)]
+    lines.append("group gbl bl0 bl1")
+    lines.append("location lbl gbl 100: ha-one")
+    lines.append("property bulk-test=yes")
+    factory._push_state()
+    try:
+        assert cibconfig.mkset_obj().save('\n'.join(lines), remove=False, method='update')
+        for i in range(n):
+            assert factory.find_resource("bl%d" % i) is not None
+        grp = factory.find_resource("gbl")
+        assert [x.obj_id for x in grp.children] == ["bl0", "bl1"]
+        assert factory.find_resource("bl0").parent is grp
+        assert factory.related_constraints(grp)[0].obj_id == "lbl"
+        obj = factory.find_resource("bl5")
+        assert obj._cli_pending
+        assert not obj.nocli
+        assert not obj._cli_pending
+        assert "/tmp/bl5" in obj.repr_cli(format_mode=-1)
+    finally:
+        factory._pop_state()
+    assert factory.find_resource("bl0") is None
+
+
+def test_prefetch_ra_meta(capsys):
+    "The meta-data is fetched up front, once for each agent"
+    from unittest import mock
+    from crmsh import cache
+
+    def ra_meta(ra_class, ra_type, ra_provider):
+        print(".EXT meta-data %s" % ra_type)
+        return ['<resource-agent name="%s"><parameters/><actions/></resource-agent>' % ra_type]
+    nodes = [etree.fromstring('<primitive id="pf%d" class="ocf" provider="pacemaker" type="PfAgent%d"/>' % (i, i % 3))
+             for i in range(6)]
+    with mock.patch('crmsh.ra.ra_meta', side_effect=ra_meta) as mock_meta:
+        cibconfig.prefetch_ra_meta(nodes)
+        assert sorted(c[0] for c in mock_meta.call_args_list) == \
+            [("ocf", "PfAgent%d" % i, "pacemaker") for i in range(3)]
+        # the output of the fetch shows when the meta-data is used
+        assert ".EXT" not in capsys.readouterr().out
+        mock_meta.reset_mock()
+        cibconfig.prefetch_ra_meta(nodes)
+        for i in (2, 0, 1):
+            assert cibconfig.get_ra(nodes[i]).meta().get("name") == "PfAgent%d" % i
+            assert cache.is_cached("ra_meta-ocf:pacemaker:PfAgent%d" % i)
+        assert not mock_meta.called
+        out = capsys.readouterr().out.splitlines()
+        assert [l for l in out if l.startswith(".EXT")] == \
+            [".EXT meta-data PfAgent%d" % i for i in (2, 0, 1)]
+
+
+def test_filter_objects():
+    "and/or filter chains over the type and tag indexes"
+    def ids(*filters):
+        ok, objs = factory.filter_objects(filters)
+        assert ok
+        return [o.obj_id for o in objs]
+    factory._push_state()
+    try:
+        factory.create_object('primitive', 'fo-db1', 'Dummy')
+        factory.create_object('primitive', 'fo-db2', 'Dummy')
+        factory.create_object('primitive', 'fo-web', 'Dummy')
+        factory.create_object('group', 'fo-grp', 'fo-web')
+        factory.create_object('tag', 'fo-dbtag', 'fo-db1', 'fo-db2')
+        factory.create_object('tag', 'fo-webtag', 'fo-grp')
+        assert ids('type:primitive', 'and', 'tag:fo-db*') == ['fo-db1', 'fo-db2']
+        assert ids('type:primitive', 'and', 'fo-w*') == ['fo-web']
+        assert ids('type:group', 'or', 'tag:fo-dbtag') == ['fo-db1', 'fo-db2', 'fo-grp']
+        assert ids('tag:fo-*', 'and', 'type:group') == ['fo-grp']
+        assert ids('type:tag', 'and', 'fo-db*', 'or', 'fo-web') == ['fo-web', 'fo-dbtag']
+        assert factory.filter_objects(['type:primitive', 'and', 'fo-nosuch']) == (False, 'fo-nosuch')
+        factory.delete('fo-webtag')
+        assert ids('tag:fo-*') == ['fo-db1', 'fo-db2']
+        assert 'fo-webtag' not in [o.obj_id for o in factory.get_elems_on_type('type:tag')]
+    finally:
+        factory._pop_state()
+    assert factory.get_elems_on_tag('tag:fo-dbtag') == []
+
+
+def test_check_unique_clash():
+    "Primitives of the same agent may not share values of unique parameters"
+    from unittest import mock
+    meta = ('<resource-agent name="%s"><parameters>'
+            '<parameter name="ip" unique="1"/><parameter name="nic" unique="0"/>'
+            '</parameters><actions/></resource-agent>')
+
+    def ra_meta(ra_class, ra_type, ra_provider):
+        return [meta % ra_type]
+    factory._push_state()
+    try:
+        with mock.patch('crmsh.ra.ra_meta', side_effect=ra_meta):
+            factory.create_from_cli('primitive uc1 ocf:pacemaker:UcAgent params ip=10.0.0.1 nic=eth0')
+            factory.create_from_cli('primitive uc2 ocf:pacemaker:UcAgent params ip=10.0.0.2 nic=eth0')
+            factory.create_from_cli('rsc_template uct ocf:pacemaker:UcOther')
+            factory.create_from_cli('primitive uc3 @uct params ip=10.0.0.1')
+            all_set = cibconfig.mkset_obj()
+            assert cibconfig.mkset_obj('uc1', 'uc2', 'uc3')._check_unique_clash(all_set) == 0
+            factory.create_from_cli('primitive uc4 ocf:pacemaker:UcAgent params ip=10.0.0.2')
+            all_set = cibconfig.mkset_obj()
+            assert cibconfig.mkset_obj('uc4')._check_unique_clash(all_set) == 2
+            assert cibconfig.mkset_obj('uc1')._check_unique_clash(all_set) == 0
+    finally:
+        factory._pop_state()
+
+
+def test_slotted_objects():
+    "Objects have no __dict__ and rollbacks restore their attributes"
+    factory._push_state()
+    try:
+        obj = factory.create_from_cli('primitive slt1 Dummy')
+        assert not hasattr(obj, '__dict__')
+        assert obj.parent_type == 'resources'
+        prop = factory.create_from_cli('rsc_defaults rsc-options2: resource-stickiness=1')
+        assert prop.parent_type == 'rsc_defaults'
+        factory._push_state()
+        try:
+            assert factory.rename('slt1', 'slt2')
+            assert obj.obj_id == 'slt2'
+        finally:
+            factory._pop_state()
+        assert obj.obj_id == 'slt1'
+        assert factory.find_object('slt1') is obj
+    finally:
+        factory._pop_state()
+
+
+def test_bulk_rename():
+    "All references to the renamed objects are rewritten"
+    factory._push_state()
+    try:
+        for cli in ('primitive brn-a Dummy',
+                    'primitive brn-b Dummy',
+                    'primitive brn-c Dummy',
+                    'primitive brn-st stonith:null params hostlist=ha-one',
+                    'group brn-g brn-a brn-c',
+                    'location brn-l1 brn-b 100: ha-one',
+                    'order brn-o1 Mandatory: brn-g brn-b',
+                    'colocation brn-c1 inf: brn-b ( brn-g brn-st )',
+                    'tag brn-t brn-a brn-b',
+                    'fencing_topology brn-st'):
+            assert factory.create_from_cli(cli) is not None, cli
+        renames = {'brn-a': 'brn-a2', 'brn-b': 'brn-b2',
+                   'brn-st': 'brn-st2', 'brn-g': 'brn-g2'}
+        assert factory.bulk_rename(renames)
+        for old_id, new_id in renames.items():
+            assert factory.find_object(old_id) is None
+            assert factory.find_object(new_id).obj_id == new_id
+        assert factory.find_object('brn-l1').node.get('rsc') == 'brn-b2'
+        o1 = factory.find_object('brn-o1').node
+        assert (o1.get('first'), o1.get('then')) == ('brn-g2', 'brn-b2')
+        c1 = factory.find_object('brn-c1').node
+        assert c1.xpath('resource_set/resource_ref/@id') == ['brn-b2', 'brn-g2', 'brn-st2']
+        assert factory.find_object('brn-t').node.xpath('obj_ref/@id') == ['brn-a2', 'brn-b2']
+        fencing = factory.find_object('fencing_topology').node
+        assert set(fencing.xpath('fencing-level/@devices')) == set(['brn-st2'])
+        group = factory.find_object('brn-g2')
+        assert [x.obj_id for x in group.children] == ['brn-a2', 'brn-c']
+        assert [x.obj_id for x in factory.related_constraints(factory.find_object('brn-b2'))] == \
+            ['brn-l1', 'brn-o1', 'brn-c1']
+
+        # nothing is renamed if one of the new ids is taken
+        assert not factory.bulk_rename({'brn-a2': 'brn-a3', 'brn-c': 'brn-b2'})
+        assert factory.find_object('brn-a2') is not None
+        assert factory.find_object('brn-a3') is None
+        assert factory.find_object('brn-t').node.xpath('obj_ref/@id') == ['brn-a2', 'brn-b2']
+        assert factory.check_structure()
+    finally:
+        factory._pop_state()
+
+
+def test_bulk_delete():
+    "Deleting many objects at once updates every referrer once"
+    factory._push_state()
+    try:
+        for cli in ('primitive bdl-d1 Dummy',
+                    'primitive bdl-d2 Dummy',
+                    'primitive bdl-d3 Dummy',
+                    'primitive bdl-d4 Dummy',
+                    'group bdl-g1 bdl-d2 bdl-d1',
+                    'clone bdl-c1 bdl-g1',
+                    'location bdl-l1 bdl-c1 100: ha-one',
+                    'colocation bdl-col1 inf: bdl-d1 bdl-d2 bdl-d3 bdl-d4',
+                    'order bdl-o1 Mandatory: bdl-d3 bdl-d4',
+                    'tag bdl-t1 bdl-d3 bdl-d4',
+                    'tag bdl-t2 bdl-d1 bdl-d2'):
+            assert factory.create_from_cli(cli) is not None, cli
+        # the group is the only child of the clone: both go and
+        # the location passes on to the first group member
+        assert factory.delete('bdl-g1')
+        assert factory.find_object('bdl-c1') is None
+        assert factory.find_object('bdl-l1').node.get('rsc') == 'bdl-d2'
+        assert factory.find_object('bdl-d1').parent is None
+
+        before = [str(x) for x in factory.cib_objects]
+        factory._push_state()
+        try:
+            assert factory.delete('bdl-d1', 'bdl-d2', 'bdl-d3')
+        finally:
+            factory._pop_state()
+        assert [str(x) for x in factory.cib_objects] == before
+        assert factory.find_object('bdl-t2').node.xpath('obj_ref/@id') == ['bdl-d1', 'bdl-d2']
+
+        assert factory.delete('bdl-d1', 'bdl-d2', 'bdl-d3')
+        for obj_id in ('bdl-d1', 'bdl-d2', 'bdl-d3', 'bdl-l1', 'bdl-o1', 'bdl-t2'):
+            assert factory.find_object(obj_id) is None, obj_id
+        assert factory.find_object('bdl-col1') is None
+        assert factory.find_object('bdl-t1').node.xpath('obj_ref/@id') == ['bdl-d4']
+        assert factory.related_constraints(factory.find_object('bdl-d4')) == []
+        assert factory.check_structure()
+    finally:
+        factory._pop_state()
+    for obj_id in ('bdl-d1', 'bdl-g1', 'bdl-c1', 'bdl-col1'):
+        assert factory.find_object(obj_id) is None
+
+
+def test_cib_cache():
+    "CLI validation results are kept for unchanged CIB files"
+    import os
+    import shutil
+    import tempfile
+    from unittest import mock
+    from crmsh import cibcache
+    tmpdir = tempfile.mkdtemp()
+    try:
+        cib_path = os.path.join(tmpdir, 'cib.xml')
+        cib = etree.fromstring('<cib epoch="1" num_updates="0" admin_epoch="0"><configuration/></cib>')
+        with open(cib_path, 'w') as f:
+            f.write(etree.tostring(cib, encoding='unicode'))
+        with mock.patch.object(cibcache, '_cache_dir', os.path.join(tmpdir, 'cache')), \
+                mock.patch.dict(os.environ, {'CIB_file': cib_path}):
+            assert cibcache.load(cib) is None
+            cibcache.save(cib, [('primitive', 'p1'), ('rsc_defaults', 'rsc-options')])
+            assert cibcache.load(cib) == set([('primitive', 'p1'), ('rsc_defaults', 'rsc-options')])
+            cib.set('epoch', '2')
+            assert cibcache.load(cib) is None
+            cib.set('epoch', '1')
+            with open(cib_path, 'a') as f:
+                f.write('\n')
+            assert cibcache.load(cib) is None
+            cibcache.save(cib, [])
+            assert cibcache.load(cib) == set()
+        # no file, no cache
+        with mock.patch.object(cibcache, '_cache_dir', os.path.join(tmpdir, 'cache')):
+            cibcache.save(cib, [])
+            assert cibcache.load(cib) is None
+            # neither for a directory
+            with mock.patch.dict(os.environ, {'CIB_file': tmpdir}):
+                cibcache.save(cib, [])
+                assert cibcache.load(cib) is None
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_populate_from_cib_cache():
+    "Objects found in the cache are not validated again"
+    from unittest import mock
+    cib = copy.deepcopy(factory.cib_elem)
+    obj_id = factory.get_elems_on_type('type:node')[0].obj_id
+    try:
+        factory.reset()
+        with mock.patch('crmsh.cibcache.load', return_value=set([('node', obj_id)])), \
+                mock.patch.object(cibconfig.CibObject, 'cli_use_validate') as mock_validate:
+            assert factory.initialize(cib=copy.deepcopy(cib))
+            assert not mock_validate.called
+        assert factory.find_object(obj_id).nocli
+        assert not any(x.nocli for x in factory.cib_objects if x.obj_id != obj_id)
+    finally:
+        factory.reset()
+        factory.initialize(cib=cib)
+
+
+def test_parse_lines_parallel():
+    "Parsing in worker processes gives the same elements and messages"
+    import io
+    from unittest import mock
+    from crmsh import config, msg, options
+    lines = ["# the first one",
+             "primitive pl0 Dummy params state=/tmp/pl0",
+             "primitive pl1 Dummy params $ID-REF=pl0",
+             "primitive pl2 Dummy op monitor interval=10s",
+             "location lpl pl0 100: ha-one",
+             "# the last one",
+             "rsc_defaults rpl: resource-stickiness=1",
+             "nosuchcommand pl4"]
+
+    def run():
+        out = io.StringIO()
+        factory._push_state()
+        try:
+            with mock.patch.object(msg, 'ERR_STREAM', out), \
+                    mock.patch.object(options, 'regression_tests', False):
+                msg.err_buf.start_tmp_lineno()
+                nodes = list(cibconfig.parse_lines(lines))
+                msg.err_buf.stop_tmp_lineno()
+        finally:
+            factory._pop_state()
+        return [etree.tostring(n) if isinstance(n, etree._Element) else n for n in nodes], \
+            out.getvalue()
+
+    serial = run()
+    used = []
+
+    def parse_parallel(*args):
+        used.append(real_parse_parallel(*args))
+        return used[-1]
+    real_parse_parallel = cibconfig._parse_parallel
+    workers = config.core.parse_workers
+    config.core.parse_workers = '3'
+    try:
+        with mock.patch.object(cibconfig, '_PARALLEL_PARSE_MIN', 1), \
+                mock.patch('os.cpu_count', return_value=4), \
+                mock.patch.object(cibconfig, '_parse_parallel', parse_parallel):
+            parallel = run()
+    finally:
+        config.core.parse_workers = workers
+    assert len(used) == 1 and len(used[0]) == 5 and 2 not in used[0]
+    assert parallel == serial
+    assert b'the first one' in serial[0][1] and b'the last one' in serial[0][6]
+    assert serial[0][0] is None and serial[0][7] is False
+    assert "8: syntax" in serial[1]
+
+
+def test_parse_parallel_worker_failure():
+    "Chunks failing in a worker are left to the parent"
+    import os
+    from unittest import mock
+    from crmsh import config, parse
+    lines = ["primitive pw%d Dummy" % i for i in range(8)]
+    parent = os.getpid()
+    real_parse = parse.parse
+
+    def worker_parse(s, **kwargs):
+        if os.getpid() != parent and s.startswith("primitive pw3 "):
+            raise RuntimeError("worker failure")
+        return real_parse(s, **kwargs)
+    workers = config.core.parse_workers
+    config.core.parse_workers = '2'
+    try:
+        with mock.patch.object(parse, 'parse', worker_parse), \
+                mock.patch.object(cibconfig, '_PARALLEL_PARSE_MIN', 1), \
+                mock.patch('os.cpu_count', return_value=2):
+            parsed = cibconfig._parse_parallel(lines, 2)
+            nodes = list(cibconfig.parse_lines(lines))
+    finally:
+        config.core.parse_workers = workers
+    assert parsed is not None and 3 not in parsed and 0 < len(parsed) < 8
+    assert [n.get('id') for n in nodes] == ["pw%d" % i for i in range(8)]
+    with mock.patch('concurrent.futures.ProcessPoolExecutor', side_effect=TypeError):
+        assert cibconfig._parse_parallel(lines, 2) is None
+
+
+def test_xml_digest():
+    "Structural digests compare like xml_equals"
+    from crmsh import xmlutil
+
+    def digest(s):
+        return xmlutil.xml_digest(etree.fromstring(s))
+    a = '<group id="g"><meta_attributes id="m"/><primitive id="p1"/><primitive id="p2"/></group>'
+    b = '<group id="g"><primitive id="p1"/><primitive id="p2"/><meta_attributes id="m"/></group>'
+    c = '<group id="g"><primitive id="p2"/><primitive id="p1"/><meta_attributes id="m"/></group>'
+    assert digest(a) == digest(b) != digest(c)
+    assert hash(digest(a)) == hash(digest(b))
+    s1 = '<rsc_order id="o"><resource_set id="s"><resource_ref id="r1"/><resource_ref id="r2"/></resource_set></rsc_order>'
+    s2 = '<rsc_order id="o"><resource_set id="s"><resource_ref id="r2"/><resource_ref id="r1"/></resource_set></rsc_order>'
+    assert digest(s1) != digest(s2)
+    n1 = '<nvpair id="n" name="a" value="1">\n  </nvpair>'
+    n2 = '<nvpair value="1" name="a" id="n"></nvpair>'
+    assert digest(n1) == digest(n2) != digest(n2.replace('"1"', '"2"'))
+    for x, y in ((a, b), (a, c), (s1, s2), (n1, n2)):
+        assert xmlutil.xml_equals(etree.fromstring(x), etree.fromstring(y)) == (digest(x) == digest(y))
+
+    # digests of unchanged objects are not computed again
+    obj = factory.find_object(factory.get_elems_on_type('type:node')[0].obj_id)
+    d = obj.digest()
+    from unittest import mock
+    with mock.patch('crmsh.cibconfig.xml_digest') as mock_digest:
+        assert obj.digest() == d
+        assert not mock_digest.called
+    updated = obj.updated
+    obj.node.set('description', 'digest')
+    try:
+        obj.updated = True
+        assert obj.digest() != d
+    finally:
+        del obj.node.attrib['description']
+        obj.updated = True
+        obj.updated = updated
+    assert obj.digest() == d
@@ -100,6 +100,40 @@ class TestBaseParser(unittest.TestCase):
         self.assertEqual(retdict['bug'], '')
         self.assertEqual(retdict['wiz'], 'fizz buzz')
 
+    def test_keywords(self):
+        self._reset('Params a=1')
+        self.assertTrue(self.base.try_match('params|meta'))
+        self.assertEqual(self.base.matched(0), 'Params')
+        self.assertFalse(self.base.try_match('params|meta'))
+        self.assertIsInstance(self.base._token_pattern('params|meta'), frozenset)
+        self.assertNotIsInstance(self.base._token_pattern('(%s):$' % 'a|b'), frozenset)
+        self._reset('op2')
+        self.assertFalse(self.base.try_match('op'))
+        self.assertEqual(self.base.match('op.'), 'op2')
+
+    def test_keywords_exact(self):
+        # keywords match whole tokens only; the former 'a|b$'
+        # regexes took any token starting with one of the words
+        # but the last
+        self._reset('paramsx a=1')
+        self.assertFalse(self.base.try_match('params|meta'))
+        self._reset('metax a=1')
+        self.assertFalse(self.base.try_match('meta|params'))
+        self._reset('META a=1')
+        self.assertTrue(self.base.try_match('meta|params'))
+
+    def test_split_line(self):
+        for s in ('primitive p1 Dummy params a=1',
+                  'primitive p1 Dummy params a="/x y" b="" c=""d',
+                  " a\tb\r\nc  ",
+                  "a='b c' d",
+                  'a=\\"b',
+                  'a=b\x0bc',
+                  'a=\u00e9\u00a0b',
+                  ''):
+            self.assertEqual(parse.split_line(s), shlex.split(s))
+        self.assertRaises(ValueError, parse.split_line, 'a="b')
+
 
 class TestCliParser(unittest.TestCase):
     def setUp(self):
@@ -141,6 +175,12 @@ class TestCliParser(unittest.TestCase):
         self.assertEqual(['bar'], out.xpath('instance_attributes/nvpair[@name="foo"]/@value'))
         self.assertEqual(['bang'], out.xpath('utilization/nvpair[@name="wiz"]/@value'))
 
+    def test_keyword_prefix(self):
+        # "metax" is not the meta keyword but an attribute name
+        out = self._parse('primitive p1 Dummy metax a=1')
+        self.assertEqual(out.xpath('meta_attributes'), [])
+        self.assertEqual(['metax', 'a'], out.xpath('instance_attributes/nvpair/@name'))
+
     def test_resources(self):
         out = self._parse('primitive www ocf:heartbeat:apache op monitor timeout=10s')
         self.assertEqual(out.get('id'), 'www')
@@ -0,0 +1,190 @@
+"""
+Unitary tests for the crm_mon XML status in crmsh/cmd_status.py
+"""
+
+import json
+from unittest import mock
+from crmsh import cmd_status
+from crmsh import clidisplay
+
+
+CRM_MON_XML = '''<?xml version="1.0"?>
+<pacemaker-result api-version="2.2" request="crm_mon --output-as=xml">
+  <summary>
+    <stack type="corosync"/>
+    <current_dc present="true" version="2.0.4" name="node1" id="1" with_quorum="true"/>
+    <last_update time="Mon Oct  5 10:00:00 2020"/>
+    <last_change time="Mon Oct  5 09:00:00 2020" user="root" client="cibadmin" origin="node1"/>
+    <nodes_configured number="3"/>
+    <resources_configured number="7" disabled="1" blocked="0"/>
+    <cluster_options stonith-enabled="true" maintenance-mode="false"/>
+  </summary>
+  <nodes>
+    <node name="node1" id="1" online="true" standby="false" maintenance="false" pending="false" unclean="false" type="member"/>
+    <node name="node2" id="2" online="true" standby="true" maintenance="false" pending="false" unclean="false" type="member"/>
+    <node name="node3" id="3" online="false" standby="false" maintenance="false" pending="false" unclean="false" type="member"/>
+  </nodes>
+  <resources>
+    <resource id="st" resource_agent="stonith:null" role="Started" active="true" managed="true" failed="false" nodes_running_on="1">
+      <node name="node1" id="1" cached="true"/>
+    </resource>
+    <resource id="off" resource_agent="ocf::pacemaker:Dummy" role="Stopped" target_role="Stopped" active="false" managed="true" failed="false" nodes_running_on="0"/>
+    <group id="g1" number_resources="2" managed="true" disabled="false">
+      <resource id="a" resource_agent="ocf::pacemaker:Dummy" role="Started" active="true" managed="true" failed="true" nodes_running_on="1">
+        <node name="node1" id="1" cached="true"/>
+      </resource>
+      <resource id="b" resource_agent="ocf::pacemaker:Dummy" role="Stopped" active="false" managed="true" failed="false" nodes_running_on="0"/>
+    </group>
+    <clone id="c1" multi_state="false" unique="false" managed="true" disabled="false" failed="false">
+      <resource id="d" resource_agent="ocf::pacemaker:Dummy" role="Started" active="true" managed="true" failed="false" nodes_running_on="1">
+        <node name="node1" id="1" cached="true"/>
+      </resource>
+      <resource id="d" resource_agent="ocf::pacemaker:Dummy" role="Started" active="true" managed="true" failed="false" nodes_running_on="1">
+        <node name="node2" id="2" cached="true"/>
+      </resource>
+      <resource id="d" resource_agent="ocf::pacemaker:Dummy" role="Stopped" active="false" managed="true" failed="false" nodes_running_on="0"/>
+    </clone>
+  </resources>
+  <failures>
+    <failure op_key="a_monitor_10000" node="node1" exitstatus="not running" exitreason="" exitcode="7" call="12" status="complete" last-rc-change="Mon Oct  5 09:30:00 2020" queued="0" exec="0" interval="10000" task="monitor"/>
+  </failures>
+  <status code="0" message="OK"/>
+</pacemaker-result>
+'''
+
+
+def test_model():
+    model = cmd_status.StatusModel.from_xml(CRM_MON_XML)
+    assert [n["name"] for n in model.nodes] == ["node1", "node2", "node3"]
+    assert [r.id for r in model.resources] == ["st", "off", "g1", "c1"]
+    g1 = model.resources[2]
+    assert g1.kind == "group" and [c.id for c in g1.children] == ["a", "b"]
+    assert g1.children[0].active and not g1.children[1].active
+    assert model.resources[0].nodes == ["node1"]
+    assert model.failures[0]["op_key"] == "a_monitor_10000"
+    assert cmd_status.StatusModel.from_xml("<html/>") is None
+    assert cmd_status.StatusModel.from_xml("not xml") is None
+
+
+def test_render():
+    model = cmd_status.StatusModel.from_xml(CRM_MON_XML)
+    with clidisplay.nopretty():
+        text = model.render()
+    lines = text.split('\n')
+    assert "  * Current DC: node1 (version 2.0.4) - partition with quorum" in lines
+    assert "  * Last change:  Mon Oct  5 09:00:00 2020 by root via cibadmin on node1" in lines
+    assert "  * 7 resource instances configured (1 DISABLED)" in lines
+    assert "  * Node node2: standby" in lines
+    assert "  * Online: [ node1 ]" in lines
+    assert "  * OFFLINE: [ node3 ]" in lines
+    assert "  * st\t(stonith:null):\t Started node1" in lines
+    assert "  * off\t(ocf::pacemaker:Dummy):\t Stopped (disabled)" in lines
+    assert "  * Resource Group: g1:" in lines
+    assert "    * a\t(ocf::pacemaker:Dummy):\t FAILED node1" in lines
+    assert "  * Clone Set: c1 [d]:" in lines
+    assert "    * Started: [ node1 node2 ]" in lines
+    assert "    * Stopped: 1 instance" in lines
+    assert any(l.startswith("  * a_monitor_10000 on node1 'not running' (7)") for l in lines)
+
+
+def test_filtered():
+    model = cmd_status.StatusModel.from_xml(CRM_MON_XML)
+    m = model.filtered(["g*"])
+    assert [r.id for r in m.resources] == ["g1"]
+    assert len(m.nodes) == 3
+    assert [f["op_key"] for f in m.failures] == ["a_monitor_10000"]
+    m = model.filtered(["node2"])
+    assert [n["name"] for n in m.nodes] == ["node2"]
+    assert [r.id for r in m.resources] == ["c1"]
+    assert m.failures == []
+    # the resource of a failed action is not the op_key up to
+    # the second last '_'
+    xml = CRM_MON_XML.replace('op_key="a_monitor_10000"', 'op_key="st_migrate_to_0"').replace(
+        'interval="10000" task="monitor"', 'interval="0" task="migrate_to"')
+    m = cmd_status.StatusModel.from_xml(xml).filtered(["st"])
+    assert [f["op_key"] for f in m.failures] == ["st_migrate_to_0"]
+    assert cmd_status._failure_rsc({"op_key": "my_rsc_migrate_from_0"}) == "my_rsc"
+    assert cmd_status._failure_rsc({"op_key": "my_rsc_monitor_10000"}) == "my_rsc"
+
+
+def test_json():
+    model = cmd_status.StatusModel.from_xml(CRM_MON_XML)
+    d = json.loads(model.to_json())
+    assert d["summary"]["current_dc"]["name"] == "node1"
+    assert d["resources"][2]["children"][0] == {
+        "type": "primitive", "id": "a", "resource_agent": "ocf::pacemaker:Dummy",
+        "role": "Started", "active": "true", "managed": "true", "failed": "true",
+        "nodes_running_on": "1", "nodes": ["node1"]}
+
+
+@mock.patch('crmsh.utils.page_string')
+@mock.patch('crmsh.cmd_status.crm_mon')
+@mock.patch('crmsh.cmd_status._init_crm_mon')
+def test_cmd_status(mock_init, mock_crm_mon, mock_page):
+    mock_crm_mon.return_value = (0, CRM_MON_XML)
+    assert cmd_status.cmd_status(["json", "st"])
+    assert [r["id"] for r in json.loads(mock_page.call_args[0][0])["resources"]] == ["st"]
+    # patterns select from the status rendered by crmsh
+    with clidisplay.nopretty():
+        assert cmd_status.cmd_status(["c*", "g1"])
+    lines = mock_page.call_args[0][0].split('\n')
+    assert "Full List of Resources:" in lines
+    assert "  * Clone Set: c1 [d]:" in lines
+    assert "    * Started: [ node1 node2 ]" in lines
+    assert "    * Stopped: 1 instance" in lines
+    assert "Failed Resource Actions:" in lines
+    assert any(l.startswith("  * a_monitor_10000 on node1 'not running' (7)") for l in lines)
+    assert "  * st\t(stonith:null):\t Started node1" not in lines
+    # the usual view and the other views are made by crm_mon
+    mock_crm_mon.return_value = (0, "Node List:")
+    assert cmd_status.cmd_status([])
+    mock_crm_mon.assert_called_with("-r")
+    assert "Node List:" in mock_page.call_args[0][0]
+    assert "Full List of Resources:" not in mock_page.call_args[0][0]
+    assert cmd_status.cmd_status(["inactive"])
+    mock_crm_mon.assert_called_with("-r")
+    assert cmd_status.cmd_status(["bynode"])
+    mock_crm_mon.assert_called_with("-n")
+    # option values are not patterns
+    assert cmd_status.cmd_status(["--exclude", "all", "--include", "resources"])
+    mock_crm_mon.assert_called_with("--exclude all --include resources")
+    assert cmd_status.cmd_status(["bynode", "--node", "n1"])
+    mock_crm_mon.assert_called_with("-n --node n1")
+
+
+def test_render_changes():
+    old = cmd_status.StatusModel.from_xml(CRM_MON_XML)
+    new_xml = CRM_MON_XML.replace(
+        'id="2" online="true" standby="true"', 'id="2" online="true" standby="false"').replace(
+        '<last_update time="Mon Oct  5 10:00:00 2020"/>', '<last_update time="Mon Oct  5 10:00:05 2020"/>')
+    with clidisplay.nopretty():
+        new = cmd_status.StatusModel.from_xml(new_xml)
+        assert cmd_status.StatusRenderer(new).render_changes(old) == "Node List:\n  * Node node2: Online"
+        new_xml = new_xml.replace('id="a" resource_agent="ocf::pacemaker:Dummy" role="Started" active="true" managed="true" failed="true"',
+                                  'id="a" resource_agent="ocf::pacemaker:Dummy" role="Started" active="true" managed="true" failed="false"')
+        new_xml = new_xml.replace('<failure op_key', '<x op_key')
+        text = cmd_status.StatusRenderer(cmd_status.StatusModel.from_xml(new_xml)).render_changes(new)
+    assert text.split('\n') == [
+        "Resources:",
+        "  * Resource Group: g1:",
+        "    * a\t(ocf::pacemaker:Dummy):\t Started node1",
+        "    * b\t(ocf::pacemaker:Dummy):\t Stopped",
+        "Failed Resource Actions: cleared"]
+
+
+@mock.patch('time.sleep')
+@mock.patch('builtins.print')
+@mock.patch('crmsh.cmd_status.crm_mon_model')
+@mock.patch('crmsh.xmlutil.cib_version')
+def test_watch_status(mock_version, mock_model, mock_print, mock_sleep):
+    mock_version.side_effect = [("0", "5", "1"), ("0", "5", "1"), ("0", "5", "2")]
+    mock_model.side_effect = lambda: cmd_status.StatusModel.from_xml(CRM_MON_XML)
+    mock_sleep.side_effect = [None, None, KeyboardInterrupt]
+    with clidisplay.nopretty():
+        assert cmd_status.cmd_status(["watch=5", "st"])
+    # crm_mon runs only when the CIB changed, and an unchanged
+    # status is not shown again
+    assert mock_model.call_count == 2
+    assert mock_print.call_count == 1
+    assert "Full List of Resources:\n  * st\t" in mock_print.call_args[0][0]
+    mock_sleep.assert_called_with(5.0)
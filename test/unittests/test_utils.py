@@ -1537,3 +1537,45 @@ def test_check_all_nodes_reachable(mock_run, mock_ping):
     utils.check_all_nodes_reachable()
     mock_run.assert_called_once_with("crm_node -l")
     mock_ping.assert_called_once_with("15sp2-1")
+
+
+@mock.patch("crmsh.utils.can_ask")
+@mock.patch("crmsh.utils.get_winsize")
+@mock.patch("subprocess.Popen")
+def test_page_gen_lines(mock_popen, mock_winsize, mock_can_ask, capsys):
+    mock_winsize.return_value = (80, 3)
+    mock_can_ask.return_value = True
+    pager = config.core.pager
+    config.core.pager = "less"
+    rendered = []
+
+    def gen(n):
+        for i in range(n):
+            rendered.append(i)
+            yield "line %d" % i
+
+    # fits on the screen: printed, no pager
+    utils.page_gen_lines(gen(2))
+    assert capsys.readouterr().out == "line 0\nline 1\n"
+    assert not mock_popen.called
+
+    # too long: everything goes to the pager
+    utils.page_gen_lines(gen(5))
+    stdin = mock_popen.return_value.stdin
+    written = b''.join(c[0][0] for c in stdin.write.call_args_list)
+    assert written == b''.join(b"line %d\n" % i for i in range(5))
+
+    # the pager quits: stop generating
+    del rendered[:]
+    stdin.write.side_effect = IOError("[Errno 32] Broken pipe")
+    utils.page_gen_lines(gen(100))
+    assert len(rendered) == 3
+
+    # the pager runs as the configured user, like with page_string
+    user = config.core.user
+    config.core.user = "hacluster"
+    stdin.write.side_effect = None
+    utils.page_gen_lines(gen(5))
+    assert mock_popen.call_args[0][0] == "sudo -E -u hacluster less -R"
+    config.core.user = user
+    config.core.pager = pager